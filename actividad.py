@@ -0,0 +1,132 @@
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime
+
+from database import db
+from models import ActivityLog
+
+logger = logging.getLogger(__name__)
+
+TAMANO_LOTE = 100          # filas por INSERT
+INTERVALO_ESCRITURA = 2.0  # segundos máximos que un evento espera en la cola
+TAMANO_MAXIMO_COLA = 10000
+
+
+class RegistroActividad:
+    """Escribe el registro de actividad en segundo plano y por lotes.
+
+    Los eventos se encolan en memoria y un hilo del proceso los inserta con
+    un único INSERT de varias filas cuando se juntan TAMANO_LOTE eventos o
+    pasa INTERVALO_ESCRITURA. El hilo se crea con el primer evento de cada
+    proceso, así que funciona igual tras el fork de los workers de gunicorn.
+    Si la cola se llena, el evento se escribe de forma síncrona; al terminar
+    el proceso se vacía la cola antes de salir.
+    """
+
+    def __init__(self, app, tamano_lote=TAMANO_LOTE, intervalo=INTERVALO_ESCRITURA,
+                 tamano_cola=TAMANO_MAXIMO_COLA):
+        self.app = app
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self.tamano_cola = tamano_cola
+        self._lock = threading.Lock()
+        self._pid = None
+        self._cola = None
+        self._hilo = None
+        atexit.register(self.cerrar)
+
+    def registrar(self, user_id, action, details=None):
+        """Encola un evento; la marca de tiempo es la del momento de la acción"""
+        evento = {
+            'user_id': user_id,
+            'action': action,
+            'details': details,
+            'timestamp': datetime.utcnow(),
+        }
+        self._asegurar_hilo()
+        try:
+            self._cola.put_nowait(evento)
+        except queue.Full:
+            logger.warning("Cola del registro de actividad llena, escribiendo de forma síncrona")
+            self._escribir([evento])
+
+    def _asegurar_hilo(self):
+        if self._pid == os.getpid() and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Proceso nuevo (o hijo de un fork): la cola heredada es del padre
+                self._pid = os.getpid()
+                self._cola = queue.Queue(maxsize=self.tamano_cola)
+                self._hilo = None
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._trabajar, name='registro-actividad', daemon=True)
+                self._hilo.start()
+
+    def _trabajar(self):
+        while True:
+            evento = self._cola.get()
+            if evento is None:
+                return
+            lote = [evento]
+            limite = time.monotonic() + self.intervalo
+            detener = False
+            while len(lote) < self.tamano_lote:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    evento = self._cola.get(timeout=restante)
+                except queue.Empty:
+                    break
+                if evento is None:
+                    detener = True
+                    break
+                lote.append(evento)
+            self._escribir(lote)
+            if detener:
+                return
+
+    def _escribir(self, lote):
+        """Inserta el lote en una transacción propia, sin tocar la sesión de la petición"""
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as conn:
+                    conn.execute(ActivityLog.__table__.insert(), lote)
+        except Exception as e:
+            if len(lote) == 1:
+                logger.error(f"Error logging activity: {str(e)}")
+                return
+            # Un evento inválido (p. ej. de un usuario ya eliminado) no debe perder el resto
+            logger.warning(f"Error al escribir un lote de {len(lote)} eventos de actividad, reintentando uno a uno: {str(e)}")
+            for evento in lote:
+                self._escribir([evento])
+
+    def vaciar(self):
+        """Escribe de inmediato los eventos pendientes en el hilo actual"""
+        if self._cola is None or self._pid != os.getpid():
+            return
+        pendientes = []
+        while True:
+            try:
+                evento = self._cola.get_nowait()
+            except queue.Empty:
+                break
+            if evento is not None:
+                pendientes.append(evento)
+        for inicio in range(0, len(pendientes), self.tamano_lote):
+            self._escribir(pendientes[inicio:inicio + self.tamano_lote])
+
+    def cerrar(self, timeout=5):
+        """Detiene el hilo y escribe lo que quede en la cola (registrado con atexit)"""
+        if self._hilo is not None and self._pid == os.getpid() and self._hilo.is_alive():
+            try:
+                self._cola.put(None, timeout=timeout)
+                self._hilo.join(timeout)
+            except queue.Full:
+                pass
+        self.vaciar()
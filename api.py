@@ -0,0 +1,291 @@
+import json
+import base64
+import logging
+import binascii
+from functools import wraps
+
+import click
+from flask import Blueprint, request, jsonify, g
+
+from database import db
+from models import User, ApiToken, Sede, Escaneo, Host, Vulnerabilidad
+from busqueda import aplicar_busqueda, relevancia_busqueda
+from filtros import aplicar_filtros
+from streaming import respuesta_en_streaming
+
+logger = logging.getLogger(__name__)
+
+api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+LIMITE_POR_DEFECTO = 100
+LIMITE_MAXIMO = 1000
+TAMANO_LOTE_STREAM = 1000
+
+# Campos expuestos por recurso. El primero de cada mapa es la clave del cursor.
+CAMPOS_SEDES = {
+    'id': Sede.id,
+    'nombre': Sede.nombre,
+    'descripcion': Sede.descripcion,
+    'activa': Sede.activa,
+    'fecha_creacion': Sede.fecha_creacion,
+}
+
+CAMPOS_ESCANEOS = {
+    'id': Escaneo.id,
+    'sede_id': Escaneo.sede_id,
+    'sede': Sede.nombre,
+    'fecha_escaneo': Escaneo.fecha_escaneo,
+    'fecha_creacion': Escaneo.fecha_creacion,
+}
+
+CAMPOS_HOSTS = {
+    'id': Host.id,
+    'ip': Host.ip,
+    'nombre_host': Host.nombre_host,
+    'escaneo_id': Host.escaneo_id,
+    'sede': Sede.nombre,
+    'fecha_escaneo': Escaneo.fecha_escaneo,
+}
+
+CAMPOS_HALLAZGOS = {
+    'id': Vulnerabilidad.id,
+    'host_id': Vulnerabilidad.host_id,
+    'ip': Host.ip,
+    'nombre_host': Host.nombre_host,
+    'escaneo_id': Host.escaneo_id,
+    'sede': Sede.nombre,
+    'fecha_escaneo': Escaneo.fecha_escaneo,
+    'oid': Vulnerabilidad.oid,
+    'nvt': Vulnerabilidad.nvt,
+    'nivel_amenaza': Vulnerabilidad.nivel_amenaza,
+    'cvss': Vulnerabilidad.cvss,
+    'puerto': Vulnerabilidad.puerto,
+    'estado': Vulnerabilidad.estado,
+    'resumen': Vulnerabilidad.resumen,
+    'impacto': Vulnerabilidad.impacto,
+    'solucion': Vulnerabilidad.solucion,
+    'metodo_deteccion': Vulnerabilidad.metodo_deteccion,
+    'referencias': Vulnerabilidad.referencias,
+}
+
+
+class ErrorApi(Exception):
+    def __init__(self, mensaje, status=400):
+        super().__init__(mensaje)
+        self.mensaje = mensaje
+        self.status = status
+
+
+@api_bp.errorhandler(ErrorApi)
+def manejar_error_api(error):
+    return jsonify({'error': error.mensaje}), error.status
+
+
+def token_requerido(f):
+    """Autentica la petición con 'Authorization: Bearer <token>' en lugar de la sesión"""
+    @wraps(f)
+    def decorada(*args, **kwargs):
+        cabecera = request.headers.get('Authorization', '')
+        esquema, _, token = cabecera.partition(' ')
+        if esquema.lower() != 'bearer' or not token:
+            raise ErrorApi('Token de API requerido', 401)
+
+        usuario = db.session.query(User)\
+            .join(ApiToken)\
+            .filter(ApiToken.token_hash == ApiToken.hash_token(token.strip()),
+                    ApiToken.activo == True,
+                    User.is_active == True)\
+            .first()
+        if not usuario:
+            raise ErrorApi('Token de API inválido', 401)
+
+        g.api_usuario = usuario
+        return f(*args, **kwargs)
+    return decorada
+
+
+def _aplicar_filtros(query, **filtros):
+    """aplicar_filtros con los errores de formato como respuesta 400"""
+    try:
+        return aplicar_filtros(query, **filtros)
+    except ValueError as e:
+        raise ErrorApi(str(e))
+
+
+def codificar_cursor(ultimo_id):
+    return base64.urlsafe_b64encode(str(ultimo_id).encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(cursor + relleno).decode())
+    except (ValueError, binascii.Error):
+        raise ErrorApi("Parámetro 'cursor' inválido")
+
+
+def _seleccionar_campos(campos_disponibles):
+    """Resuelve ?fields=a,b,c; la clave del cursor siempre va primera"""
+    clave = next(iter(campos_disponibles))
+    solicitados = request.args.get('fields')
+    if not solicitados:
+        return list(campos_disponibles)
+
+    nombres = [c.strip() for c in solicitados.split(',') if c.strip()]
+    desconocidos = [c for c in nombres if c not in campos_disponibles]
+    if desconocidos:
+        raise ErrorApi(f"Campos desconocidos: {', '.join(desconocidos)}")
+    return [clave] + [n for n in nombres if n != clave]
+
+
+def _serializar(nombres, fila):
+    item = {}
+    for nombre, valor in zip(nombres, fila):
+        if hasattr(valor, 'isoformat'):
+            valor = valor.isoformat()
+        item[nombre] = valor
+    return item
+
+
+def _quiere_ndjson():
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best == 'application/x-ndjson'
+
+
+def responder_coleccion(campos_disponibles, construir_query, relevancia=None):
+    """Pagina por cursor (orden ascendente de id) o transmite NDJSON.
+
+    ``construir_query`` recibe las columnas seleccionadas y devuelve la
+    consulta ya filtrada, sin orden ni límite. Con ``relevancia`` los
+    resultados se ordenan por ella y el cursor pasa a ser un desplazamiento.
+    """
+    nombres = _seleccionar_campos(campos_disponibles)
+    columna_clave = campos_disponibles[nombres[0]]
+    query = construir_query([campos_disponibles[n] for n in nombres])
+
+    cursor = request.args.get('cursor')
+    desplazamiento = 0
+    if relevancia is not None:
+        desplazamiento = decodificar_cursor(cursor) if cursor else 0
+        query = query.order_by(relevancia.desc(), columna_clave).offset(desplazamiento)
+    else:
+        if cursor:
+            query = query.filter(columna_clave > decodificar_cursor(cursor))
+        query = query.order_by(columna_clave)
+
+    limite = request.args.get('limit', type=int)
+    if limite is not None and limite < 1:
+        raise ErrorApi("Parámetro 'limit' inválido")
+
+    if _quiere_ndjson():
+        if limite:
+            query = query.limit(limite)
+
+        def generar():
+            for fila in query.yield_per(TAMANO_LOTE_STREAM):
+                yield json.dumps(_serializar(nombres, fila), ensure_ascii=False) + '\n'
+
+        return respuesta_en_streaming(generar(), mimetype='application/x-ndjson')
+
+    limite = min(limite or LIMITE_POR_DEFECTO, LIMITE_MAXIMO)
+    filas = query.limit(limite + 1).all()
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        if relevancia is not None:
+            siguiente = codificar_cursor(desplazamiento + limite)
+        else:
+            siguiente = codificar_cursor(filas[-1][0])
+
+    return jsonify({
+        'data': [_serializar(nombres, fila) for fila in filas],
+        'next_cursor': siguiente,
+    })
+
+
+def _filtros_request(*nombres):
+    return {nombre: request.args.get(nombre) for nombre in nombres}
+
+
+@api_bp.route('/sedes')
+@token_requerido
+def listar_sedes():
+    def construir(columnas):
+        query = db.session.query(*columnas).select_from(Sede)
+        activa = request.args.get('activa')
+        if activa is not None:
+            query = query.filter(Sede.activa == (activa.lower() in ('1', 'true')))
+        return query
+
+    return responder_coleccion(CAMPOS_SEDES, construir)
+
+
+@api_bp.route('/escaneos')
+@token_requerido
+def listar_escaneos():
+    def construir(columnas):
+        query = db.session.query(*columnas).select_from(Escaneo).join(Sede)
+        return _aplicar_filtros(query, **_filtros_request('sede', 'fecha_inicio', 'fecha_fin'))
+
+    return responder_coleccion(CAMPOS_ESCANEOS, construir)
+
+
+@api_bp.route('/hosts')
+@token_requerido
+def listar_hosts():
+    def construir(columnas):
+        query = db.session.query(*columnas).select_from(Host).join(Escaneo).join(Sede)
+        query = _aplicar_filtros(query, **_filtros_request('sede', 'fecha_inicio', 'fecha_fin'))
+        riesgo = request.args.get('riesgo')
+        if riesgo and riesgo != 'all':
+            # Igual que filtrar_resultados: solo hosts con algún hallazgo de ese riesgo
+            query = query.filter(Host.vulnerabilidades.any(Vulnerabilidad.nivel_amenaza == riesgo))
+        return query
+
+    return responder_coleccion(CAMPOS_HOSTS, construir)
+
+
+@api_bp.route('/hallazgos')
+@token_requerido
+def listar_hallazgos():
+    def construir(columnas):
+        query = db.session.query(*columnas).select_from(Vulnerabilidad)\
+            .join(Host).join(Escaneo).join(Sede)
+        query = _aplicar_filtros(query, **_filtros_request('sede', 'fecha_inicio', 'fecha_fin', 'riesgo', 'estado'))
+        escaneo_id = request.args.get('escaneo_id', type=int)
+        if escaneo_id:
+            query = query.filter(Host.escaneo_id == escaneo_id)
+        if q:
+            query, _ = aplicar_busqueda(query, q)
+        return query
+
+    # Con q= los resultados se ordenan por relevancia de la búsqueda de texto completo
+    q = request.args.get('q', '').strip()
+    return responder_coleccion(CAMPOS_HALLAZGOS, construir,
+                               relevancia=relevancia_busqueda(q) if q else None)
+
+
+@api_bp.cli.command('crear-token')
+@click.argument('username')
+@click.argument('nombre')
+def crear_token(username, nombre):
+    """Crea un token de API para USERNAME identificado como NOMBRE"""
+    usuario = User.query.filter_by(username=username).first()
+    if not usuario:
+        raise click.ClickException(f'No existe el usuario {username}')
+    api_token, token = ApiToken.generar(usuario, nombre)
+    db.session.add(api_token)
+    db.session.commit()
+    click.echo(f'Token creado para {username} ({nombre}):')
+    click.echo(token)
+    click.echo('Guárdelo ahora: no se puede volver a mostrar.')
+
+
+@api_bp.cli.command('revocar-token')
+@click.argument('nombre')
+def revocar_token(nombre):
+    """Desactiva los tokens de API identificados como NOMBRE"""
+    total = ApiToken.query.filter_by(nombre=nombre, activo=True).update({'activo': False})
+    db.session.commit()
+    click.echo(f'{total} token(s) revocado(s)')
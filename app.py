@@ -1,11 +1,23 @@
 import os
+import io
+import time
+import csv
 import logging
 from datetime import datetime
-from flask import Flask, render_template, request, flash, redirect, url_for, send_from_directory, jsonify, send_file
+from flask import Flask, render_template, request, flash, redirect, url_for, jsonify, send_file
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from sqlalchemy import text
+from itertools import groupby
+from sqlalchemy import text, select, update, func, case
+from sqlalchemy.orm import contains_eager
 from werkzeug.utils import secure_filename
 from parser import analizar_vulnerabilidades
+from ingesta import guardar_escaneo
+from cache import cache, VERSION_USUARIOS
+from artefactos import artefactos
+from busqueda import aplicar_busqueda
+from diferencias import Diferencias, CATEGORIAS
+from streaming import ResultadosEnStreaming, renderizar_en_streaming, respuesta_en_streaming
+from exportar import exportar_a_csv, exportar_a_pdf, exportar_a_parquet, parquet_disponible, DemasiadasFilas
 
 # Set up logging with more detail
 logging.basicConfig(
@@ -17,6 +29,16 @@ logger = logging.getLogger(__name__)
 # Initialize Flask app
 app = Flask(__name__)
 
+# Compresión gzip/brotli de HTML, JSON y CSV (COMPRESSION_ENABLED=0 para delegarla al proxy)
+if os.environ.get('COMPRESSION_ENABLED', '1') != '0':
+    from compresion import CompresionMiddleware
+    app.wsgi_app = CompresionMiddleware(
+        app.wsgi_app,
+        nivel_gzip=int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6)),
+        calidad_brotli=int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 4)),
+        tamano_minimo=int(os.environ.get('COMPRESSION_MIN_SIZE', 1024)),
+    )
+
 # Configuración segura de la clave secreta
 if not os.environ.get("SESSION_SECRET"):
     logger.warning("SESSION_SECRET not set! Using a random secret key.")
@@ -29,7 +51,45 @@ from database import db, init_db
 init_db(app)
 
 # Import models after database initialization
-from models import User, Sede, Escaneo, Host, Vulnerabilidad, ActivityLog
+from models import User, UsuarioSesion, Sede, Escaneo, Host, Vulnerabilidad
+from filtros import aplicar_filtros
+
+# Registro de actividad asíncrono y por lotes
+from actividad import RegistroActividad
+registro_actividad = RegistroActividad(app)
+
+# Métricas de Prometheus en /metrics
+from metricas import init_metricas, registrar_trabajo, medir_generador
+init_metricas(app)
+
+# Datos sintéticos para pruebas de carga (flask sembrar-datos)
+from datos_prueba import comando_sembrar_datos
+app.cli.add_command(comando_sembrar_datos)
+
+# Perfilador de consultas SQL y detector de N+1 (PROFILER_SAMPLE_RATE > 0)
+from perfilador import init_perfilador
+init_perfilador(app)
+
+# Archivos estáticos con hash y precomprimidos (python assets.py)
+from assets import assets_bp
+app.register_blueprint(assets_bp)
+
+# Informes técnicos en PDF generados en segundo plano (flask ejecutar-trabajo)
+from trabajos import trabajos_bp, comando_ejecutar_trabajo, crear_trabajo, listar_trabajos, resumen_trabajo, DemasiadosTrabajos, PAQUETE
+app.register_blueprint(trabajos_bp)
+app.cli.add_command(comando_ejecutar_trabajo)
+
+# Paquetes ZIP con los informes de cada sede, generados en paralelo (flask generar-paquete)
+from paquetes import comando_generar_paquete, sedes_con_datos
+app.cli.add_command(comando_generar_paquete)
+
+# Informes estándar generados fuera de hora (flask pregenerar-informes o REPORT_SCHEDULE_TIME)
+from programados import init_programados, resumen_programados
+init_programados(app)
+
+# API REST para integraciones (autenticada por token)
+from api import api_bp
+app.register_blueprint(api_bp)
 
 # Initialize Flask-Login
 login_manager = LoginManager()
@@ -38,6 +98,19 @@ login_manager.login_view = 'login'
 login_manager.login_message = 'Por favor inicie sesión para acceder a esta página.'
 login_manager.login_message_category = 'warning'
 
+ESTADOS_VULNERABILIDAD = ('ACTIVA', 'ASUMIDA', 'MITIGADA')
+# Criterios aceptados por /actualizar_estado_masivo cuando no se envían ids
+FILTROS_ESTADO_MASIVO = {'sede', 'fecha_inicio', 'fecha_fin', 'riesgo', 'estado', 'oid', 'ip', 'escaneo_id'}
+RESULTADOS_BUSQUEDA_POR_PAGINA = 50
+DIFERENCIAS_POR_PAGINA = 50
+FILAS_POR_LOTE = 500
+TIPOS_MIME_INFORME = {'pdf': 'application/pdf', 'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+# Con varios workers y caché en memoria, un cambio de usuario tarda hasta esto en verse en los demás
+TTL_CACHE_USUARIO = 30
+NIVELES_RIESGO = ('Critical', 'High', 'Medium', 'Low')
+MATRIZ_ESCANEOS_POR_DEFECTO = 12
+MATRIZ_ESCANEOS_MAXIMO = 104
+
 # Configuración para subida de archivos
 ALLOWED_EXTENSIONS = {'txt'}
 UPLOAD_FOLDER = '/tmp'
@@ -63,7 +136,7 @@ def filtrar_resultados(sede=None, fecha_inicio=None, fecha_fin=None, riesgo=None
         query = query.filter(Escaneo.fecha_escaneo <= fecha_fin_obj)
 
     # Ordenar por fecha de escaneo descendente (más reciente primero)
-    escaneos = query.order_by(Escaneo.fecha_escaneo.desc()).all()
+    escaneos = query.order_by(Escaneo.fecha_escaneo.desc(), Escaneo.id.desc()).all()
     resultados = []
 
     for escaneo in escaneos:
@@ -103,41 +176,188 @@ def filtrar_resultados(sede=None, fecha_inicio=None, fecha_fin=None, riesgo=None
     return resultados
 
 
+def iterar_hosts_por_escaneo(sede=None, fecha_inicio=None, fecha_fin=None, riesgo=None):
+    """
+    Versión en streaming de filtrar_resultados para la vista de hosts.
+    Los conteos por nivel de riesgo se agregan en la base de datos y las filas
+    se leen por lotes; devuelve un escaneo por elemento con sus hosts como iterador.
+    """
+    def contar(nivel):
+        return func.count(case((Vulnerabilidad.nivel_amenaza == nivel, Vulnerabilidad.id)))
+
+    query = db.session.query(
+        Escaneo.id, Sede.nombre, Escaneo.fecha_escaneo, Host.ip, func.max(Host.nombre_host),
+        contar('Critical'), contar('High'), contar('Medium'), contar('Low')
+    ).select_from(Host).join(Escaneo).join(Sede).outerjoin(Vulnerabilidad)
+    # Con riesgo solo quedan los hosts que tienen hallazgos de ese nivel, como en filtrar_resultados
+    query = aplicar_filtros(query, sede, fecha_inicio, fecha_fin, riesgo)
+    query = query.group_by(Escaneo.id, Sede.nombre, Escaneo.fecha_escaneo, Host.ip)\
+        .order_by(Escaneo.fecha_escaneo.desc(), Escaneo.id, Host.ip)\
+        .yield_per(FILAS_POR_LOTE)
+
+    # La consulta se construye (y valida los filtros) antes de empezar a leer filas
+    def agrupar():
+        for (escaneo_id, nombre_sede, fecha), filas in groupby(query, key=lambda f: f[:3]):
+            yield {
+                'sede': nombre_sede,
+                'fecha_escaneo': fecha.strftime('%Y-%m-%d') if hasattr(fecha, 'strftime') else fecha,
+                'escaneo_id': escaneo_id,
+                'hosts': ({
+                    'ip': f[3],
+                    'nombre_host': f[4],
+                    'Critical': f[5],
+                    'High': f[6],
+                    'Medium': f[7],
+                    'Low': f[8],
+                } for f in filas)
+            }
+
+    return agrupar()
+
+
+def filas_exportar_vulnerabilidades(sede=None, fecha_inicio=None, fecha_fin=None, riesgo=None):
+    """
+    Hallazgos para /exportar/vulnerabilidades: una sola consulta con los
+    joins que devuelve filas ligeras (sede, fecha_escaneo, ip, nombre_host,
+    nivel_amenaza, cvss, puerto, estado, nvt, resumen) en lugar de objetos
+    ORM, sin las columnas de texto largo que no se exportan. Se leen por lotes.
+    """
+    query = db.session.query(
+        Sede.nombre.label('sede'), Escaneo.fecha_escaneo, Host.ip, Host.nombre_host,
+        Vulnerabilidad.nivel_amenaza, Vulnerabilidad.cvss, Vulnerabilidad.puerto, Vulnerabilidad.estado,
+        Vulnerabilidad.nvt, Vulnerabilidad.resumen
+    ).select_from(Vulnerabilidad).join(Host).join(Escaneo).join(Sede)
+    return aplicar_filtros(query, sede, fecha_inicio, fecha_fin, riesgo).yield_per(FILAS_POR_LOTE)
+
+
+def vulnerabilidades_informe_tecnico(sede=None, fecha_inicio=None, fecha_fin=None, riesgo=None, por_sede=False):
+    """
+    Hallazgos del informe técnico, leídos por lotes. De cada IP se toma el
+    escaneo más reciente del rango, como en los hosts_detalle combinados del
+    informe ejecutivo. Con ``por_sede`` se toma el más reciente de cada IP
+    dentro de cada sede y las filas se ordenan por sede.
+    """
+    particion = (Sede.id, Host.ip) if por_sede else (Host.ip,)
+    orden = func.row_number().over(partition_by=particion,
+                                   order_by=(Escaneo.fecha_escaneo.desc(), Escaneo.id.desc()))
+    reciente = aplicar_filtros(
+        db.session.query(Host.ip, Escaneo.id.label('escaneo_id'), orden.label('orden'))
+        .select_from(Vulnerabilidad).join(Host).join(Escaneo).join(Sede),
+        sede, fecha_inicio, fecha_fin, riesgo
+    ).subquery()
+
+    query = Vulnerabilidad.query.join(Host).join(Escaneo).join(Sede)\
+        .join(reciente, (Host.ip == reciente.c.ip) & (Escaneo.id == reciente.c.escaneo_id) & (reciente.c.orden == 1))\
+        .options(contains_eager(Vulnerabilidad.host).contains_eager(Host.escaneo).contains_eager(Escaneo.sede))
+    query = aplicar_filtros(query, sede, fecha_inicio, fecha_fin, riesgo)
+    orden_filas = (Sede.nombre, Host.ip, Vulnerabilidad.id) if por_sede else (Host.ip, Vulnerabilidad.id)
+    return query.order_by(*orden_filas).yield_per(FILAS_POR_LOTE)
+
+
+def datos_informe_ejecutivo(sede=None, fecha_inicio=None, fecha_fin=None, riesgo=None):
+    """Datos del informe ejecutivo, con el escaneo más reciente de cada IP, o None si no hay resultados"""
+    resultados = filtrar_resultados(sede, fecha_inicio, fecha_fin, riesgo)
+    logger.debug(f"Resultados obtenidos: {len(resultados)} registros")
+    if not resultados:
+        return None
+
+    datos_informe = {
+        'sede': sede,
+        'fecha_inicio': fecha_inicio,
+        'fecha_fin': fecha_fin,
+        'hosts_detalle': {}
+    }
+    # Los resultados van del escaneo más reciente al más antiguo: de cada IP queda el más reciente
+    for resultado in resultados:
+        for ip, host in resultado['hosts_detalle'].items():
+            datos_informe['hosts_detalle'].setdefault(ip, host)
+
+    logger.debug(f"Datos preparados: {len(datos_informe['hosts_detalle'])} hosts")
+    return datos_informe
+
+
 def obtener_sedes():
     """Obtiene la lista única de sedes activas que tienen escaneos"""
-    # Query para obtener solo las sedes que tienen escaneos
-    sql = text("""
-        SELECT DISTINCT s.nombre
-        FROM sedes s
-        JOIN escaneos e ON e.sede_id = s.id
-        WHERE s.activa = true
-        ORDER BY s.nombre
-    """)
-    result = db.session.execute(sql)
-    return [row[0] for row in result]
+    def calcular():
+        # Query para obtener solo las sedes que tienen escaneos
+        sql = text("""
+            SELECT DISTINCT s.nombre
+            FROM sedes s
+            JOIN escaneos e ON e.sede_id = s.id
+            WHERE s.activa = true
+            ORDER BY s.nombre
+        """)
+        result = db.session.execute(sql)
+        return [row[0] for row in result]
+
+    return cache.obtener_o_calcular('obtener_sedes', None, calcular)
+
+def consultar_fechas_sede(sede):
+    """Obtiene las fechas de escaneo (YYYY-MM-DD, más reciente primero) de una sede activa"""
+    query = db.session.query(Escaneo.fecha_escaneo)\
+        .join(Sede)\
+        .filter(Sede.activa == True)
+
+    if sede != 'Todas las sedes':
+        query = query.filter(Sede.nombre == sede)
+
+    # Ordenar por fecha descendente y obtener fechas únicas
+    fechas = query.order_by(Escaneo.fecha_escaneo.desc())\
+        .distinct()\
+        .all()
+
+    # Formatear las fechas como strings YYYY-MM-DD
+    return [fecha[0].strftime('%Y-%m-%d') for fecha in fechas]
+
+def obtener_fechas_sede(sede):
+    """Versión cacheada de consultar_fechas_sede"""
+    return cache.obtener_o_calcular('fechas_por_sede', {'sede': sede},
+                                    lambda: consultar_fechas_sede(sede), sede=sede)
+
+def respuesta_json_condicional(endpoint, filtros, calcular, sede=None):
+    """Respuesta JSON cacheada con ETag; responde 304 sin consultar la base si el cliente ya la tiene"""
+    etag = cache.etag(endpoint, filtros, sede=sede)
+    # Comparación débil: la compresión convierte el ETag en W/"..."
+    if etag and request.if_none_match.contains_weak(etag):
+        respuesta = app.response_class(status=304)
+    else:
+        respuesta = jsonify(cache.obtener_o_calcular(endpoint, filtros, calcular, sede=sede))
+
+    if etag:
+        respuesta.set_etag(etag)
+        # Los datos dependen de la sesión: permitir almacenarlos pero revalidar siempre
+        respuesta.headers['Cache-Control'] = 'no-cache'
+        respuesta.vary.add('Cookie')
+    return respuesta
+
+def sede_de_escaneo(escaneo_id):
+    """Devuelve el nombre de la sede a la que pertenece un escaneo"""
+    return db.session.query(Sede.nombre).join(Escaneo).filter(Escaneo.id == escaneo_id).scalar()
+
+def consultar_usuario(user_id):
+    usuario = db.session.get(User, user_id)
+    return UsuarioSesion.datos_de(usuario) if usuario else None
 
 @login_manager.user_loader
 def load_user(user_id):
+    """Carga current_user desde la caché; solo consulta la base al expirar o invalidarse"""
     try:
-        return User.query.get(int(user_id))
+        user_id = int(user_id)
+        datos = cache.obtener_o_calcular('usuario', {'id': user_id},
+                                         lambda: consultar_usuario(user_id),
+                                         ttl=TTL_CACHE_USUARIO, versiones=[VERSION_USUARIOS])
+        return UsuarioSesion(datos) if datos else None
     except Exception as e:
         logger.error(f"Error loading user {user_id}: {str(e)}")
         return None
 
 def log_activity(action, details=None):
-    """Log user activity"""
+    """Log user activity (se escribe en segundo plano, ver actividad.py)"""
     try:
         if current_user.is_authenticated:
-            activity = ActivityLog(
-                user_id=current_user.id,
-                action=action,
-                details=details
-            )
-            db.session.add(activity)
-            db.session.commit()
+            registro_actividad.registrar(current_user.id, action, details)
     except Exception as e:
         logger.error(f"Error logging activity: {str(e)}")
-        db.session.rollback()
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -198,48 +418,59 @@ def dashboard():
     fecha_fin = request.args.get('fecha_fin')
     riesgo = request.args.get('riesgo')
 
-    # Query base
-    query = Vulnerabilidad.query.join(Host).join(Escaneo).join(Sede)
+    def calcular():
+        # Query base
+        query = Vulnerabilidad.query.join(Host).join(Escaneo).join(Sede)
 
-    # Aplicar filtros
-    if sede:
-        query = query.filter(Sede.nombre == sede)
-    if fecha_inicio:
-        query = query.filter(Escaneo.fecha_escaneo >= datetime.strptime(fecha_inicio, '%Y-%m-%d').date())
-    if fecha_fin:
-        query = query.filter(Escaneo.fecha_escaneo <= datetime.strptime(fecha_fin, '%Y-%m-%d').date())
+        # Aplicar filtros
+        if sede:
+            query = query.filter(Sede.nombre == sede)
+        if fecha_inicio:
+            query = query.filter(Escaneo.fecha_escaneo >= datetime.strptime(fecha_inicio, '%Y-%m-%d').date())
+        if fecha_fin:
+            query = query.filter(Escaneo.fecha_escaneo <= datetime.strptime(fecha_fin, '%Y-%m-%d').date())
 
-    vulnerabilidades = query.all()
-    total_vulnerabilidades = len(vulnerabilidades)
+        vulnerabilidades = query.all()
+        total_vulnerabilidades = len(vulnerabilidades)
+
+        # Calcular riesgo promedio (CVSS)
+        vulnerabilidades_con_cvss = [v for v in vulnerabilidades if v.cvss and v.cvss.replace('.','').isdigit()]
+        if vulnerabilidades_con_cvss:
+            riesgo_total = sum(float(v.cvss) for v in vulnerabilidades_con_cvss)
+            riesgo_promedio = round(riesgo_total / len(vulnerabilidades_con_cvss), 1)
+        else:
+            riesgo_promedio = 0.0
+
+        # Contar estados
+        estados = {
+            'mitigada': len([v for v in vulnerabilidades if v.estado == 'MITIGADA']),
+            'asumida': len([v for v in vulnerabilidades if v.estado == 'ASUMIDA']),
+            'vigente': len([v for v in vulnerabilidades if v.estado == 'ACTIVA'])
+        }
 
-    # Calcular riesgo promedio (CVSS)
-    vulnerabilidades_con_cvss = [v for v in vulnerabilidades if v.cvss and v.cvss.replace('.','').isdigit()]
-    if vulnerabilidades_con_cvss:
-        riesgo_total = sum(float(v.cvss) for v in vulnerabilidades_con_cvss)
-        riesgo_promedio = round(riesgo_total / len(vulnerabilidades_con_cvss), 1)
-    else:
-        riesgo_promedio = 0.0
+        # Contar por criticidad
+        criticidad = {
+            'Critical': len([v for v in vulnerabilidades if v.nivel_amenaza == 'Critical']),
+            'High': len([v for v in vulnerabilidades if v.nivel_amenaza == 'High']),
+            'Medium': len([v for v in vulnerabilidades if v.nivel_amenaza == 'Medium']),
+            'Low': len([v for v in vulnerabilidades if v.nivel_amenaza == 'Low'])
+        }
 
-    # Contar estados
-    estados = {
-        'mitigada': len([v for v in vulnerabilidades if v.estado == 'MITIGADA']),
-        'asumida': len([v for v in vulnerabilidades if v.estado == 'ASUMIDA']),
-        'vigente': len([v for v in vulnerabilidades if v.estado == 'ACTIVA'])
-    }
+        return {
+            'riesgo_promedio': riesgo_promedio,
+            'total_vulnerabilidades': total_vulnerabilidades,
+            'estados': estados,
+            'criticidad': list(criticidad.values())
+        }
 
-    # Contar por criticidad
-    criticidad = {
-        'Critical': len([v for v in vulnerabilidades if v.nivel_amenaza == 'Critical']),
-        'High': len([v for v in vulnerabilidades if v.nivel_amenaza == 'High']),
-        'Medium': len([v for v in vulnerabilidades if v.nivel_amenaza == 'Medium']),
-        'Low': len([v for v in vulnerabilidades if v.nivel_amenaza == 'Low'])
-    }
+    filtros = {'sede': sede, 'fecha_inicio': fecha_inicio, 'fecha_fin': fecha_fin}
+    datos = cache.obtener_o_calcular('dashboard', filtros, calcular, sede=sede)
 
     return render_template('dashboard.html',
-                         riesgo_promedio=riesgo_promedio,
-                         total_vulnerabilidades=total_vulnerabilidades,
-                         estados=estados,
-                         criticidad=list(criticidad.values()),
+                         riesgo_promedio=datos['riesgo_promedio'],
+                         total_vulnerabilidades=datos['total_vulnerabilidades'],
+                         estados=datos['estados'],
+                         criticidad=datos['criticidad'],
                          sedes=obtener_sedes(),
                          sede_seleccionada=sede,
                          fecha_inicio=fecha_inicio,
@@ -285,11 +516,10 @@ def hosts():
     riesgo = request.args.get('riesgo')
 
     try:
-        resultados_filtrados = filtrar_resultados(sede, fecha_inicio, fecha_fin, riesgo)
-        logger.debug(f"Resultados filtrados para hosts: {len(resultados_filtrados) if resultados_filtrados else 0} registros")
+        resultados_filtrados = iterar_hosts_por_escaneo(sede, fecha_inicio, fecha_fin, riesgo)
 
-        return render_template('hosts.html', 
-                            resultados=resultados_filtrados,
+        return renderizar_en_streaming('hosts.html',
+                            resultados=ResultadosEnStreaming(resultados_filtrados),
                             sedes=obtener_sedes(),
                             sede_seleccionada=sede,
                             fecha_inicio=fecha_inicio,
@@ -315,10 +545,13 @@ def vulnerabilidades():
         fecha_fin = request.args.get('fecha_fin')
         riesgo = request.args.get('riesgo')
         estado = request.args.get('estado')
+        q = request.args.get('q', '').strip()
 
-        logger.debug(f"Filtros recibidos - sede: {sede}, fecha_inicio: {fecha_inicio}, fecha_fin: {fecha_fin}, riesgo: {riesgo}, estado: {estado}")
+        logger.debug(f"Filtros recibidos - sede: {sede}, fecha_inicio: {fecha_inicio}, fecha_fin: {fecha_fin}, riesgo: {riesgo}, estado: {estado}, q: {q}")
 
-        query = Vulnerabilidad.query.join(Host).join(Escaneo).join(Sede)
+        # El host y el escaneo de cada fila se cargan en la misma consulta
+        query = Vulnerabilidad.query.join(Host).join(Escaneo).join(Sede)\
+            .options(contains_eager(Vulnerabilidad.host).contains_eager(Host.escaneo))
 
         # Aplicar filtros
         if sede and sede != 'Todas las sedes':
@@ -332,11 +565,22 @@ def vulnerabilidades():
         if estado and estado != 'all':
             query = query.filter(Vulnerabilidad.estado == estado)
 
-        vulnerabilidades = query.all()
-        logger.debug(f"Total de vulnerabilidades encontradas: {len(vulnerabilidades)}")
-
-        return render_template('vulnerabilidades.html', 
+        paginacion = None
+        if q:
+            # Búsqueda de texto completo: resultados ordenados por relevancia y paginados
+            query, relevancia = aplicar_busqueda(query, q)
+            paginacion = query.order_by(relevancia.desc(), Vulnerabilidad.id)\
+                .paginate(page=request.args.get('pagina', 1, type=int),
+                          per_page=RESULTADOS_BUSQUEDA_POR_PAGINA, error_out=False)
+            vulnerabilidades = paginacion.items
+        else:
+            # Sin búsqueda pueden ser todas las vulnerabilidades: leerlas por lotes
+            vulnerabilidades = ResultadosEnStreaming(query.yield_per(FILAS_POR_LOTE))
+
+        return renderizar_en_streaming('vulnerabilidades.html',
                             resultados=vulnerabilidades,
+                            paginacion=paginacion,
+                            q=q,
                             sedes=obtener_sedes(),
                             sede_seleccionada=sede,
                             fecha_inicio=fecha_inicio,
@@ -354,7 +598,171 @@ def vulnerabilidades():
                             fecha_inicio=fecha_inicio if 'fecha_inicio' in locals() else None,
                             fecha_fin=fecha_fin if 'fecha_fin' in locals() else None,
                             riesgo=riesgo if 'riesgo' in locals() else None,
-                            estado=estado if 'estado' in locals() else None)
+                            estado=estado if 'estado' in locals() else None,
+                            q=q if 'q' in locals() else '')
+
+def calcular_comparacion(sede1, fecha1, sede2, fecha2):
+    """Calcula los conteos por nivel de riesgo de dos escaneos y su variación"""
+    fecha1_obj = datetime.strptime(fecha1, '%Y-%m-%d').date()
+    fecha2_obj = datetime.strptime(fecha2, '%Y-%m-%d').date()
+
+    # Consulta SQL para obtener los conteos
+    sql_query = text("""
+    SELECT 
+        s.nombre,
+        e.fecha_escaneo,
+        v.nivel_amenaza,
+        COUNT(*) as total
+    FROM escaneos e
+    JOIN hosts h ON h.escaneo_id = e.id
+    JOIN vulnerabilidades v ON v.host_id = h.id
+    JOIN sedes s ON e.sede_id = s.id
+    WHERE (s.nombre = :sede1 AND e.fecha_escaneo = :fecha1)
+       OR (s.nombre = :sede2 AND e.fecha_escaneo = :fecha2)
+    GROUP BY s.nombre, e.fecha_escaneo, v.nivel_amenaza
+    ORDER BY e.fecha_escaneo, v.nivel_amenaza;
+    """)
+
+    result = db.session.execute(sql_query, {
+        'sede1': sede1,
+        'fecha1': fecha1_obj,
+        'sede2': sede2,
+        'fecha2': fecha2_obj
+    })
+
+    # Procesar resultados
+    primer_conteo = {'Critical': 0, 'High': 0, 'Medium': 0, 'Low': 0}
+    segundo_conteo = {'Critical': 0, 'High': 0, 'Medium': 0, 'Low': 0}
+    primer_total = 0
+    segundo_total = 0
+
+    # Almacenar los resultados para procesarlos
+    resultados_sql = list(result)
+    logger.debug(f"Resultados SQL obtenidos: {len(resultados_sql)} filas")
+
+    # Si es el mismo escaneo, usar los mismos datos para ambos
+    if sede1 == sede2 and fecha1_obj == fecha2_obj:
+        for row in resultados_sql:
+            nivel_amenaza = row[2]
+            total = row[3]
+            primer_conteo[nivel_amenaza] = total
+            segundo_conteo[nivel_amenaza] = total
+            primer_total += total
+            segundo_total += total
+    else:
+        # Procesar normalmente para escaneos diferentes
+        for row in resultados_sql:
+            sede = row[0]
+            fecha_escaneo = row[1]
+            nivel_amenaza = row[2]
+            total = row[3]
+
+            if sede == sede1 and fecha_escaneo == fecha1_obj:
+                primer_conteo[nivel_amenaza] = total
+                primer_total += total
+            elif sede == sede2 and fecha_escaneo == fecha2_obj:
+                segundo_conteo[nivel_amenaza] = total
+                segundo_total += total
+
+    # Calcular variación
+    variacion = segundo_total - primer_total
+    porcentaje_variacion = (variacion / primer_total * 100) if primer_total > 0 else 0
+
+    return {
+        'primer_escaneo': {
+            'fecha': fecha1,
+            'datos': primer_conteo,
+            'total': primer_total
+        },
+        'diferencias': Diferencias(sede1, fecha1_obj, sede2, fecha2_obj).resumen(),
+        'segundo_escaneo': {
+            'fecha': fecha2,
+            'datos': segundo_conteo,
+            'total': segundo_total
+        },
+        'variacion': {
+            'total': variacion,
+            'porcentaje': porcentaje_variacion
+        }
+    }
+
+def calcular_matriz(modo, sede=None, limite=MATRIZ_ESCANEOS_POR_DEFECTO):
+    """
+    Matriz de conteos por nivel de riesgo para N escaneos en una sola consulta.
+    modo 'sedes': último escaneo de cada sede activa.
+    modo 'historial': últimos `limite` escaneos de una sede.
+    """
+    if modo == 'historial':
+        filtro_sede = "s.nombre = :sede"
+    else:
+        filtro_sede = "s.activa = true"
+        limite = 1
+
+    sql_query = text(f"""
+    WITH escaneos_numerados AS (
+        SELECT
+            e.id,
+            s.nombre AS sede,
+            e.fecha_escaneo,
+            ROW_NUMBER() OVER (PARTITION BY e.sede_id ORDER BY e.fecha_escaneo DESC, e.id DESC) AS posicion
+        FROM escaneos e
+        JOIN sedes s ON s.id = e.sede_id
+        WHERE {filtro_sede}
+    )
+    SELECT
+        en.id,
+        en.sede,
+        en.fecha_escaneo,
+        v.nivel_amenaza,
+        COUNT(v.id) AS total
+    FROM escaneos_numerados en
+    LEFT JOIN hosts h ON h.escaneo_id = en.id
+    LEFT JOIN vulnerabilidades v ON v.host_id = h.id
+    WHERE en.posicion <= :limite
+    GROUP BY en.id, en.sede, en.fecha_escaneo, v.nivel_amenaza
+    ORDER BY en.sede, en.fecha_escaneo, en.id;
+    """)
+
+    columnas = []
+    indices = {}
+    valores = {nivel: [] for nivel in NIVELES_RIESGO}
+    for escaneo_id, nombre_sede, fecha, nivel, total in db.session.execute(
+            sql_query, {'sede': sede, 'limite': limite}):
+        if escaneo_id not in indices:
+            indices[escaneo_id] = len(columnas)
+            columnas.append({'escaneo_id': escaneo_id, 'sede': nombre_sede, 'fecha': str(fecha)})
+            for serie in valores.values():
+                serie.append(0)
+        if nivel in valores:
+            valores[nivel][indices[escaneo_id]] = total
+
+    return {
+        'modo': modo,
+        'columnas': columnas,
+        'niveles': list(NIVELES_RIESGO),
+        'valores': valores,
+        'totales': [sum(valores[nivel][i] for nivel in NIVELES_RIESGO) for i in range(len(columnas))],
+    }
+
+@app.route('/comparacion/matriz')
+@login_required
+def matriz_comparacion():
+    """Matriz JSON de comparación entre varios escaneos (ver calcular_matriz)"""
+    try:
+        modo = request.args.get('modo', 'sedes')
+        sede = request.args.get('sede')
+        if modo not in ('sedes', 'historial') or (modo == 'historial' and not sede):
+            return jsonify({'error': 'Parámetros de comparación no válidos'}), 400
+        limite = min(max(request.args.get('limite', MATRIZ_ESCANEOS_POR_DEFECTO, type=int), 1),
+                     MATRIZ_ESCANEOS_MAXIMO)
+
+        filtros = {'modo': modo, 'sede': sede, 'limite': limite if modo == 'historial' else None}
+        return respuesta_json_condicional('matriz_comparacion', filtros,
+                                          lambda: calcular_matriz(modo, sede, limite),
+                                          sede=sede if modo == 'historial' else None)
+    except Exception as e:
+        logger.error(f"Error al calcular la matriz de comparación: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Error al calcular la matriz de comparación'}), 500
 
 @app.route('/comparacion')
 @login_required
@@ -378,118 +786,31 @@ def comparacion():
         if not sede2 and sedes:
             sede2 = sedes[0]
 
-        # Obtener los escaneos de cada sede
-        escaneos1 = []
-        escaneos2 = []
-
-        if sede1:
-            sede1_obj = Sede.query.filter_by(nombre=sede1).first()
-            if sede1_obj:
-                escaneos1 = Escaneo.query.filter_by(sede_id=sede1_obj.id)\
-                    .order_by(Escaneo.fecha_escaneo.desc()).all()
-
-        if sede2:
-            sede2_obj = Sede.query.filter_by(nombre=sede2).first()
-            if sede2_obj:
-                escaneos2 = Escaneo.query.filter_by(sede_id=sede2_obj.id)\
-                    .order_by(Escaneo.fecha_escaneo.desc()).all()
+        # Obtener las fechas de escaneo de cada sede
+        fechas1 = obtener_fechas_sede(sede1) if sede1 else []
+        fechas2 = obtener_fechas_sede(sede2) if sede2 else []
 
         # Si no hay fechas seleccionadas, usar las más recientes
-        if not fecha1 and escaneos1:
-            fecha1 = escaneos1[0].fecha_escaneo.strftime('%Y-%m-%d')
-        if not fecha2 and escaneos2:
-            fecha2 = escaneos2[0].fecha_escaneo.strftime('%Y-%m-%d')
+        if not fecha1 and fechas1:
+            fecha1 = fechas1[0]
+        if not fecha2 and fechas2:
+            fecha2 = fechas2[0]
 
         resultados = None
         if fecha1 and fecha2 and sede1 and sede2:
-            fecha1_obj = datetime.strptime(fecha1, '%Y-%m-%d').date()
-            fecha2_obj = datetime.strptime(fecha2, '%Y-%m-%d').date()
-
-            # Consulta SQL para obtener los conteos
-            sql_query = text("""
-            SELECT 
-                s.nombre,
-                e.fecha_escaneo,
-                v.nivel_amenaza,
-                COUNT(*) as total
-            FROM escaneos e
-            JOIN hosts h ON h.escaneo_id = e.id
-            JOIN vulnerabilidades v ON v.host_id = h.id
-            JOIN sedes s ON e.sede_id = s.id
-            WHERE (s.nombre = :sede1 AND e.fecha_escaneo = :fecha1)
-               OR (s.nombre = :sede2 AND e.fecha_escaneo = :fecha2)
-            GROUP BY s.nombre, e.fecha_escaneo, v.nivel_amenaza
-            ORDER BY e.fecha_escaneo, v.nivel_amenaza;
-            """)
-
-            result = db.session.execute(sql_query, {
-                'sede1': sede1,
-                'fecha1': fecha1_obj,
-                'sede2': sede2,
-                'fecha2': fecha2_obj
-            })
-
-            # Procesar resultados
-            primer_conteo = {'Critical': 0, 'High': 0, 'Medium': 0, 'Low': 0}
-            segundo_conteo = {'Critical': 0, 'High': 0, 'Medium': 0, 'Low': 0}
-            primer_total = 0
-            segundo_total = 0
-
-            # Almacenar los resultados para procesarlos
-            resultados_sql = list(result)
-            logger.debug(f"Resultados SQL obtenidos: {resultados_sql}")
-
-            # Si es el mismo escaneo, usar los mismos datos para ambos
-            if sede1 == sede2 and fecha1_obj == fecha2_obj:
-                for row in resultados_sql:
-                    nivel_amenaza = row[2]
-                    total = row[3]
-                    primer_conteo[nivel_amenaza] = total
-                    segundo_conteo[nivel_amenaza] = total
-                    primer_total += total
-                    segundo_total += total
-            else:
-                # Procesar normalmente para escaneos diferentes
-                for row in resultados_sql:
-                    sede = row[0]
-                    fecha_escaneo = row[1]
-                    nivel_amenaza = row[2]
-                    total = row[3]
-
-                    if sede == sede1 and fecha_escaneo == fecha1_obj:
-                        primer_conteo[nivel_amenaza] = total
-                        primer_total += total
-                    elif sede == sede2 and fecha_escaneo == fecha2_obj:
-                        segundo_conteo[nivel_amenaza] = total
-                        segundo_total += total
-
-            # Calcular variación
-            variacion = segundo_total - primer_total
-            porcentaje_variacion = (variacion / primer_total * 100) if primer_total > 0 else 0
-
-            resultados = {
-                'primer_escaneo': {
-                    'fecha': fecha1,
-                    'datos': primer_conteo,
-                    'total': primer_total
-                },
-                'segundo_escaneo': {
-                    'fecha': fecha2,
-                    'datos': segundo_conteo,
-                    'total': segundo_total
-                },
-                'variacion': {
-                    'total': variacion,
-                    'porcentaje': porcentaje_variacion
-                }
-            }
+            filtros = {'sede1': sede1, 'fecha1': fecha1, 'sede2': sede2, 'fecha2': fecha2}
+            resultados = cache.obtener_o_calcular(
+                'comparacion', filtros,
+                lambda: calcular_comparacion(sede1, fecha1, sede2, fecha2),
+                sede=sede1 if sede1 == sede2 else None
+            )
 
         return render_template('comparacion.html',
                             sedes=sedes,
                             sede1_seleccionada=sede1,
                             sede2_seleccionada=sede2,
-                            escaneos1=escaneos1,
-                            escaneos2=escaneos2,
+                            fechas1=fechas1,
+                            fechas2=fechas2,
                             fecha1=fecha1,
                             fecha2=fecha2,
                             resultados=resultados)
@@ -499,10 +820,74 @@ def comparacion():
         flash('Error al cargar la página de comparación', 'error')
         return redirect(url_for('dashboard'))
 
-@app.route('/static/<path:filename>')
+def parametros_comparacion():
+    """Lee y valida los dos escaneos a comparar de la query string"""
+    parametros = {k: request.args.get(k) for k in ('sede1', 'fecha1', 'sede2', 'fecha2')}
+    if not all(parametros.values()):
+        raise ValueError('Faltan los escaneos a comparar')
+    fecha1 = datetime.strptime(parametros['fecha1'], '%Y-%m-%d').date()
+    fecha2 = datetime.strptime(parametros['fecha2'], '%Y-%m-%d').date()
+    return parametros, Diferencias(parametros['sede1'], fecha1, parametros['sede2'], fecha2)
+
+@app.route('/comparacion/<categoria>')
 @login_required
-def serve_static(filename):
-    return send_from_directory(app.static_folder, filename)
+def detalle_comparacion(categoria):
+    """Listado paginado de una categoría de diferencias entre dos escaneos"""
+    if categoria not in CATEGORIAS:
+        flash('Categoría de comparación no válida', 'error')
+        return redirect(url_for('comparacion'))
+    try:
+        parametros, diferencias = parametros_comparacion()
+        pagina = max(request.args.get('pagina', 1, type=int), 1)
+        filas, hay_siguiente = diferencias.pagina(categoria, pagina, DIFERENCIAS_POR_PAGINA)
+
+        return render_template('comparacion_detalle.html',
+                            categoria=categoria,
+                            titulo=CATEGORIAS[categoria][0],
+                            columnas=diferencias.columnas(categoria),
+                            filas=filas,
+                            pagina=pagina,
+                            hay_siguiente=hay_siguiente,
+                            parametros=parametros)
+
+    except Exception as e:
+        logger.error(f"Error en el detalle de comparación: {str(e)}", exc_info=True)
+        flash('Error al cargar el detalle de la comparación', 'error')
+        return redirect(url_for('comparacion', **request.args))
+
+@app.route('/comparacion/<categoria>/csv')
+@login_required
+def exportar_comparacion(categoria):
+    """Exporta a CSV todas las filas de una categoría de diferencias"""
+    if categoria not in CATEGORIAS:
+        flash('Categoría de comparación no válida', 'error')
+        return redirect(url_for('comparacion'))
+    try:
+        parametros, diferencias = parametros_comparacion()
+
+        def generar():
+            salida = io.StringIO()
+            escritor = csv.writer(salida)
+            escritor.writerow(diferencias.columnas(categoria))
+            for fila in diferencias.filas(categoria):
+                escritor.writerow(fila)
+                if salida.tell() > 65536:
+                    yield salida.getvalue()
+                    salida.seek(0)
+                    salida.truncate()
+            yield salida.getvalue()
+
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        return respuesta_en_streaming(
+            generar(),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename=comparacion_{categoria}_{timestamp}.csv'}
+        )
+
+    except Exception as e:
+        logger.error(f"Error al exportar la comparación: {str(e)}", exc_info=True)
+        flash('Error al exportar la comparación', 'error')
+        return redirect(url_for('comparacion', **request.args))
 
 @app.route('/tendencias')
 @login_required
@@ -514,90 +899,168 @@ def obtener_tendencias():
 
     logger.debug(f"Filtros recibidos - sede: {sede}, fecha_inicio: {fecha_inicio}, fecha_fin: {fecha_fin}")
 
-    # Construir la consulta SQL base
-    sql_base = """
-        SELECT 
-            e.fecha_escaneo,
-            v.nivel_amenaza,
-            COUNT(*) as total_vulnerabilidades
-        FROM escaneos e
-        JOIN hosts h ON h.escaneo_id = e.id
-        JOIN vulnerabilidades v ON v.host_id = h.id
-        JOIN sedes s ON e.sede_id = s.id
-        WHERE 1=1
-    """
-    params = {}
-
-    # Agregar condiciones según los filtros
-    if sede and sede != 'Todas las sedes':
-        sql_base += " AND s.nombre = :sede"
-        params['sede'] = sede
-    if fecha_inicio:
-        sql_base += " AND e.fecha_escaneo >= :fecha_inicio"
-        params['fecha_inicio'] = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
-    if fecha_fin:
-        sql_base += " AND e.fecha_escaneo <= :fecha_fin"
-        params['fecha_fin'] = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
-
-    # Agregar agrupación y ordenamiento
-    sql_base += " GROUP BY e.fecha_escaneo, v.nivel_amenaza ORDER BY e.fecha_escaneo, v.nivel_amenaza"
-
-    logger.debug(f"SQL Query: {sql_base}")
-    logger.debug(f"Params: {params}")
+    def calcular():
+        # Construir la consulta SQL base
+        sql_base = """
+            SELECT 
+                e.fecha_escaneo,
+                v.nivel_amenaza,
+                COUNT(*) as total_vulnerabilidades
+            FROM escaneos e
+            JOIN hosts h ON h.escaneo_id = e.id
+            JOIN vulnerabilidades v ON v.host_id = h.id
+            JOIN sedes s ON e.sede_id = s.id
+            WHERE 1=1
+        """
+        params = {}
 
-    # Ejecutar consulta
-    result = db.session.execute(text(sql_base), params)
+        # Agregar condiciones según los filtros
+        if sede and sede != 'Todas las sedes':
+            sql_base += " AND s.nombre = :sede"
+            params['sede'] = sede
+        if fecha_inicio:
+            sql_base += " AND e.fecha_escaneo >= :fecha_inicio"
+            params['fecha_inicio'] = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
+        if fecha_fin:
+            sql_base += " AND e.fecha_escaneo <= :fecha_fin"
+            params['fecha_fin'] = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
+
+        # Agregar agrupación y ordenamiento
+        sql_base += " GROUP BY e.fecha_escaneo, v.nivel_amenaza ORDER BY e.fecha_escaneo, v.nivel_amenaza"
+
+        logger.debug(f"SQL Query: {sql_base}")
+        logger.debug(f"Params: {params}")
+
+        # Ejecutar consulta
+        result = db.session.execute(text(sql_base), params)
+
+        # Procesar resultados
+        tendencias = {}
+        for row in result:
+            fecha = row[0].strftime('%Y-%m-%d')
+            nivel = row[1]
+            total = row[2]
+
+            if fecha not in tendencias:
+                tendencias[fecha] = {
+                    'fecha': fecha,
+                    'Critical': 0,
+                    'High': 0,
+                    'Medium': 0,
+                    'Low': 0
+                }
+            tendencias[fecha][nivel] = total
 
-    # Procesar resultados
-    tendencias = {}
-    for row in result:
-        fecha = row[0].strftime('%Y-%m-%d')
-        nivel = row[1]
-        total = row[2]
-
-        if fecha not in tendencias:
-            tendencias[fecha] = {
-                'fecha': fecha,
-                'Critical': 0,
-                'High': 0,
-                'Medium': 0,
-                'Low': 0
-            }
-        tendencias[fecha][nivel] = total
+        logger.debug(f"Tendencias calculadas: {len(tendencias)} fechas")
+        return list(tendencias.values())
 
-    logger.debug(f"Tendencias calculadas: {tendencias}")
-    return jsonify(list(tendencias.values()))
+    filtros = {'sede': sede, 'fecha_inicio': fecha_inicio, 'fecha_fin': fecha_fin}
+    return respuesta_json_condicional('tendencias', filtros, calcular, sede=sede)
 
 @app.route('/actualizar_estado', methods=['POST'])
 @login_required
 def actualizar_estado():
     data = request.get_json()
+    vuln_id = data.get('id')
     ip = data.get('ip')
     oid = data.get('oid')
     nuevo_estado = data.get('estado')
 
-    if not all([ip, oid, nuevo_estado]):
+    if not nuevo_estado or not (vuln_id or (ip and oid)):
         return jsonify({'success': False, 'error': 'Datos incompletos'}), 400
+    if nuevo_estado not in ESTADOS_VULNERABILIDAD:
+        return jsonify({'success': False, 'error': 'Estado no válido'}), 400
 
     try:
-        # Buscar la vulnerabilidad por IP y OID
-        host = Host.query.filter_by(ip=ip).first()
-        if host:
-            vulnerabilidad = Vulnerabilidad.query.filter_by(
-                host_id=host.id,
-                oid=oid
-            ).first()
-
-            if vulnerabilidad:
-                vulnerabilidad.estado = nuevo_estado
-                db.session.commit()
-                log_activity('update_vulnerability_status', f'Actualizó el estado de la vulnerabilidad {oid} a {nuevo_estado}')
-                return jsonify({'success': True})
+        if vuln_id:
+            vulnerabilidad = db.session.get(Vulnerabilidad, int(vuln_id))
+        else:
+            # Compatibilidad con IP y OID: la misma IP aparece en muchos escaneos,
+            # se toma el hallazgo del escaneo más reciente
+            vulnerabilidad = Vulnerabilidad.query.join(Host).join(Escaneo)\
+                .filter(Host.ip == ip, Vulnerabilidad.oid == oid)\
+                .order_by(Escaneo.fecha_escaneo.desc(), Escaneo.id.desc())\
+                .first()
+
+        if vulnerabilidad:
+            vulnerabilidad.estado = nuevo_estado
+            db.session.commit()
+            cache.invalidar(sede_de_escaneo(vulnerabilidad.host.escaneo_id))
+            log_activity('update_vulnerability_status', f'Actualizó el estado de la vulnerabilidad {vulnerabilidad.oid} a {nuevo_estado}')
+            return jsonify({'success': True})
 
         return jsonify({'success': False, 'error': 'Vulnerabilidad no encontrada'}), 404
 
     except Exception as e:
         logger.error(f"Error al actualizar estado: {str(e)}", exc_info=True)
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/actualizar_estado_masivo', methods=['POST'])
+@login_required
+def actualizar_estado_masivo():
+    """
+    Cambia el estado de muchas vulnerabilidades con un único UPDATE.
+    Recibe {'estado': ..., 'ids': [...]} o {'estado': ..., 'filtro': {'oid': ..., 'sede': ...}}
+    """
+    data = request.get_json(silent=True) or {}
+    nuevo_estado = data.get('estado')
+    ids = data.get('ids')
+    filtro = data.get('filtro')
+
+    if nuevo_estado not in ESTADOS_VULNERABILIDAD:
+        return jsonify({'success': False, 'error': 'Estado no válido'}), 400
+    if bool(ids) == bool(filtro):
+        return jsonify({'success': False, 'error': 'Debe indicar ids o filtro'}), 400
+    if (ids and not isinstance(ids, list)) or (filtro and not isinstance(filtro, dict)):
+        return jsonify({'success': False, 'error': 'Formato de ids o filtro no válido'}), 400
+
+    try:
+        def seleccion(*columnas):
+            stmt = select(*columnas).select_from(Vulnerabilidad).join(Host).join(Escaneo).join(Sede)\
+                .where(Vulnerabilidad.estado != nuevo_estado)
+            if ids:
+                return stmt.where(Vulnerabilidad.id.in_([int(i) for i in ids]))
+
+            stmt = aplicar_filtros(stmt, sede=filtro.get('sede'), fecha_inicio=filtro.get('fecha_inicio'),
+                                   fecha_fin=filtro.get('fecha_fin'), riesgo=filtro.get('riesgo'),
+                                   estado=filtro.get('estado'))
+            if filtro.get('oid'):
+                stmt = stmt.where(Vulnerabilidad.oid == filtro['oid'])
+            if filtro.get('ip'):
+                stmt = stmt.where(Host.ip == filtro['ip'])
+            if filtro.get('escaneo_id'):
+                stmt = stmt.where(Host.escaneo_id == int(filtro['escaneo_id']))
+            return stmt
+
+        if filtro:
+            desconocidos = set(filtro) - FILTROS_ESTADO_MASIVO
+            if desconocidos:
+                return jsonify({'success': False, 'error': f"Filtros no válidos: {', '.join(sorted(desconocidos))}"}), 400
+
+        sedes_afectadas = db.session.execute(seleccion(Sede.nombre).distinct()).scalars().all()
+        resultado = db.session.execute(
+            update(Vulnerabilidad)
+            .where(Vulnerabilidad.id.in_(seleccion(Vulnerabilidad.id)))
+            .values(estado=nuevo_estado)
+            .execution_options(synchronize_session=False)
+        )
+        total = resultado.rowcount
+        db.session.commit()
+
+        if total:
+            cache.invalidar(*sedes_afectadas)
+            criterio = f'{len(ids)} ids' if ids else ', '.join(f'{k}={v}' for k, v in sorted(filtro.items()))
+            log_activity('bulk_update_vulnerability_status',
+                         f'Actualizó {total} vulnerabilidades a {nuevo_estado} ({criterio}; sedes: {", ".join(sedes_afectadas)})')
+        return jsonify({'success': True, 'actualizadas': total})
+
+    except (ValueError, TypeError) as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error en la actualización masiva de estado: {str(e)}", exc_info=True)
+        db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/eliminar_escaneo/<int:escaneo_id>', methods=['POST'])
@@ -611,6 +1074,7 @@ def eliminar_escaneo(escaneo_id):
 
         db.session.delete(escaneo)
         db.session.commit()
+        cache.invalidar(sede_nombre)
         log_activity('delete_scan', f'Eliminó el escaneo {escaneo_id} de la sede {sede_nombre}')
         flash(f'Escaneo de {sede_nombre} del {fecha} eliminado exitosamente', 'success')
     except Exception as e:
@@ -628,30 +1092,38 @@ def informes():
     fecha_fin = request.args.get('fecha_fin')
     riesgo = request.args.get('riesgo')
 
-    # Query base para obtener estadísticas
-    query = Vulnerabilidad.query.join(Host).join(Escaneo).join(Sede)
+    def calcular():
+        # Query base para obtener estadísticas
+        query = Vulnerabilidad.query.join(Host).join(Escaneo).join(Sede)
 
-    # Aplicar filtros
-    if sede:
-        query = query.filter(Sede.nombre == sede)
-    if fecha_inicio:
-        query = query.filter(Escaneo.fecha_escaneo >= datetime.strptime(fecha_inicio, '%Y-%m-%d').date())
-    if fecha_fin:
-        query = query.filter(Escaneo.fecha_escaneo <= datetime.strptime(fecha_fin, '%Y-%m-%d').date())
+        # Aplicar filtros
+        if sede:
+            query = query.filter(Sede.nombre == sede)
+        if fecha_inicio:
+            query = query.filter(Escaneo.fecha_escaneo >= datetime.strptime(fecha_inicio, '%Y-%m-%d').date())
+        if fecha_fin:
+            query = query.filter(Escaneo.fecha_escaneo <= datetime.strptime(fecha_fin, '%Y-%m-%d').date())
 
-    # Obtener todas las vulnerabilidades que cumplen los filtros
-    vulnerabilidades = query.all()
+        # Obtener todas las vulnerabilidades que cumplen los filtros
+        vulnerabilidades = query.all()
 
-    # Contar por criticidad
-    criticidad = {
-        'Critical': len([v for v in vulnerabilidades if v.nivel_amenaza == 'Critical']),
-        'High': len([v for v in vulnerabilidades if v.nivel_amenaza == 'High']),
-        'Medium': len([v for v in vulnerabilidades if v.nivel_amenaza == 'Medium']),
-        'Low': len([v for v in vulnerabilidades if v.nivel_amenaza == 'Low'])
-    }
+        # Contar por criticidad
+        criticidad = {
+            'Critical': len([v for v in vulnerabilidades if v.nivel_amenaza == 'Critical']),
+            'High': len([v for v in vulnerabilidades if v.nivel_amenaza == 'High']),
+            'Medium': len([v for v in vulnerabilidades if v.nivel_amenaza == 'Medium']),
+            'Low': len([v for v in vulnerabilidades if v.nivel_amenaza == 'Low'])
+        }
+
+        return list(criticidad.values())
+
+    filtros = {'sede': sede, 'fecha_inicio': fecha_inicio, 'fecha_fin': fecha_fin}
+    criticidad = cache.obtener_o_calcular('informes', filtros, calcular, sede=sede)
 
     return render_template('informes.html',
-                         criticidad=list(criticidad.values()),
+                         criticidad=criticidad,
+                         trabajos=[resumen_trabajo(t) for t in listar_trabajos(current_user.id)],
+                         programados=resumen_programados(),
                          sedes=obtener_sedes(),
                          sede_seleccionada=sede,
                          fecha_inicio=fecha_inicio,
@@ -663,7 +1135,7 @@ def generar_informe(tipo, formato):
     """
     Genera un informe en el formato especificado
     tipo: 'ejecutivo' o 'tecnico'
-    formato: 'pdf' o 'csv'
+    formato: 'pdf' o 'csv' ('parquet' solo para el técnico)
     """
     try:
         sede = request.args.get('sede')
@@ -679,53 +1151,81 @@ def generar_informe(tipo, formato):
             flash('Tipo de informe no válido', 'error')
             return redirect(url_for('informes'))
 
-        if formato not in ['pdf', 'csv']:
+        if formato not in ['pdf', 'csv', 'parquet'] or (formato == 'parquet' and tipo != 'tecnico'):
             flash('Formato de informe no válido', 'error')
             return redirect(url_for('informes'))
 
-        # Obtener datos filtrados
-        resultados = filtrar_resultados(sede, fecha_inicio, fecha_fin, riesgo)
-        logger.debug(f"Resultados obtenidos: {len(resultados)} registros")
-
-        if not resultados:
-            flash('No hay datos disponibles para generar el informe. Por favor, seleccione otros filtros.', 'warning')
+        if formato == 'parquet' and not parquet_disponible():
+            flash('La exportación a Parquet requiere el paquete pyarrow (pip install pyarrow)', 'error')
             return redirect(url_for('informes'))
 
-        # Preparar datos para el informe
-        datos_informe = {
-            'sede': sede,
-            'fecha_inicio': fecha_inicio,
-            'fecha_fin': fecha_fin,
-            'hosts_detalle': {}
-        }
+        filtros = {'sede': sede, 'fecha_inicio': fecha_inicio, 'fecha_fin': fecha_fin, 'riesgo': riesgo}
+        por_sede = tipo == 'tecnico' and formato == 'pdf' and request.args.get('por_sede') == '1'
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+        # Un informe ya generado con los mismos filtros y los mismos datos se sirve desde disco
+        clave = artefactos.clave(tipo, formato, dict(filtros, por_sede=por_sede or None), sede=sede)
+        archivo = artefactos.abrir(clave)
+        if archivo is not None:
+            return send_file(
+                archivo,
+                mimetype=TIPOS_MIME_INFORME[formato],
+                as_attachment=True,
+                download_name=f'informe_{tipo}_{timestamp}.{formato}'
+            )
 
-        for resultado in resultados:
-            datos_informe['hosts_detalle'].update(resultado['hosts_detalle'])
+        if tipo == 'tecnico' and formato == 'pdf':
+            # Puede tardar minutos: se genera en segundo plano y se descarga desde /informes
+            filtros_vista = {k: v for k, v in request.args.items() if k != 'por_sede'}
+            if vulnerabilidades_informe_tecnico(**filtros).first() is None:
+                flash('No hay datos disponibles para generar el informe. Por favor, seleccione otros filtros.', 'warning')
+                return redirect(url_for('informes', **filtros_vista))
+            try:
+                crear_trabajo(current_user.id, filtros, por_sede=por_sede, clave_cache=clave)
+            except DemasiadosTrabajos:
+                flash('Hay demasiados informes técnicos en preparación. Inténtelo de nuevo en unos minutos.', 'warning')
+                return redirect(url_for('informes', **filtros_vista))
+            flash('El informe técnico se está generando. Podrá descargarlo desde esta página cuando esté listo.', 'info')
+            return redirect(url_for('informes', **filtros_vista))
+
+        if tipo == 'tecnico':  # csv o parquet
+            from informes import generar_informe_tecnico
+            # Se envía a medida que se leen las filas, sin cargar el informe en memoria
+            vulnerabilidades = ResultadosEnStreaming(
+                vulnerabilidades_informe_tecnico(sede, fecha_inicio, fecha_fin, riesgo))
+            if not vulnerabilidades:
+                flash('No hay datos disponibles para generar el informe. Por favor, seleccione otros filtros.', 'warning')
+                return redirect(url_for('informes'))
 
-        logger.debug(f"Datos preparados: {len(datos_informe['hosts_detalle'])} hosts")
+            contenido = medir_generador(f'informe_tecnico_{formato}', generar_informe_tecnico(vulnerabilidades, tipo=formato))
+            return respuesta_en_streaming(
+                artefactos.guardar_flujo(clave, contenido),
+                mimetype=TIPOS_MIME_INFORME[formato],
+                headers={'Content-Disposition': f'attachment; filename=informe_tecnico_{timestamp}.{formato}'}
+            )
+
+        datos_informe = datos_informe_ejecutivo(sede, fecha_inicio, fecha_fin, riesgo)
+        if datos_informe is None:
+            flash('No hay datos disponibles para generar el informe. Por favor, seleccione otros filtros.', 'warning')
+            return redirect(url_for('informes'))
 
-        # Generar el informe según el tipo y formato
         try:
-            if tipo == 'ejecutivo':
-                from informes import generar_informe_ejecutivo
-                logger.debug("Iniciando generación de informe ejecutivo")
-                output = generar_informe_ejecutivo(datos_informe, tipo=formato)
-                logger.debug("Informe ejecutivo generado exitosamente")
-            else:  # técnico
-                from informes import generar_informe_tecnico
-                logger.debug("Iniciando generación de informe técnico")
-                output = generar_informe_tecnico(datos_informe, tipo=formato)
-                logger.debug("Informe técnico generado exitosamente")
+            from informes import generar_informe_ejecutivo
+            inicio = time.perf_counter()
+            logger.debug("Iniciando generación de informe ejecutivo")
+            output = generar_informe_ejecutivo(datos_informe, tipo=formato)
+            logger.debug("Informe ejecutivo generado exitosamente")
 
             if not output:
                 logger.error("La función de generación de informes retornó None")
                 flash('Error al generar el informe. No se pudo crear el archivo.', 'error')
                 return redirect(url_for('informes'))
+            registrar_trabajo(f'informe_{tipo}_{formato}', time.perf_counter() - inicio)
+            artefactos.guardar(clave, output.getvalue())
 
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             return send_file(
                 output,
-                mimetype='application/pdf' if formato == 'pdf' else 'text/csv',
+                mimetype=TIPOS_MIME_INFORME[formato],
                 as_attachment=True,
                 download_name=f'informe_{tipo}_{timestamp}.{formato}'
             )
@@ -743,13 +1243,31 @@ def generar_informe(tipo, formato):
         flash('Error al generar el informe. Por favor, inténtelo de nuevo.', 'error')
         return redirect(url_for('informes'))
 
+@app.route('/generar_paquete')
+@login_required
+def generar_paquete_informes():
+    """Lanza en segundo plano el ZIP con los informes ejecutivo y técnico en PDF de cada sede"""
+    filtros = {clave: request.args.get(clave) for clave in ('sede', 'fecha_inicio', 'fecha_fin', 'riesgo')}
+    try:
+        if not sedes_con_datos(filtros):
+            flash('No hay datos disponibles para generar el informe. Por favor, seleccione otros filtros.', 'warning')
+            return redirect(url_for('informes', **request.args))
+        crear_trabajo(current_user.id, filtros, tipo=PAQUETE)
+        flash('El paquete de informes por sede se está generando. Podrá descargarlo desde esta página cuando esté listo.', 'info')
+    except DemasiadosTrabajos:
+        flash('Hay demasiados informes en preparación. Inténtelo de nuevo en unos minutos.', 'warning')
+    except Exception as e:
+        logger.error(f"Error al lanzar el paquete de informes: {str(e)}", exc_info=True)
+        flash('Error al generar el informe. Por favor, inténtelo de nuevo.', 'error')
+    return redirect(url_for('informes', **request.args))
+
 @app.route('/exportar/<tipo>/<formato>')
 @login_required
 def exportar(tipo, formato):
     """
     Maneja la exportación de datos en diferentes formatos
     tipo: 'hosts' o 'vulnerabilidades'
-    formato: 'csv' o 'pdf'
+    formato: 'csv' o 'pdf' ('parquet' solo para vulnerabilidades)
     """
     try:
         sede = request.args.get('sede')
@@ -761,37 +1279,63 @@ def exportar(tipo, formato):
             flash('Tipo de exportación no válido', 'error')
             return redirect(url_for('dashboard'))
 
-        if formato not in ['csv', 'pdf']:
+        if formato not in ['csv', 'pdf', 'parquet'] or (formato == 'parquet' and tipo != 'vulnerabilidades'):
             flash('Formato de exportación no válido', 'error')
-            return redirect(url_for('dashboard'))# Obtener datos filtrados
+            return redirect(url_for('dashboard'))
+
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        if formato == 'parquet':
+            if not parquet_disponible():
+                flash('La exportación a Parquet requiere el paquete pyarrow (pip install pyarrow)', 'error')
+                return redirect(url_for('vulnerabilidades'))
+            filas = ResultadosEnStreaming(filas_exportar_vulnerabilidades(sede, fecha_inicio, fecha_fin, riesgo))
+            if not filas:
+                flash('No haydatos disponibles para exportar', 'warning')
+                return redirect(url_for('vulnerabilidades'))
+            # Columnas tipadas, escritas y enviadas por grupos de filas
+            return respuesta_en_streaming(
+                medir_generador('exportar_vulnerabilidades_parquet', exportar_a_parquet(filas)),
+                mimetype='application/vnd.apache.parquet',
+                headers={'Content-Disposition': f'attachment; filename={tipo}_{timestamp}.parquet'}
+            )
+
+        # Obtener datos filtrados
         if tipo == 'hosts':
-            resultados = filtrar_resultados(sede, fecha_inicio, fecha_fin, riesgo)
+            # CSV y PDF leen los hosts por lotes; el PDF se corta al pasar del máximo de filas
+            resultados = ResultadosEnStreaming(iterar_hosts_por_escaneo(sede, fecha_inicio, fecha_fin, riesgo))
             if not resultados:
                 flash('No hay datosdisponibles para exportar', 'warning')
                 return redirect(url_for('hosts'))
-            if formato == 'csv':
-                return exportar_a_csv(resultados, tipo_reporte='hosts')
-            else:  # pdf
-                return exportar_a_pdf(resultados, tipo_reporte='hosts')
         else:  # vulnerabilidades
-            query = Vulnerabilidad.query.join(Host).join(Escaneo).join(Sede)
-            if sede and sede != 'Todas las sedes':
-                query = query.filter(Sede.nombre ==sede)
-            if fecha_inicio:
-                query =query.filter(Escaneo.fecha_escaneo >= datetime.strptime(fecha_inicio, '%Y-%m-%d').date())
-            if fecha_fin:
-                query = query.filter(Escaneo.fecha_escaneo <= datetime.strptime(fecha_fin, '%Y-%m-%d').date())
-            if riesgo and riesgo != 'all':
-                query = query.filter(Vulnerabilidad.nivel_amenaza == riesgo)
-
-            vulnerabilidades = query.all()
-            if not vulnerabilidades:
+            # También el PDF las lee por lotes: se corta al pasar del máximo de filas
+            resultados = ResultadosEnStreaming(filas_exportar_vulnerabilidades(sede, fecha_inicio, fecha_fin, riesgo))
+            if not resultados:
                 flash('No haydatos disponibles para exportar', 'warning')
                 return redirect(url_for('vulnerabilidades'))
 
-            if formato== 'csv':                return exportar_a_csv(vulnerabilidades, tipo_reporte='vulnerabilidades')
-            else:  # pdf
-                return exportar_a_pdf(vulnerabilidades, tipo_reporte='vulnerabilidades')
+        if formato == 'csv':
+            # Las filas se leen por lotes y se envían a medida que se escriben
+            return respuesta_en_streaming(
+                medir_generador(f'exportar_{tipo}_csv', exportar_a_csv(resultados, tipo_reporte=tipo)),
+                mimetype='text/csv',
+                headers={'Content-Disposition': f'attachment; filename={tipo}_{timestamp}.csv'}
+            )
+
+        inicio = time.perf_counter()
+        try:
+            output = exportar_a_pdf(resultados, tipo_reporte=tipo)
+        except DemasiadasFilas as e:
+            alternativas = 'CSV' if tipo == 'hosts' else 'CSV o Parquet'
+            flash(f'La exportación tiene más de {e.maximo} filas, el máximo para PDF. '
+                  f'Descárguela en {alternativas} o acote los filtros.', 'warning')
+            return redirect(url_for(tipo, **request.args))
+        registrar_trabajo(f'exportar_{tipo}_pdf', time.perf_counter() - inicio)
+        return send_file(
+            output,
+            mimetype='application/pdf',
+            as_attachment=True,
+            download_name=f'{tipo}_{timestamp}.pdf'
+        )
 
     except Exception as e:
         logger.error(f"Error al exportar datos: {str(e)}", exc_info=True)
@@ -824,6 +1368,7 @@ def crear_sede():
 
         db.session.add(nueva_sede)
         db.session.commit()
+        cache.invalidar()
         log_activity('create_sede', f'Creó la sede {nombre}')
         flash('Sede creada exitosamente', 'success')
 
@@ -863,6 +1408,7 @@ def editar_sede(sede_id):
         sede.activa = activa
 
         db.session.commit()
+        cache.invalidar()
         log_activity('update_sede', f'Actualizó la sede {nombre}')
         flash('Sede actualizada exitosamente', 'success')
 
@@ -887,6 +1433,7 @@ def eliminar_sede(sede_id):
 
         db.session.delete(sede)
         db.session.commit()
+        cache.invalidar()
         log_activity('delete_sede', f'Eliminó la sede {sede.nombre}')
         flash('Sede eliminada exitosamente', 'success')
 
@@ -942,6 +1489,7 @@ def subir_reporte():
             logger.debug(f"Archivo guardado en: {filepath}")
 
             # Procesar el reporte
+            inicio = time.perf_counter()
             logger.debug("Iniciando análisis de vulnerabilidades")
             resultados = analizar_vulnerabilidades(filepath)
             logger.debug(f"Resultados del análisis: {resultados is not None}")
@@ -954,48 +1502,14 @@ def subir_reporte():
                 return redirect(url_for('configuracion'))
 
             try:
-                # Crear el escaneo
-                escaneo = Escaneo(
-                    sede_id=sede_id,
-                    fecha_escaneo=datetime.strptime(fecha_escaneo, '%Y-%m-%d').date()
+                escaneo, total_hosts, total_vulns = guardar_escaneo(
+                    sede_id,
+                    datetime.strptime(fecha_escaneo, '%Y-%m-%d').date(),
+                    resultados
                 )
-                db.session.add(escaneo)
-                db.session.flush()
-                logger.debug(f"Escaneo creado con ID: {escaneo.id}")
-
-                # Procesar cada host y sus vulnerabilidades
-                total_hosts = 0
-                total_vulns = 0
-                for ip, host_data in resultados['hosts_detalle'].items():
-                    logger.debug(f"Procesando host: {ip}")
-                    host = Host(
-                        ip=ip,
-                        nombre_host=host_data.get('nombre_host', ''),
-                        escaneo_id=escaneo.id
-                    )
-                    db.session.add(host)
-                    db.session.flush()
-                    total_hosts += 1
-
-                    for vuln_data in host_data.get('vulnerabilidades', []):
-                        vulnerabilidad = Vulnerabilidad(
-                            host_id=host.id,
-                            nvt=vuln_data.get('nvt', ''),
-                            oid=vuln_data.get('oid', ''),
-                            nivel_amenaza=vuln_data.get('nivel_amenaza', ''),
-                            cvss=vuln_data.get('cvss', ''),
-                            puerto=vuln_data.get('puerto', ''),
-                            resumen=vuln_data.get('resumen', ''),
-                            impacto=vuln_data.get('impacto', ''),
-                            solucion=vuln_data.get('solucion', ''),
-                            metodo_deteccion=vuln_data.get('metodo_deteccion', ''),
-                            referencias=vuln_data.get('referencias', []),
-                            estado='ACTIVA'
-                        )
-                        db.session.add(vulnerabilidad)
-                        total_vulns += 1
-
                 db.session.commit()
+                registrar_trabajo('ingesta', time.perf_counter() - inicio)
+                cache.invalidar(sede_de_escaneo(escaneo.id))
                 logger.info(f"Datos guardados exitosamente: {total_hosts} hosts, {total_vulns} vulnerabilidades")
                 log_activity('upload_report', f'Subió reporte para sede ID {sede_id}: {total_hosts} hosts, {total_vulns} vulnerabilidades')
                 flash('Reporte procesado exitosamente', 'success')
@@ -1035,6 +1549,7 @@ def toggle_sede(sede_id):
         sede = Sede.query.get_or_404(sede_id)
         sede.activa = not sede.activa
         db.session.commit()
+        cache.invalidar()
         log_activity('toggle_sede', f'Cambió el estado de la sede {sede.nombre} a {"Activa" if sede.activa else "Inactiva"}')
         flash(f'Sede {sede.nombre} {"activada" if sede.activa else "desactivada"} exitosamente', 'success')
     except Exception as e:
@@ -1048,22 +1563,8 @@ def toggle_sede(sede_id):
 def fechas_por_sede(sede):
     """Obtiene las fechas disponibles para una sede específica"""
     try:
-        query = db.session.query(Escaneo.fecha_escaneo)\
-            .join(Sede)\
-            .filter(Sede.activa == True)
-
-        if sede != 'Todas las sedes':
-            query = query.filter(Sede.nombre == sede)
-
-        # Ordenar por fecha descendente y obtener fechas únicas
-        fechas = query.order_by(Escaneo.fecha_escaneo.desc())\
-            .distinct()\
-            .all()
-
-        # Formatear las fechas como strings YYYY-MM-DD
-        fechas_formateadas = [fecha[0].strftime('%Y-%m-%d') for fecha in fechas]
-
-        return jsonify(fechas_formateadas)
+        return respuesta_json_condicional('fechas_por_sede', {'sede': sede},
+                                          lambda: consultar_fechas_sede(sede), sede=sede)
     except Exception as e:
         logger.error(f"Error al obtener fechas por sede: {str(e)}", exc_info=True)
         return jsonify([])
@@ -1113,6 +1614,7 @@ def toggle_usuario(user_id):
         usuario = User.query.get_or_404(user_id)
         usuario.is_active = not usuario.is_active
         db.session.commit()
+        cache.invalidar_usuarios()
         log_activity('toggle_user', f'Cambió el estado del usuario {usuario.username} a {"activo" if usuario.is_active else "inactivo"}')
         return jsonify({'success': True})
     except Exception as e:
@@ -1138,6 +1640,7 @@ def eliminar_usuario(user_id):
         # Eliminar el usuario
         db.session.delete(usuario)
         db.session.commit()
+        cache.invalidar_usuarios()
 
         log_activity('delete_user', f'Eliminó el usuario {username}')
         flash('Usuario eliminado exitosamente', 'success')
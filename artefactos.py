@@ -0,0 +1,182 @@
+"""
+Caché en disco de los informes generados (/generar_informe/<tipo>/<formato>).
+
+Cada archivo se guarda con una clave derivada del tipo y formato, los
+filtros normalizados y la versión de datos de la sede (la misma de la caché
+de respuestas, que incrementan las subidas, los cambios de estado y los
+borrados), así que un informe repetido con los mismos filtros se sirve
+directamente desde el archivo y nunca se sirve uno anterior a la última
+escritura. Con el backend de caché en memoria las versiones no se comparten
+entre workers y la clave incluye además la franja de CACHE_TTL, como los
+ETag (ver ResponseCache.etag).
+
+El tamaño total del directorio se acota a REPORT_CACHE_MAX_MB expulsando
+los archivos usados hace más tiempo (la fecha de modificación se actualiza
+en cada acierto). REPORT_CACHE_MAX_MB=0 o CACHE_BACKEND=none la desactivan.
+"""
+import os
+import time
+import shutil
+import logging
+import threading
+
+from cache import cache
+
+logger = logging.getLogger(__name__)
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+# Archivos temporales más antiguos que esto son restos de un proceso interrumpido
+ANTIGUEDAD_TEMPORALES = 3600
+
+
+class CacheArtefactos:
+    def __init__(self, directorio, tamano_maximo):
+        self.directorio = directorio
+        self.tamano_maximo = tamano_maximo
+
+    @property
+    def activa(self):
+        return self.tamano_maximo > 0
+
+    def clave(self, tipo, formato, filtros, sede=None):
+        """Clave del informe, o None si la caché está desactivada"""
+        if not self.activa:
+            return None
+        version = cache.etag(f'informe_{tipo}_{formato}', filtros, sede=sede)
+        return f'{tipo}_{version}.{formato}' if version else None
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, clave)
+
+    def _temporal(self, clave):
+        return f"{self._ruta(clave)}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def abrir(self, clave):
+        """Archivo abierto del informe cacheado (y lo marca como usado), o None.
+
+        Se devuelve abierto para que una expulsión simultánea no lo borre
+        entre la comprobación y el envío.
+        """
+        if clave is None:
+            return None
+        try:
+            archivo = open(self._ruta(clave), 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(self._ruta(clave))
+        except OSError:
+            pass
+        logger.debug(f"Informe servido desde la caché: {clave}")
+        return archivo
+
+    def guardar(self, clave, datos):
+        """Guarda el contenido (bytes) de un informe recién generado"""
+        if clave is None:
+            return
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            temporal = self._temporal(clave)
+            with open(temporal, 'wb') as f:
+                f.write(datos)
+            self._publicar(temporal, clave)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar el informe {clave} en la caché: {str(e)}")
+
+    def guardar_archivo(self, clave, origen):
+        """Guarda una copia de un informe ya escrito en disco"""
+        if clave is None:
+            return
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            temporal = self._temporal(clave)
+            shutil.copyfile(origen, temporal)
+            self._publicar(temporal, clave)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar el informe {clave} en la caché: {str(e)}")
+
+    def guardar_flujo(self, clave, fragmentos):
+        """
+        Envuelve el generador de una respuesta en streaming: reenvía cada
+        fragmento y a la vez lo escribe en disco. Solo se guarda si el
+        generador termina completo; si el cliente corta la descarga o hay un
+        error, el archivo parcial se descarta.
+        """
+        if clave is None:
+            yield from fragmentos
+            return
+        temporal = self._temporal(clave)
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            salida = open(temporal, 'wb')
+        except OSError as e:
+            logger.warning(f"No se pudo guardar el informe {clave} en la caché: {str(e)}")
+            yield from fragmentos
+            return
+
+        completo = False
+        try:
+            for fragmento in fragmentos:
+                if salida is not None:
+                    try:
+                        salida.write(fragmento.encode('utf-8') if isinstance(fragmento, str) else fragmento)
+                    except OSError as e:
+                        logger.warning(f"No se pudo guardar el informe {clave} en la caché: {str(e)}")
+                        salida.close()
+                        salida = None
+                yield fragmento
+            completo = salida is not None
+        finally:
+            if salida is not None:
+                salida.close()
+            try:
+                if completo:
+                    self._publicar(temporal, clave)
+                elif os.path.exists(temporal):
+                    os.remove(temporal)
+            except OSError as e:
+                logger.warning(f"No se pudo guardar el informe {clave} en la caché: {str(e)}")
+
+    def _publicar(self, temporal, clave):
+        os.replace(temporal, self._ruta(clave))
+        self._expulsar()
+
+    def _expulsar(self):
+        """Borra los archivos usados hace más tiempo hasta quedar dentro del tamaño máximo"""
+        entradas = []
+        ahora = time.time()
+        for nombre in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                estado = os.stat(ruta)
+            except FileNotFoundError:
+                continue
+            if nombre.endswith('.tmp'):
+                if ahora - estado.st_mtime > ANTIGUEDAD_TEMPORALES:
+                    self._borrar(ruta)
+                continue
+            entradas.append((estado.st_mtime, estado.st_size, ruta))
+
+        total = sum(tamano for _, tamano, _ in entradas)
+        for _, tamano, ruta in sorted(entradas):
+            if total <= self.tamano_maximo:
+                break
+            self._borrar(ruta)
+            total -= tamano
+            logger.debug(f"Informe expulsado de la caché: {os.path.basename(ruta)}")
+
+    @staticmethod
+    def _borrar(ruta):
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+
+
+def crear_cache_artefactos():
+    directorio = os.environ.get('REPORT_CACHE_DIR', os.path.join(RAIZ, 'data', 'cache_informes'))
+    tamano_maximo = int(float(os.environ.get('REPORT_CACHE_MAX_MB', 512)) * 1024 * 1024)
+    return CacheArtefactos(directorio, tamano_maximo)
+
+
+artefactos = crear_cache_artefactos()
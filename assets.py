@@ -0,0 +1,145 @@
+"""
+Archivos estáticos con huella de contenido y precomprimidos.
+
+Construcción (en el Dockerfile o tras modificar static/):
+
+    python assets.py
+
+Copia cada archivo de static/ a static/dist/ con un hash de su contenido en
+el nombre (js/charts.js -> js/charts.3f2a9c1b7d4e.js), genera las variantes
+.gz y .br (esta última si está instalado el paquete brotli) y escribe
+static/dist/manifest.json. En las plantillas, asset_url('js/charts.js')
+devuelve la URL con hash, que se sirve con Cache-Control: immutable.
+"""
+import os
+import sys
+import gzip
+import json
+import shutil
+import hashlib
+import logging
+import mimetypes
+
+from flask import Blueprint, current_app, request, send_from_directory, url_for, abort
+
+logger = logging.getLogger(__name__)
+
+DIRECTORIO_DIST = 'dist'
+NOMBRE_MANIFIESTO = 'manifest.json'
+# Un año: el nombre cambia con el contenido, así que nunca hace falta revalidar
+MAX_AGE_INMUTABLE = 365 * 24 * 3600
+# No vale la pena comprimir archivos más pequeños que esto
+TAMANO_MINIMO_COMPRESION = 512
+EXTENSIONES_COMPRIMIBLES = {'.js', '.css', '.svg', '.json', '.html', '.txt', '.map'}
+
+assets_bp = Blueprint('assets', __name__)
+
+_manifiesto = None
+
+
+def _hash_contenido(contenido):
+    return hashlib.sha256(contenido).hexdigest()[:12]
+
+
+def _comprimir(ruta, contenido):
+    with open(ruta + '.gz', 'wb') as destino:
+        # mtime=0 para que la salida sea reproducible entre construcciones
+        with gzip.GzipFile(fileobj=destino, mode='wb', compresslevel=9, mtime=0) as gz:
+            gz.write(contenido)
+    try:
+        import brotli
+    except ImportError:
+        return
+    with open(ruta + '.br', 'wb') as destino:
+        destino.write(brotli.compress(contenido, quality=11))
+
+
+def construir(directorio_static):
+    """Genera static/dist con los archivos renombrados, comprimidos y el manifiesto"""
+    destino = os.path.join(directorio_static, DIRECTORIO_DIST)
+    if os.path.isdir(destino):
+        shutil.rmtree(destino)
+    os.makedirs(destino)
+
+    manifiesto = {}
+    for raiz, directorios, archivos in os.walk(directorio_static):
+        if os.path.abspath(raiz).startswith(os.path.abspath(destino)):
+            continue
+        for nombre in sorted(archivos):
+            origen = os.path.join(raiz, nombre)
+            relativa = os.path.relpath(origen, directorio_static).replace(os.sep, '/')
+            with open(origen, 'rb') as f:
+                contenido = f.read()
+
+            base, extension = os.path.splitext(relativa)
+            con_hash = f'{base}.{_hash_contenido(contenido)}{extension}'
+            ruta = os.path.join(destino, con_hash)
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            with open(ruta, 'wb') as f:
+                f.write(contenido)
+            if extension in EXTENSIONES_COMPRIMIBLES and len(contenido) >= TAMANO_MINIMO_COMPRESION:
+                _comprimir(ruta, contenido)
+            manifiesto[relativa] = con_hash
+
+    with open(os.path.join(destino, NOMBRE_MANIFIESTO), 'w') as f:
+        json.dump(manifiesto, f, indent=2, sort_keys=True)
+    return manifiesto
+
+
+def _directorio_dist():
+    return os.path.join(current_app.static_folder, DIRECTORIO_DIST)
+
+
+def cargar_manifiesto():
+    """Lee el manifiesto una vez por proceso (en modo debug, en cada llamada)"""
+    global _manifiesto
+    if _manifiesto is None or current_app.debug:
+        try:
+            with open(os.path.join(_directorio_dist(), NOMBRE_MANIFIESTO)) as f:
+                _manifiesto = json.load(f)
+        except FileNotFoundError:
+            logger.warning("No existe static/dist/manifest.json, ejecute 'python assets.py'. Se usan los archivos sin hash")
+            _manifiesto = {}
+    return _manifiesto
+
+
+@assets_bp.app_template_global()
+def asset_url(filename):
+    """URL con hash de un archivo de static/, o la URL normal si no está construido"""
+    con_hash = cargar_manifiesto().get(filename)
+    if con_hash is None:
+        return url_for('static', filename=filename)
+    return url_for('assets.servir_asset', filename=con_hash)
+
+
+@assets_bp.route('/assets/<path:filename>')
+def servir_asset(filename):
+    """Sirve un archivo con hash, precomprimido si el cliente lo acepta"""
+    directorio = _directorio_dist()
+    if filename == NOMBRE_MANIFIESTO or filename.endswith(('.gz', '.br')):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    aceptadas = request.accept_encodings
+    servido = filename
+    codificacion = None
+    for candidata, extension in (('br', '.br'), ('gzip', '.gz')):
+        if aceptadas[candidata] and os.path.isfile(os.path.join(directorio, filename + extension)):
+            servido = filename + extension
+            codificacion = candidata
+            break
+
+    respuesta = send_from_directory(directorio, servido, mimetype=mimetype, max_age=MAX_AGE_INMUTABLE)
+    if codificacion:
+        respuesta.headers['Content-Encoding'] = codificacion
+    respuesta.vary.add('Accept-Encoding')
+    respuesta.cache_control.public = True
+    respuesta.cache_control.immutable = True
+    return respuesta
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    directorio = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    generados = construir(directorio)
+    logger.info(f"{len(generados)} archivos generados en {os.path.join(directorio, DIRECTORIO_DIST)}")
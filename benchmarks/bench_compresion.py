@@ -0,0 +1,122 @@
+"""
+Mide bytes transferidos y latencia con y sin compresión sobre un enlace lento.
+
+Levanta la aplicación en un servidor local y, delante, un proxy TCP que
+limita el ancho de banda de bajada y añade latencia, para simular el acceso
+de una sede remota por VPN. Cada URL se pide sin compresión (identity), con
+gzip y, si está instalado el paquete brotli, con br.
+
+Uso:
+    DATABASE_URL=... BENCH_USUARIO=admin BENCH_PASSWORD=... \\
+        python benchmarks/bench_compresion.py --kbps 2000 --rtt-ms 80 \\
+        --url /hosts --url /vulnerabilidades
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import http.client
+import statistics
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from werkzeug.serving import make_server  # noqa: E402
+
+from app import app  # noqa: E402
+from compresion import brotli  # noqa: E402
+
+
+class ProxyLento:
+    """Proxy TCP que limita la bajada a ``kbps`` y retrasa cada conexión ``rtt_ms``"""
+
+    def __init__(self, destino, kbps, rtt_ms):
+        self.destino = destino
+        self.bytes_por_segundo = kbps * 1000 / 8
+        self.rtt = rtt_ms / 1000
+        self.servidor = socket.create_server(('127.0.0.1', 0))
+        self.puerto = self.servidor.getsockname()[1]
+        threading.Thread(target=self._aceptar, daemon=True).start()
+
+    def _aceptar(self):
+        while True:
+            cliente, _ = self.servidor.accept()
+            threading.Thread(target=self._atender, args=(cliente,), daemon=True).start()
+
+    def _atender(self, cliente):
+        time.sleep(self.rtt)
+        servidor = socket.create_connection(self.destino)
+        threading.Thread(target=self._reenviar, args=(cliente, servidor, False), daemon=True).start()
+        self._reenviar(servidor, cliente, True)
+
+    def _reenviar(self, origen, destino, limitar):
+        try:
+            while True:
+                datos = origen.recv(16384)
+                if not datos:
+                    break
+                if limitar:
+                    time.sleep(len(datos) / self.bytes_por_segundo)
+                destino.sendall(datos)
+        except OSError:
+            pass
+        finally:
+            for s in (origen, destino):
+                try:
+                    s.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+def pedir(puerto, metodo, url, headers=None, cuerpo=None):
+    conexion = http.client.HTTPConnection('127.0.0.1', puerto, timeout=600)
+    conexion.request(metodo, url, body=cuerpo, headers=headers or {})
+    respuesta = conexion.getresponse()
+    datos = respuesta.read()
+    conexion.close()
+    return respuesta, datos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--kbps', type=int, default=2000, help='ancho de banda de bajada en kbit/s')
+    parser.add_argument('--rtt-ms', type=int, default=80)
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--url', action='append', dest='urls')
+    args = parser.parse_args()
+    urls = args.urls or ['/hosts', '/vulnerabilidades', '/comparacion/matriz']
+
+    servidor = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    proxy = ProxyLento(('127.0.0.1', servidor.server_port), args.kbps, args.rtt_ms)
+
+    respuesta, _ = pedir(servidor.server_port, 'POST', '/login',
+                         headers={'Content-Type': 'application/x-www-form-urlencoded'},
+                         cuerpo=urlencode({
+                             'username': os.environ.get('BENCH_USUARIO', 'admin'),
+                             'password': os.environ.get('BENCH_PASSWORD', ''),
+                         }))
+    if respuesta.status != 302:
+        sys.exit('No se pudo iniciar sesión; revisar BENCH_USUARIO y BENCH_PASSWORD')
+    cookie = respuesta.getheader('Set-Cookie').split(';', 1)[0]
+
+    codificaciones = ['identity', 'gzip'] + (['br'] if brotli is not None else [])
+    print(f"Enlace simulado: {args.kbps} kbit/s, RTT {args.rtt_ms} ms")
+    print(f"{'url':<30} {'codificación':<12} {'estado':>6} {'bytes':>10} {'p50 ms':>10}")
+    for url in urls:
+        for codificacion in codificaciones:
+            tiempos = []
+            for _ in range(args.repeticiones):
+                inicio = time.perf_counter()
+                respuesta, datos = pedir(proxy.puerto, 'GET', url,
+                                         headers={'Cookie': cookie, 'Accept-Encoding': codificacion})
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+            print(f"{url:<30} {codificacion:<12} {respuesta.status:>6} {len(datos):>10} {statistics.median(tiempos):>10.0f}")
+
+    servidor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Mide el efecto de los ETag en /tendencias y /fechas_por_sede.
+
+Compara, para cada endpoint, tres situaciones sobre la base configurada en
+DATABASE_URL: respuesta completa sin caché, respuesta completa con caché
+caliente y revalidación con If-None-Match (304). Usa el cliente de pruebas
+de Flask, por lo que los tiempos son de servidor, sin red.
+
+Uso:
+    DATABASE_URL=... BENCH_USUARIO=admin BENCH_PASSWORD=... \\
+        python benchmarks/bench_etag.py --repeticiones 200 --sede "Sede Central"
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import app  # noqa: E402
+from cache import cache  # noqa: E402
+
+
+def medir(cliente, url, repeticiones, headers=None, limpiar_cache=False):
+    tiempos = []
+    bytes_totales = 0
+    estado = None
+    for _ in range(repeticiones):
+        if limpiar_cache and cache.activa:
+            cache.backend.clear()
+        inicio = time.perf_counter()
+        respuesta = cliente.get(url, headers=headers or {})
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+        bytes_totales += len(respuesta.get_data())
+        estado = respuesta.status_code
+    return {
+        'estado': estado,
+        'p50_ms': statistics.median(tiempos),
+        'media_ms': statistics.mean(tiempos),
+        'bytes': bytes_totales // repeticiones,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeticiones', type=int, default=200)
+    parser.add_argument('--sede', default='Todas las sedes')
+    args = parser.parse_args()
+
+    cliente = app.test_client()
+    respuesta = cliente.post('/login', data={
+        'username': os.environ.get('BENCH_USUARIO', 'admin'),
+        'password': os.environ.get('BENCH_PASSWORD', ''),
+    })
+    if respuesta.status_code != 302:
+        sys.exit('No se pudo iniciar sesión; revisar BENCH_USUARIO y BENCH_PASSWORD')
+
+    urls = [f'/fechas_por_sede/{args.sede}', '/tendencias']
+    if args.sede != 'Todas las sedes':
+        urls[1] += f'?sede={args.sede}'
+
+    print(f"{'endpoint':<40} {'caso':<14} {'estado':>6} {'p50 ms':>9} {'media ms':>9} {'bytes':>8}")
+    for url in urls:
+        etag = cliente.get(url).headers.get('ETag')
+        casos = [
+            ('sin caché', medir(cliente, url, args.repeticiones, limpiar_cache=True)),
+            ('caché', medir(cliente, url, args.repeticiones)),
+        ]
+        if etag:
+            casos.append(('304', medir(cliente, url, args.repeticiones, headers={'If-None-Match': etag})))
+        for nombre, r in casos:
+            print(f"{url:<40} {nombre:<14} {r['estado']:>6} {r['p50_ms']:>9.3f} {r['media_ms']:>9.3f} {r['bytes']:>8}")
+
+
+if __name__ == '__main__':
+    main()
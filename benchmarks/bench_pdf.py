@@ -0,0 +1,63 @@
+"""
+Mide el tiempo, el tamaño y la memoria de la exportación de vulnerabilidades
+en PDF según el número de filas.
+
+Las filas son sintéticas (con la forma de filas_exportar_vulnerabilidades),
+así que no hace falta base de datos, y se exportan sin el máximo de
+PDF_EXPORT_MAX_ROWS para ver cómo crece el tiempo más allá de él. La memoria
+es el pico del proceso, por lo que cada tamaño se mide en un proceso aparte.
+
+Uso:
+    python benchmarks/bench_pdf.py --filas 1000,10000,100000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import resource
+import subprocess
+from collections import namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from exportar import exportar_a_pdf  # noqa: E402
+
+Fila = namedtuple('Fila', 'sede fecha_escaneo ip nombre_host nivel_amenaza cvss puerto estado nvt resumen')
+NIVELES = ['Critical', 'High', 'Medium', 'Low']
+
+
+def filas_sinteticas(numero):
+    aleatorio = random.Random(numero)
+    for i in range(numero):
+        yield Fila('Sede 01', '2024-01-01', f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}',
+                   f'host-{i}.corp.ejemplo.local', aleatorio.choice(NIVELES),
+                   round(aleatorio.uniform(0, 10), 1), f'{aleatorio.randint(1, 65535)}/tcp', 'ACTIVA',
+                   'SSL/TLS: Report Weak Cipher Suites', 'Resumen del hallazgo')
+
+
+def medir(numero):
+    inicio = time.perf_counter()
+    salida = exportar_a_pdf(filas_sinteticas(numero), 'vulnerabilidades', maximo_filas=None)
+    segundos = time.perf_counter() - inicio
+    memoria = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+    print(f"{numero:>10} {segundos:>10.2f} {numero / segundos:>10.0f} "
+          f"{len(salida.getvalue()) // 1024:>10} {memoria:>10}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', default='1000,10000,100000', help='tamaños separados por comas')
+    parser.add_argument('--solo', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.solo:
+        medir(args.solo)
+        return
+
+    print(f"{'filas':>10} {'segundos':>10} {'filas/s':>10} {'KB':>10} {'pico MB':>10}", flush=True)
+    for numero in (int(n) for n in args.filas.split(',')):
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--solo', str(numero)], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""
+Prueba de carga de extremo a extremo con percentiles por ruta.
+
+Cada usuario virtual es un hilo con su propia sesión (inicia sesión una vez)
+que pide rutas al azar según los pesos de MEZCLA: dashboard, hosts,
+vulnerabilidades, tendencias, comparación, matriz, informes, exportaciones
+y subidas de reportes. Se ejecuta una fase por cada nivel de --concurrencia
+y se muestran p50/p95/p99 por ruta. Las sedes y fechas de escaneo se leen
+de la base (DATABASE_URL), así que conviene poblarla antes con:
+
+    flask sembrar-datos --sedes 5 --escaneos 12 --hosts 250
+
+Uso:
+    DATABASE_URL=... BENCH_USUARIO=admin BENCH_PASSWORD=... \\
+        python benchmarks/carga.py --concurrencia 1,8,32 --duracion 60 --salida base.json
+    # tras un cambio, comparar contra la línea base:
+    python benchmarks/carga.py --concurrencia 1,8,32 --duracion 60 --base base.json
+
+Sin --url se levanta la aplicación en un servidor local con hilos; con
+--url http://host:5000 se prueba una instancia ya desplegada (gunicorn).
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import http.client
+from urllib.parse import urlencode, urlsplit
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from werkzeug.serving import make_server  # noqa: E402
+
+from app import app  # noqa: E402
+from database import db  # noqa: E402
+from models import Sede, Escaneo  # noqa: E402
+from datos_prueba import crear_catalogo, SedeSintetica, como_reporte_txt  # noqa: E402
+
+# (ruta, peso): proporción aproximada de un día de uso
+MEZCLA = (
+    ('dashboard', 20),
+    ('hosts', 12),
+    ('vulnerabilidades', 12),
+    ('busqueda', 4),
+    ('tendencias', 10),
+    ('comparacion', 10),
+    ('matriz', 5),
+    ('informe_ejecutivo_pdf', 3),
+    ('informe_tecnico_csv', 2),
+    ('exportar_hosts_csv', 2),
+    ('exportar_vulnerabilidades_csv', 2),
+    ('subir_reporte', 1),
+)
+# Las subidas terminan en una redirección a /configuracion; el resto debe responder 200
+ESTADO_ESPERADO = {'subir_reporte': 302}
+HOSTS_POR_SUBIDA = 50
+
+
+def percentil(valores, p):
+    """Percentil por rango más cercano de una lista ordenada"""
+    if not valores:
+        return float('nan')
+    indice = max(0, min(len(valores) - 1, int(round(p / 100 * len(valores) + 0.5)) - 1))
+    return valores[indice]
+
+
+class Escenario:
+    """Sedes, escaneos y reportes de subida disponibles para armar las peticiones"""
+
+    def __init__(self, semilla):
+        with app.app_context():
+            self.sedes = [(s.id, s.nombre) for s in Sede.query.filter_by(activa=True).order_by(Sede.id)]
+            fechas = defaultdict(list)
+            consulta = db.session.query(Sede.nombre, Escaneo.fecha_escaneo).join(Escaneo.sede)
+            for nombre, fecha in consulta:
+                fechas[nombre].append(str(fecha))
+        self.fechas = {nombre: sorted(set(lista)) for nombre, lista in fechas.items()}
+        if not self.fechas:
+            sys.exit('No hay escaneos en la base: ejecutar antes flask sembrar-datos')
+        rng = random.Random(semilla)
+        sintetica = SedeSintetica(rng, 200, HOSTS_POR_SUBIDA, 12, crear_catalogo(rng))
+        self.reporte = como_reporte_txt(sintetica.siguiente_escaneo()).encode()
+        self._subidas = 0
+        self._lock = threading.Lock()
+
+    def peticion(self, ruta, rng):
+        """(método, url, cuerpo, cabeceras) de una petición de la ruta indicada"""
+        sede = rng.choice(list(self.fechas))
+        fechas = self.fechas[sede]
+        if ruta == 'dashboard':
+            return 'GET', '/dashboard', None, {}
+        if ruta == 'hosts':
+            return 'GET', '/hosts?' + urlencode({'sede': sede}), None, {}
+        if ruta == 'vulnerabilidades':
+            return 'GET', '/vulnerabilidades?' + urlencode({'sede': sede, 'riesgo': rng.choice(['Critical', 'High'])}), None, {}
+        if ruta == 'busqueda':
+            return 'GET', '/vulnerabilidades?' + urlencode({'q': rng.choice(['OpenSSH', 'remote code', 'TLS cipher'])}), None, {}
+        if ruta == 'tendencias':
+            return 'GET', '/tendencias?' + urlencode({'sede': sede}), None, {}
+        if ruta == 'comparacion':
+            primera, segunda = (fechas[-2], fechas[-1]) if len(fechas) > 1 else (fechas[0], fechas[0])
+            return 'GET', '/comparacion?' + urlencode({'sede1': sede, 'fecha1': primera,
+                                                       'sede2': sede, 'fecha2': segunda}), None, {}
+        if ruta == 'matriz':
+            return 'GET', '/comparacion/matriz?' + urlencode({'modo': 'historial', 'sede': sede}), None, {}
+        if ruta == 'informe_ejecutivo_pdf':
+            return 'GET', '/generar_informe/ejecutivo/pdf?' + urlencode({'sede': sede, 'fecha_inicio': fechas[-1]}), None, {}
+        if ruta == 'informe_tecnico_csv':
+            return 'GET', '/generar_informe/tecnico/csv?' + urlencode({'sede': sede, 'fecha_inicio': fechas[-1]}), None, {}
+        if ruta == 'exportar_hosts_csv':
+            return 'GET', '/exportar/hosts/csv?' + urlencode({'sede': sede, 'fecha_inicio': fechas[-1]}), None, {}
+        if ruta == 'exportar_vulnerabilidades_csv':
+            return 'GET', '/exportar/vulnerabilidades/csv?' + urlencode({'sede': sede, 'fecha_inicio': fechas[-1]}), None, {}
+        if ruta == 'subir_reporte':
+            return self._subida()
+        raise ValueError(ruta)
+
+    def _subida(self):
+        with self._lock:
+            self._subidas += 1
+            numero = self._subidas
+        sede_id = self.sedes[0][0]
+        # Fechas antiguas y distintas para no mezclarse con los escaneos sembrados
+        fecha = time.strftime('%Y-%m-%d', time.gmtime(86400 * (numero % 3650)))
+        limite = f'----carga{random.getrandbits(64):x}'
+        cuerpo = (
+            f'--{limite}\r\nContent-Disposition: form-data; name="sede_id"\r\n\r\n{sede_id}\r\n'
+            f'--{limite}\r\nContent-Disposition: form-data; name="fecha_escaneo"\r\n\r\n{fecha}\r\n'
+            f'--{limite}\r\nContent-Disposition: form-data; name="archivo"; filename="carga_{numero}.txt"\r\n'
+            f'Content-Type: text/plain\r\n\r\n'
+        ).encode() + self.reporte + f'\r\n--{limite}--\r\n'.encode()
+        return 'POST', '/subir_reporte', cuerpo, {'Content-Type': f'multipart/form-data; boundary={limite}'}
+
+
+class Cliente:
+    """Conexión keep-alive con su propia cookie de sesión"""
+
+    def __init__(self, destino, usuario, password):
+        self.destino = destino
+        self.conexion = None
+        self.cookie = None
+        estado, _ = self.pedir('POST', '/login', urlencode({'username': usuario, 'password': password}).encode(),
+                               {'Content-Type': 'application/x-www-form-urlencoded'})
+        if estado != 302 or not self.cookie:
+            raise RuntimeError('No se pudo iniciar sesión; revisar BENCH_USUARIO y BENCH_PASSWORD')
+
+    def pedir(self, metodo, url, cuerpo=None, cabeceras=None):
+        cabeceras = dict(cabeceras or {})
+        cabeceras['Accept-Encoding'] = 'gzip'
+        if self.cookie:
+            cabeceras['Cookie'] = self.cookie
+        for intento in (1, 2):
+            if self.conexion is None:
+                self.conexion = http.client.HTTPConnection(*self.destino, timeout=600)
+            try:
+                self.conexion.request(metodo, url, body=cuerpo, headers=cabeceras)
+                respuesta = self.conexion.getresponse()
+                datos = respuesta.read()
+                break
+            except (http.client.HTTPException, OSError):
+                # El servidor puede cerrar una conexión keep-alive inactiva: reintentar una vez
+                self.conexion.close()
+                self.conexion = None
+                if intento == 2:
+                    raise
+        cookie = respuesta.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        if respuesta.getheader('Connection', '').lower() == 'close':
+            self.conexion.close()
+            self.conexion = None
+        return respuesta.status, len(datos)
+
+
+def fase(destino, escenario, concurrencia, duracion, usuario, password, semilla):
+    """Ejecuta ``concurrencia`` usuarios durante ``duracion`` segundos; devuelve las muestras por ruta"""
+    rutas = [ruta for ruta, _ in MEZCLA]
+    pesos = [peso for _, peso in MEZCLA]
+    muestras = defaultdict(list)
+    errores = defaultdict(int)
+    lock = threading.Lock()
+    fin = time.monotonic() + duracion
+
+    def usuario_virtual(numero):
+        rng = random.Random(semilla * 1000 + numero)
+        cliente = Cliente(destino, usuario, password)
+        while time.monotonic() < fin:
+            ruta = rng.choices(rutas, pesos)[0]
+            metodo, url, cuerpo, cabeceras = escenario.peticion(ruta, rng)
+            inicio = time.perf_counter()
+            try:
+                estado, _ = cliente.pedir(metodo, url, cuerpo, cabeceras)
+            except Exception:
+                estado = None
+            ms = (time.perf_counter() - inicio) * 1000
+            with lock:
+                muestras[ruta].append(ms)
+                if estado != ESTADO_ESPERADO.get(ruta, 200):
+                    errores[ruta] += 1
+
+    hilos = [threading.Thread(target=usuario_virtual, args=(i,), daemon=True) for i in range(concurrencia)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    resumen = {}
+    for ruta in rutas:
+        valores = sorted(muestras.get(ruta, []))
+        resumen[ruta] = {
+            'n': len(valores),
+            'errores': errores.get(ruta, 0),
+            'p50': percentil(valores, 50),
+            'p95': percentil(valores, 95),
+            'p99': percentil(valores, 99),
+            'max': valores[-1] if valores else float('nan'),
+        }
+    total = sum(r['n'] for r in resumen.values())
+    return {'concurrencia': concurrencia, 'peticiones_por_segundo': total / duracion, 'rutas': resumen}
+
+
+def imprimir(resultado, base=None):
+    print(f"\nConcurrencia {resultado['concurrencia']}: {resultado['peticiones_por_segundo']:.1f} peticiones/s")
+    cabecera = f"{'ruta':<32} {'n':>6} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    if base:
+        cabecera += f" {'Δ p95':>8}"
+    print(cabecera)
+    for ruta, r in resultado['rutas'].items():
+        linea = (f"{ruta:<32} {r['n']:>6} {r['errores']:>5} {r['p50']:>9.0f} {r['p95']:>9.0f} "
+                 f"{r['p99']:>9.0f} {r['max']:>9.0f}")
+        anterior = (base or {}).get(ruta)
+        if anterior and anterior['n'] and r['n']:
+            linea += f" {(r['p95'] / anterior['p95'] - 1) * 100:>+7.0f}%"
+        print(linea)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='instancia a probar (por defecto, un servidor local)')
+    parser.add_argument('--concurrencia', default='1,8,32', help='usuarios simultáneos por fase, separados por comas')
+    parser.add_argument('--duracion', type=float, default=60, help='segundos por fase')
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--salida', help='guardar los resultados en JSON (línea base)')
+    parser.add_argument('--base', help='JSON de una ejecución anterior para comparar el p95')
+    args = parser.parse_args()
+
+    usuario = os.environ.get('BENCH_USUARIO', 'admin')
+    password = os.environ.get('BENCH_PASSWORD', '')
+    escenario = Escenario(args.semilla)
+
+    servidor = None
+    if args.url:
+        partes = urlsplit(args.url)
+        destino = (partes.hostname, partes.port or 80)
+    else:
+        servidor = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        destino = ('127.0.0.1', servidor.server_port)
+
+    base = {}
+    if args.base:
+        with open(args.base) as f:
+            base = {r['concurrencia']: r['rutas'] for r in json.load(f)['fases']}
+
+    fases = []
+    for concurrencia in (int(c) for c in args.concurrencia.split(',')):
+        resultado = fase(destino, escenario, concurrencia, args.duracion, usuario, password, args.semilla)
+        imprimir(resultado, base.get(concurrencia))
+        fases.append(resultado)
+
+    if args.salida:
+        with open(args.salida, 'w') as f:
+            json.dump({'url': args.url or 'local', 'duracion': args.duracion, 'fases': fases}, f, indent=2)
+    if servidor is not None:
+        servidor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
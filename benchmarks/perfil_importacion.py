@@ -0,0 +1,68 @@
+"""
+Mide cuánto tarda en importarse cada módulo y qué dependencias pesan más.
+
+Lanza ``python -X importtime -c "import <módulo>"`` varias veces en procesos
+nuevos (sin caché de módulos) y muestra la mediana del tiempo total y las
+dependencias de primer nivel más lentas de la última ejecución. Sirve para
+comprobar que Flask arranca sin cargar reportlab.
+
+Uso:
+    DATABASE_URL=... python benchmarks/perfil_importacion.py app informes exportar
+"""
+import os
+import re
+import sys
+import argparse
+import statistics
+import subprocess
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# "import time:      self [us] |   cumulative | imported package"
+LINEA = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def medir(modulo):
+    """Devuelve (total en ms, [(acumulado en ms, dependencia)] importadas por el módulo)"""
+    proceso = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {modulo}'],
+                             cwd=RAIZ, env=os.environ, capture_output=True, text=True)
+    if proceso.returncode != 0:
+        sys.exit(f"Error al importar {modulo}:\n{proceso.stderr[-2000:]}")
+    total = 0
+    dependencias = []
+    for linea in proceso.stderr.splitlines():
+        coincidencia = LINEA.match(linea)
+        if not coincidencia:
+            continue
+        acumulado = int(coincidencia.group(2)) / 1000
+        sangria = len(coincidencia.group(3))
+        # Un espacio: importado por el intérprete o por -c; tres: por esos módulos
+        if sangria == 1:
+            total += acumulado
+        elif sangria == 3:
+            dependencias.append((acumulado, coincidencia.group(4)))
+    return total, dependencias
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('modulos', nargs='*', default=['app', 'informes', 'exportar'])
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--top', type=int, default=8, help='dependencias más lentas a mostrar')
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        sys.exit('Definir DATABASE_URL (basta una base SQLite vacía)')
+
+    for modulo in args.modulos:
+        totales = []
+        for _ in range(args.repeticiones):
+            total, dependencias = medir(modulo)
+            totales.append(total)
+        print(f"{modulo}: {statistics.median(totales):.0f} ms (mediana de {args.repeticiones})")
+        for ms, nombre in sorted(dependencias, reverse=True)[:args.top]:
+            print(f"    {ms:>8.1f} ms  {nombre}")
+
+
+if __name__ == '__main__':
+    main()
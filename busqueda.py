@@ -0,0 +1,27 @@
+from sqlalchemy import func, literal_column
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+# Debe coincidir con la configuración usada en la columna generada (database.DDL_POSTGRESQL)
+CONFIGURACION_TS = 'english'
+
+# Columna generada que no forma parte del modelo para que el ORM no la cargue
+columna_busqueda = literal_column('vulnerabilidades.busqueda', type_=TSVECTOR)
+
+
+def _tsquery(texto):
+    # websearch_to_tsquery acepta "frase exacta", -excluir y OR sin errores de sintaxis
+    return func.websearch_to_tsquery(CONFIGURACION_TS, texto)
+
+
+def relevancia_busqueda(texto):
+    """Expresión de relevancia (mayor es mejor) para ordenar los resultados"""
+    return func.ts_rank_cd(columna_busqueda, _tsquery(texto))
+
+
+def aplicar_busqueda(query, texto):
+    """
+    Filtra una consulta sobre vulnerabilidades por texto completo (nvt, resumen,
+    solución y referencias) usando el índice GIN.
+    Retorna la consulta filtrada y la expresión de relevancia para ordenar.
+    """
+    return query.filter(columna_busqueda.op('@@')(_tsquery(texto))), relevancia_busqueda(texto)
@@ -0,0 +1,267 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Contadores de versión de datos. 'global' cambia con cualquier escritura,
+# 'estructura' con los cambios de sedes (alta, baja, renombrado, activación)
+# y 'sede:<nombre>' con las escrituras sobre los escaneos de esa sede.
+VERSION_GLOBAL = 'global'
+VERSION_ESTRUCTURA = 'estructura'
+# Contador independiente para la identidad de los usuarios en sesión
+VERSION_USUARIOS = 'usuarios'
+
+# Valores de sede que equivalen a "todas las sedes"
+SEDES_NEUTRAS = (None, '', 'Todas las sedes')
+
+
+class MemoryBackend:
+    """Backend en memoria del proceso con expulsión LRU y expiración por TTL.
+
+    Cada worker de gunicorn tiene su propia copia; las invalidaciones hechas
+    en un worker no llegan a los demás, que pueden servir datos obsoletos
+    hasta que expire el TTL. Para varios workers usar RedisBackend.
+    """
+
+    compartido = False
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._versiones = {}
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            expira, valor = entrada
+            if expira < time.monotonic():
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return valor
+
+    def set(self, clave, valor, ttl=None):
+        expira = time.monotonic() + (ttl or self.ttl)
+        with self._lock:
+            self._datos[clave] = (expira, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entries:
+                self._datos.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+
+    def versiones(self, nombres):
+        with self._lock:
+            return [self._versiones.get(nombre, 0) for nombre in nombres]
+
+    def incrementar(self, nombres):
+        with self._lock:
+            for nombre in nombres:
+                self._versiones[nombre] = self._versiones.get(nombre, 0) + 1
+
+
+class RedisBackend:
+    """Backend compartido entre workers sobre Redis.
+
+    Los valores se guardan como JSON con expiración (SETEX). La expulsión LRU
+    queda a cargo del servidor: configurar ``maxmemory`` y
+    ``maxmemory-policy volatile-lru`` en redis.conf, que solo expulsa claves
+    con expiración (las entradas) y nunca los contadores de versión.
+
+    Si los contadores se pierden igualmente (un reinicio de Redis sin
+    persistencia, una política ``allkeys-*``), volverían a 0 y las claves y
+    ETag antiguos, también los de la caché de informes en disco, serían
+    válidos de nuevo. Por eso cada versión incluye una época: un valor
+    aleatorio creado con SETNX que desaparece junto con los contadores y se
+    crea otro distinto en la siguiente lectura.
+    """
+
+    compartido = True
+
+    def __init__(self, url, ttl=300, prefijo='sectracker:'):
+        import redis
+
+        self.ttl = ttl
+        self.prefijo = prefijo
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self._redis.ping()
+        self._epoca()
+
+    def _epoca(self):
+        clave = f'{self.prefijo}epoca'
+        # Entre varios workers gana el primero; el resto lee la suya
+        self._redis.set(clave, uuid.uuid4().hex[:12], nx=True)
+        return self._redis.get(clave).decode()
+
+    def get(self, clave):
+        valor = self._redis.get(f'{self.prefijo}c:{clave}')
+        return json.loads(valor) if valor is not None else None
+
+    def set(self, clave, valor, ttl=None):
+        self._redis.set(f'{self.prefijo}c:{clave}', json.dumps(valor), ex=ttl or self.ttl)
+
+    def clear(self):
+        for clave in self._redis.scan_iter(f'{self.prefijo}c:*'):
+            self._redis.delete(clave)
+
+    def versiones(self, nombres):
+        epoca, *valores = self._redis.mget([f'{self.prefijo}epoca'] +
+                                           [f'{self.prefijo}v:{nombre}' for nombre in nombres])
+        epoca = epoca.decode() if epoca is not None else self._epoca()
+        return [epoca] + [int(v) if v is not None else 0 for v in valores]
+
+    def incrementar(self, nombres):
+        pipe = self._redis.pipeline()
+        for nombre in nombres:
+            pipe.incr(f'{self.prefijo}v:{nombre}')
+        pipe.execute()
+
+
+class ResponseCache:
+    """Caché de resultados de agregados indexada por endpoint, filtros
+    normalizados y la versión de datos de las sedes involucradas.
+
+    Las rutas de escritura llaman a ``invalidar`` después del commit; las
+    claves antiguas dejan de consultarse y terminan expulsadas por LRU/TTL.
+    Cualquier error del backend se trata como un fallo de caché.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+
+    @property
+    def activa(self):
+        return self.backend is not None
+
+    @staticmethod
+    def normalizar_filtros(filtros):
+        """Descarta los filtros vacíos y devuelve una representación estable"""
+        limpios = {k: str(v) for k, v in (filtros or {}).items() if v not in (None, '')}
+        return json.dumps(limpios, sort_keys=True, ensure_ascii=False)
+
+    @staticmethod
+    def _nombres_version(sede=None):
+        if sede in SEDES_NEUTRAS:
+            return [VERSION_GLOBAL]
+        return [VERSION_ESTRUCTURA, f'sede:{sede}']
+
+    def version(self, sede=None, versiones=None):
+        """Devuelve la versión de datos que afecta a una sede (o a todas).
+
+        ``versiones`` permite indicar directamente los contadores a usar
+        para datos que no dependen de las sedes.
+        """
+        if not self.activa:
+            return None
+        try:
+            nombres = versiones or self._nombres_version(sede)
+            return '.'.join(str(v) for v in self.backend.versiones(nombres))
+        except Exception as e:
+            logger.warning(f"Caché no disponible al leer versiones: {str(e)}")
+            return None
+
+    def clave(self, endpoint, filtros, version):
+        base = f'{endpoint}|{self.normalizar_filtros(filtros)}|{version}'
+        return f'{endpoint}:{hashlib.sha1(base.encode("utf-8")).hexdigest()}'
+
+    def etag(self, endpoint, filtros, sede=None):
+        """ETag fuerte derivado de la versión de datos, sin consultar la base.
+
+        Con un backend no compartido las versiones de cada worker divergen,
+        así que se añade una franja temporal de duración TTL para acotar el
+        tiempo en que un worker puede responder 304 con datos obsoletos.
+        """
+        version = self.version(sede)
+        if version is None:
+            return None
+        if not self.backend.compartido:
+            version = f'{version}.t{int(time.time() // self.backend.ttl)}'
+        return self.clave(endpoint, filtros, version).split(':', 1)[1]
+
+    def obtener_o_calcular(self, endpoint, filtros, calcular, sede=None, ttl=None, versiones=None):
+        """Devuelve el valor cacheado o lo calcula y lo guarda.
+
+        ``calcular`` debe devolver un valor serializable a JSON.
+        """
+        version = self.version(sede, versiones)
+        if version is None:
+            return calcular()
+
+        clave = self.clave(endpoint, filtros, version)
+        try:
+            valor = self.backend.get(clave)
+        except Exception as e:
+            logger.warning(f"Error al leer de la caché: {str(e)}")
+            return calcular()
+        if valor is not None:
+            return valor
+
+        valor = calcular()
+        try:
+            self.backend.set(clave, valor, ttl)
+        except Exception as e:
+            logger.warning(f"Error al escribir en la caché: {str(e)}")
+        return valor
+
+    def invalidar(self, *sedes):
+        """Incrementa la versión de datos de las sedes indicadas.
+
+        Sin argumentos invalida todas las sedes (cambios estructurales como
+        alta, baja, renombrado o activación de sedes).
+        """
+        if not self.activa:
+            return
+        nombres = {VERSION_GLOBAL}
+        if sedes:
+            nombres.update(f'sede:{sede}' for sede in sedes if sede)
+        else:
+            nombres.add(VERSION_ESTRUCTURA)
+        try:
+            self.backend.incrementar(sorted(nombres))
+        except Exception as e:
+            logger.error(f"Error al invalidar la caché: {str(e)}")
+
+
+    def invalidar_usuarios(self):
+        """Descarta la identidad cacheada de todos los usuarios"""
+        if not self.activa:
+            return
+        try:
+            self.backend.incrementar([VERSION_USUARIOS])
+        except Exception as e:
+            logger.error(f"Error al invalidar la caché de usuarios: {str(e)}")
+
+
+def crear_cache():
+    """Crea la caché según CACHE_BACKEND ('memory', 'redis' o 'none')"""
+    tipo = os.environ.get('CACHE_BACKEND', 'memory').lower()
+    ttl = int(os.environ.get('CACHE_TTL', 300))
+    max_entries = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+
+    if tipo == 'none':
+        logger.info("Caché de respuestas deshabilitada")
+        return ResponseCache(None)
+
+    if tipo == 'redis':
+        url = os.environ.get('CACHE_REDIS_URL') or os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+        try:
+            return ResponseCache(RedisBackend(url, ttl=ttl))
+        except Exception as e:
+            logger.warning(f"No se pudo usar Redis para la caché ({str(e)}), usando memoria del proceso")
+
+    return ResponseCache(MemoryBackend(max_entries=max_entries, ttl=ttl))
+
+
+cache = crear_cache()
@@ -0,0 +1,206 @@
+import zlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TIPOS_COMPRIMIBLES = (
+    'text/html',
+    'text/css',
+    'text/csv',
+    'text/plain',
+    'text/javascript',
+    'application/javascript',
+    'application/json',
+    'application/x-ndjson',
+    'image/svg+xml',
+)
+
+
+def _codificaciones_aceptadas(cabecera):
+    """Codificaciones de Accept-Encoding con q > 0"""
+    aceptadas = set()
+    for parte in (cabecera or '').split(','):
+        nombre, _, parametros = parte.strip().partition(';')
+        nombre = nombre.strip().lower()
+        if not nombre:
+            continue
+        q = 1.0
+        parametros = parametros.strip()
+        if parametros.startswith('q='):
+            try:
+                q = float(parametros[2:])
+            except ValueError:
+                q = 0
+        if q > 0:
+            aceptadas.add(nombre)
+    return aceptadas
+
+
+class _Gzip:
+    def __init__(self, nivel):
+        # wbits 16 + MAX_WBITS: formato gzip (cabecera y CRC) en lugar de zlib
+        self._compresor = zlib.compressobj(nivel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def comprimir(self, datos):
+        # Z_SYNC_FLUSH entrega al cliente todo lo recibido hasta ahora
+        return self._compresor.compress(datos) + self._compresor.flush(zlib.Z_SYNC_FLUSH)
+
+    def terminar(self):
+        return self._compresor.flush(zlib.Z_FINISH)
+
+
+class _Brotli:
+    def __init__(self, calidad):
+        self._compresor = brotli.Compressor(quality=calidad)
+
+    def comprimir(self, datos):
+        return self._compresor.process(datos) + self._compresor.flush()
+
+    def terminar(self):
+        return self._compresor.finish()
+
+
+class CompresionMiddleware:
+    """Middleware WSGI que comprime con brotli o gzip las respuestas de texto.
+
+    Solo comprime los tipos de TIPOS_COMPRIMIBLES, y nunca respuestas que ya
+    traen Content-Encoding (p. ej. los assets precomprimidos). Los PDF y
+    otros binarios se envían tal cual. Las respuestas más pequeñas que
+    ``tamano_minimo`` se envían sin comprimir; si no declaran Content-Length
+    se acumulan fragmentos hasta alcanzarlo antes de decidir. Cada fragmento
+    de una respuesta en streaming se comprime y se envía en cuanto llega.
+    """
+
+    def __init__(self, app, nivel_gzip=6, calidad_brotli=4, tamano_minimo=1024,
+                 tipos=TIPOS_COMPRIMIBLES):
+        self.app = app
+        self.nivel_gzip = nivel_gzip
+        self.calidad_brotli = calidad_brotli
+        self.tamano_minimo = tamano_minimo
+        self.tipos = tuple(tipos)
+
+    def _elegir_codificacion(self, environ):
+        aceptadas = _codificaciones_aceptadas(environ.get('HTTP_ACCEPT_ENCODING'))
+        if brotli is not None and 'br' in aceptadas:
+            return 'br'
+        if 'gzip' in aceptadas:
+            return 'gzip'
+        return None
+
+    def _compresor(self, codificacion):
+        if codificacion == 'br':
+            return _Brotli(self.calidad_brotli)
+        return _Gzip(self.nivel_gzip)
+
+    def _es_comprimible(self, estado, cabeceras):
+        codigo = int(estado.split(' ', 1)[0])
+        if codigo < 200 or codigo in (204, 206, 304):
+            return False
+        tipo = ''
+        for nombre, valor in cabeceras:
+            nombre = nombre.lower()
+            if nombre == 'content-encoding':
+                return False
+            if nombre == 'content-type':
+                tipo = valor.split(';', 1)[0].strip().lower()
+            if nombre == 'content-length' and int(valor) < self.tamano_minimo:
+                return False
+            if nombre == 'cache-control' and 'no-transform' in valor.lower():
+                return False
+        return tipo in self.tipos
+
+    def __call__(self, environ, start_response):
+        codificacion = None
+        if environ.get('REQUEST_METHOD') != 'HEAD':
+            codificacion = self._elegir_codificacion(environ)
+        if codificacion is None:
+            return self.app(environ, start_response)
+
+        respuesta = {}
+
+        def start_response_diferido(estado, cabeceras, exc_info=None):
+            if exc_info and respuesta.get('enviada'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            respuesta['estado'] = estado
+            respuesta['cabeceras'] = cabeceras
+            respuesta['exc_info'] = exc_info
+            return self._escribir_no_soportado
+
+        app_iter = self.app(environ, start_response_diferido)
+        return self._generar(app_iter, respuesta, codificacion, start_response)
+
+    @staticmethod
+    def _escribir_no_soportado(datos):
+        raise RuntimeError('CompresionMiddleware no admite el callable write() de WSGI')
+
+    def _generar(self, app_iter, respuesta, codificacion, start_response):
+        try:
+            fragmentos = iter(app_iter)
+            pendientes = []
+            tamano = 0
+
+            # El start_response de la aplicación puede llegar con el primer fragmento
+            primero = next(fragmentos, None)
+            if primero is not None:
+                pendientes.append(primero)
+                tamano += len(primero)
+
+            comprimir = self._es_comprimible(respuesta['estado'], respuesta['cabeceras'])
+            longitud_declarada = any(n.lower() == 'content-length' for n, _ in respuesta['cabeceras'])
+
+            if comprimir and not longitud_declarada:
+                # Sin Content-Length: acumular hasta saber si supera el umbral
+                for fragmento in fragmentos:
+                    pendientes.append(fragmento)
+                    tamano += len(fragmento)
+                    if tamano >= self.tamano_minimo:
+                        break
+                else:
+                    comprimir = tamano >= self.tamano_minimo
+
+            if not comprimir:
+                respuesta['enviada'] = True
+                start_response(respuesta['estado'], respuesta['cabeceras'], respuesta['exc_info'])
+                yield from pendientes
+                yield from fragmentos
+                return
+
+            start_response(respuesta['estado'], self._cabeceras_comprimidas(respuesta['cabeceras'], codificacion),
+                           respuesta['exc_info'])
+            respuesta['enviada'] = True
+            compresor = self._compresor(codificacion)
+            if pendientes:
+                yield compresor.comprimir(b''.join(pendientes))
+            for fragmento in fragmentos:
+                if fragmento:
+                    yield compresor.comprimir(fragmento)
+            yield compresor.terminar()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+    @staticmethod
+    def _cabeceras_comprimidas(cabeceras, codificacion):
+        nuevas = []
+        vary = None
+        for nombre, valor in cabeceras:
+            clave = nombre.lower()
+            if clave == 'content-length':
+                continue
+            if clave == 'vary':
+                vary = valor
+                continue
+            if clave == 'etag' and not valor.startswith('W/'):
+                # La representación comprimida ya no es idéntica byte a byte
+                valor = f'W/{valor}'
+            nuevas.append((nombre, valor))
+        if vary and 'accept-encoding' not in vary.lower():
+            vary = f'{vary}, Accept-Encoding'
+        nuevas.append(('Vary', vary or 'Accept-Encoding'))
+        nuevas.append(('Content-Encoding', codificacion))
+        return nuevas
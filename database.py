@@ -1,6 +1,9 @@
 import os
 import logging
+import click
+from flask.cli import with_appcontext
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
 from sqlalchemy.orm import DeclarativeBase
 
 # Configurar logging
@@ -11,6 +14,49 @@ class Base(DeclarativeBase):
 
 db = SQLAlchemy(model_class=Base)
 
+# Cambios de esquema que db.create_all() no aplica sobre tablas existentes.
+# Son idempotentes y específicos de PostgreSQL.
+DDL_POSTGRESQL = [
+    # Búsqueda de texto completo sobre las vulnerabilidades
+    """
+    ALTER TABLE vulnerabilidades ADD COLUMN IF NOT EXISTS busqueda tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(nvt, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(resumen, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(solucion, '')), 'C') ||
+        setweight(to_tsvector('english', coalesce(referencias::text, '')), 'D')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_vulnerabilidades_busqueda ON vulnerabilidades USING GIN (busqueda)",
+    # Índices de las claves foráneas (las tablas existentes no los tenían)
+    "CREATE INDEX IF NOT EXISTS ix_escaneos_sede_id ON escaneos (sede_id)",
+    "CREATE INDEX IF NOT EXISTS ix_hosts_escaneo_id ON hosts (escaneo_id)",
+    "CREATE INDEX IF NOT EXISTS ix_vulnerabilidades_host_id ON vulnerabilidades (host_id)",
+]
+
+def actualizar_esquema():
+    """Aplica DDL_POSTGRESQL; en otros motores no hace nada"""
+    if db.engine.dialect.name != 'postgresql':
+        logger.warning("Base de datos distinta de PostgreSQL: se omiten búsqueda de texto e índices adicionales")
+        return
+    with db.engine.begin() as conn:
+        for sentencia in DDL_POSTGRESQL:
+            conn.execute(text(sentencia))
+
+def crear_esquema():
+    """Crea las tablas que falten y aplica los cambios de esquema pendientes"""
+    from models import User, Sede, Escaneo, Host, Vulnerabilidad, ActivityLog, ApiToken
+    db.create_all()
+    actualizar_esquema()
+
+@click.command('init-db')
+@with_appcontext
+def comando_init_db():
+    """Crea o actualiza el esquema de la base de datos (instalación y actualizaciones)"""
+    crear_esquema()
+    logger.info("Database initialized successfully")
+    click.echo("Esquema de la base de datos actualizado")
+
 def init_db(app):
     """Initialize database with the Flask app"""
     try:
@@ -26,11 +72,9 @@ def init_db(app):
         app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
         db.init_app(app)
-
-        with app.app_context():
-            from models import User, Sede, Escaneo, Host, Vulnerabilidad, ActivityLog
-            db.create_all()
-            logger.info("Database initialized successfully")
+        # El esquema se crea con 'flask init-db', no al importar la aplicación:
+        # así arrancar un worker no abre conexiones ni ejecuta DDL
+        app.cli.add_command(comando_init_db)
 
     except Exception as e:
         logger.error(f"Error initializing database: {str(e)}", exc_info=True)
@@ -0,0 +1,177 @@
+"""
+Datos sintéticos para pruebas de rendimiento.
+
+    flask sembrar-datos --sedes 5 --escaneos 12 --hosts 250 --hallazgos 12
+
+Crea las sedes que falten ("Sede de prueba 01"...) y, para cada una, una
+serie de escaneos semanales que terminan hoy. Cada sede tiene un parque de
+hosts fijo y cada host conserva la mayoría de sus hallazgos de un escaneo
+al siguiente (unos se resuelven y aparecen otros nuevos), de modo que la
+comparación, las tendencias y la matriz tienen diferencias realistas. Los
+hallazgos salen de un catálogo común con la distribución de severidades
+típica de OpenVAS y textos de longitud similar a la de un reporte real.
+Todo se guarda con ingesta.guardar_escaneo, el mismo camino que las subidas.
+
+Con la misma --semilla se generan siempre los mismos datos.
+"""
+import time
+import random
+import logging
+from datetime import date, timedelta
+
+import click
+from flask.cli import with_appcontext
+
+from database import db
+from models import Sede
+from ingesta import guardar_escaneo
+from cache import cache
+
+logger = logging.getLogger(__name__)
+
+# (nivel, peso, rango de CVSS)
+SEVERIDADES = (
+    ('Critical', 5, (9.0, 10.0)),
+    ('High', 20, (7.0, 8.9)),
+    ('Medium', 45, (4.0, 6.9)),
+    ('Low', 30, (0.1, 3.9)),
+)
+PUERTOS = ('22/tcp', '80/tcp', '443/tcp', '445/tcp', '3389/tcp', '8080/tcp', '3306/tcp', '161/udp', 'general/tcp')
+PRODUCTOS = ('OpenSSH', 'Apache HTTP Server', 'nginx', 'Microsoft Windows SMB', 'OpenSSL', 'PHP',
+             'MySQL', 'SNMP', 'Microsoft IIS', 'Samba', 'jQuery', 'TLS/SSL')
+PROBLEMAS = ('Multiple Vulnerabilities', 'Denial of Service Vulnerability', 'Information Disclosure',
+             'Remote Code Execution Vulnerability', 'Weak Cipher Suites', 'Outdated Version',
+             'Default Credentials', 'Privilege Escalation Vulnerability')
+PROBABILIDAD_RESUELTO = 0.1   # por hallazgo y escaneo
+NUEVOS_POR_ESCANEO = 1.0      # media de hallazgos nuevos por host y escaneo
+TAMANO_CATALOGO = 400
+
+
+def _texto(rng, palabras):
+    vocabulario = ('the', 'remote', 'host', 'is', 'affected', 'by', 'a', 'vulnerability', 'which', 'allows',
+                   'an', 'attacker', 'to', 'execute', 'arbitrary', 'code', 'version', 'installed', 'update',
+                   'service', 'configuration', 'request', 'crafted', 'authentication', 'bypass', 'sensitive')
+    return ' '.join(rng.choice(vocabulario) for _ in range(palabras)).capitalize() + '.'
+
+
+def crear_catalogo(rng, tamano=TAMANO_CATALOGO):
+    """Hallazgos posibles, cada uno con severidad, puerto y textos fijos"""
+    niveles = [nivel for nivel, _, _ in SEVERIDADES]
+    pesos = [peso for _, peso, _ in SEVERIDADES]
+    rangos = {nivel: rango for nivel, _, rango in SEVERIDADES}
+    catalogo = []
+    for i in range(tamano):
+        nivel = rng.choices(niveles, pesos)[0]
+        producto = rng.choice(PRODUCTOS)
+        catalogo.append({
+            'nvt': f"{producto} {rng.choice(PROBLEMAS)} ({2015 + i % 10}-{i:04d})",
+            'oid': f"1.3.6.1.4.1.25623.1.0.{100000 + i}",
+            'nivel_amenaza': nivel,
+            'cvss': f"{rng.uniform(*rangos[nivel]):.1f}",
+            'puerto': rng.choice(PUERTOS),
+            'resumen': _texto(rng, rng.randint(20, 60)),
+            'impacto': _texto(rng, rng.randint(15, 40)),
+            'solucion': _texto(rng, rng.randint(10, 30)),
+            'metodo_deteccion': _texto(rng, rng.randint(10, 25)),
+            'referencias': [f"https://nvd.nist.gov/vuln/detail/CVE-{2015 + i % 10}-{1000 + i}"
+                            for _ in range(rng.randint(0, 3))],
+        })
+    return catalogo
+
+
+class SedeSintetica:
+    """Parque de hosts de una sede y la evolución de sus hallazgos entre escaneos"""
+
+    def __init__(self, rng, numero, hosts, hallazgos, catalogo):
+        self.rng = rng
+        self.catalogo = catalogo
+        self.hosts = {}
+        for i in range(hosts):
+            ip = f"10.{numero}.{i // 250}.{i % 250 + 1}"
+            self.hosts[ip] = {
+                'nombre_host': f"srv-{numero:02d}-{i:04d}",
+                # Distribución sesgada: muchos hosts con pocos hallazgos y algunos con muchos
+                'hallazgos': set(rng.sample(range(len(catalogo)),
+                                            min(len(catalogo), int(rng.expovariate(1 / hallazgos))))),
+            }
+
+    def siguiente_escaneo(self):
+        """Resultados del próximo escaneo en el formato de analizar_vulnerabilidades"""
+        hosts_detalle = {}
+        for ip, host in self.hosts.items():
+            resueltos = {h for h in host['hallazgos'] if self.rng.random() < PROBABILIDAD_RESUELTO}
+            nuevos = {self.rng.randrange(len(self.catalogo))
+                      for _ in range(int(self.rng.expovariate(1 / NUEVOS_POR_ESCANEO)))}
+            host['hallazgos'] = (host['hallazgos'] - resueltos) | nuevos
+            # Algunos hosts no responden en cada escaneo
+            if not host['hallazgos'] or self.rng.random() < 0.03:
+                continue
+            hosts_detalle[ip] = {
+                'nombre_host': host['nombre_host'],
+                'vulnerabilidades': [dict(self.catalogo[h]) for h in sorted(host['hallazgos'])],
+            }
+        return {'hosts_detalle': hosts_detalle}
+
+
+def como_reporte_txt(resultados):
+    """Texto en el formato de reporte que entiende parser.analizar_vulnerabilidades"""
+    partes = []
+    for ip, host in resultados['hosts_detalle'].items():
+        partes.append(f"Host Information: {ip} ({host['nombre_host']})\n\n")
+    for ip, host in resultados['hosts_detalle'].items():
+        titulo = f"Security Issues for Host {ip}"
+        bloques = []
+        for v in host['vulnerabilidades']:
+            referencias = ''
+            if v['referencias']:
+                referencias = "\n\nReferences:\n" + ''.join(f"    {r}\n" for r in v['referencias'])
+            bloques.append(
+                f"Issue\n-----\n"
+                f"NVT: {v['nvt']}\nOID: {v['oid']}\n"
+                f"Threat: {v['nivel_amenaza']} (CVSS: {v['cvss']})\nPort: {v['puerto']}\n\n"
+                f"Summary:\n{v['resumen']}\n\n"
+                f"Impact:\n{v['impacto']}\n\n"
+                f"Solution:\n{v['solucion']}\n\n"
+                f"Vulnerability Detection Method:\n{v['metodo_deteccion']}"
+                f"{referencias}"
+            )
+        partes.append(f"{titulo}\n{'-' * len(titulo)}\n\n" + '\n\n'.join(bloques) + '\n\n')
+    return ''.join(partes)
+
+
+@click.command('sembrar-datos')
+@click.option('--sedes', default=5, show_default=True, help='Sedes de prueba a poblar')
+@click.option('--escaneos', default=12, show_default=True, help='Escaneos semanales por sede')
+@click.option('--hosts', default=250, show_default=True, help='Hosts por sede')
+@click.option('--hallazgos', default=12, show_default=True, help='Hallazgos medios por host')
+@click.option('--semilla', default=1, show_default=True, help='Semilla del generador aleatorio')
+@with_appcontext
+def comando_sembrar_datos(sedes, escaneos, hosts, hallazgos, semilla):
+    """Llena la base con datos sintéticos para pruebas de rendimiento"""
+    rng = random.Random(semilla)
+    catalogo = crear_catalogo(rng)
+    hoy = date.today()
+    total_hosts = total_vulns = 0
+    inicio = time.perf_counter()
+
+    for numero in range(1, sedes + 1):
+        nombre = f"Sede de prueba {numero:02d}"
+        sede = Sede.query.filter_by(nombre=nombre).first()
+        if sede is None:
+            sede = Sede(nombre=nombre, descripcion='Datos sintéticos (flask sembrar-datos)')
+            db.session.add(sede)
+            db.session.commit()
+
+        sintetica = SedeSintetica(rng, numero, hosts, hallazgos, catalogo)
+        for k in range(escaneos):
+            fecha = hoy - timedelta(weeks=escaneos - 1 - k)
+            _, n_hosts, n_vulns = guardar_escaneo(sede.id, fecha, sintetica.siguiente_escaneo())
+            db.session.commit()
+            total_hosts += n_hosts
+            total_vulns += n_vulns
+        click.echo(f"{nombre}: {escaneos} escaneos")
+
+    cache.invalidar()
+    segundos = time.perf_counter() - inicio
+    click.echo(f"{sedes * escaneos} escaneos, {total_hosts} hosts y {total_vulns} hallazgos "
+               f"en {segundos:.1f} s ({total_vulns / max(segundos, 1e-9):.0f} hallazgos/s)")
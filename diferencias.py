@@ -0,0 +1,154 @@
+import logging
+from sqlalchemy import select, func, case, and_
+
+from database import db
+from models import Sede, Escaneo, Host, Vulnerabilidad
+
+logger = logging.getLogger(__name__)
+
+# Categorías de la comparación: (etiqueta, escaneo del que se muestran los datos)
+CATEGORIAS = {
+    'nuevas': ('Vulnerabilidades nuevas', 'segundo'),
+    'resueltas': ('Vulnerabilidades resueltas', 'primero'),
+    'persistentes': ('Vulnerabilidades persistentes', 'segundo'),
+    'hosts_nuevos': ('Hosts nuevos', 'segundo'),
+    'hosts_desaparecidos': ('Hosts desaparecidos', 'primero'),
+}
+
+COLUMNAS_HALLAZGOS = ['IP', 'Host', 'OID', 'Puerto', 'Vulnerabilidad', 'Nivel de Riesgo', 'CVSS', 'Estado']
+COLUMNAS_HOSTS = ['IP', 'Host', 'Vulnerabilidades']
+
+
+def ids_escaneos(sede, fecha):
+    """IDs de los escaneos de una sede en una fecha (YYYY-MM-DD)"""
+    return db.session.execute(
+        select(Escaneo.id).join(Sede).where(Sede.nombre == sede, Escaneo.fecha_escaneo == fecha)
+    ).scalars().all()
+
+
+def _puerto():
+    # Los hallazgos sin puerto también deben coincidir entre escaneos
+    return func.coalesce(Vulnerabilidad.puerto, '')
+
+
+def _claves(escaneos):
+    """Claves (ip, oid, puerto) de los hallazgos; solo columnas estrechas"""
+    return select(Host.ip, Vulnerabilidad.oid, _puerto().label('puerto'))\
+        .join(Vulnerabilidad, Vulnerabilidad.host_id == Host.id)\
+        .where(Host.escaneo_id.in_(escaneos))
+
+
+def _ips(escaneos):
+    return select(Host.ip).where(Host.escaneo_id.in_(escaneos))
+
+
+class Diferencias:
+    """Diferencias por hallazgo entre dos escaneos identificados por sede y fecha.
+
+    Un hallazgo se identifica por (ip, oid, puerto). Los conjuntos se
+    calculan en la base de datos con EXCEPT/INTERSECT sobre esas claves,
+    sin leer las columnas de texto, y solo se recuperan los detalles de
+    la página que se muestra o de las filas que se exportan.
+    """
+
+    def __init__(self, sede1, fecha1, sede2, fecha2):
+        self.primero = ids_escaneos(sede1, fecha1)
+        self.segundo = ids_escaneos(sede2, fecha2)
+
+    def resumen(self):
+        """Totales de cada categoría en dos consultas agregadas"""
+        a = self.primero
+        b = self.segundo
+
+        claves = select(
+            func.max(case((Host.escaneo_id.in_(a), 1), else_=0)).label('en_a'),
+            func.max(case((Host.escaneo_id.in_(b), 1), else_=0)).label('en_b'),
+        ).join(Vulnerabilidad, Vulnerabilidad.host_id == Host.id)\
+            .where(Host.escaneo_id.in_(a + b))\
+            .group_by(Host.ip, Vulnerabilidad.oid, _puerto())\
+            .subquery()
+        nuevas, resueltas, persistentes = db.session.execute(select(
+            func.coalesce(func.sum(case((and_(claves.c.en_a == 0, claves.c.en_b == 1), 1), else_=0)), 0),
+            func.coalesce(func.sum(case((and_(claves.c.en_a == 1, claves.c.en_b == 0), 1), else_=0)), 0),
+            func.coalesce(func.sum(case((and_(claves.c.en_a == 1, claves.c.en_b == 1), 1), else_=0)), 0),
+        )).one()
+
+        ips = select(
+            func.max(case((Host.escaneo_id.in_(a), 1), else_=0)).label('en_a'),
+            func.max(case((Host.escaneo_id.in_(b), 1), else_=0)).label('en_b'),
+        ).where(Host.escaneo_id.in_(a + b)).group_by(Host.ip).subquery()
+        hosts_nuevos, hosts_desaparecidos = db.session.execute(select(
+            func.coalesce(func.sum(case((ips.c.en_a == 0, 1), else_=0)), 0),
+            func.coalesce(func.sum(case((ips.c.en_b == 0, 1), else_=0)), 0),
+        )).one()
+
+        return {
+            'nuevas': int(nuevas),
+            'resueltas': int(resueltas),
+            'persistentes': int(persistentes),
+            'hosts_nuevos': int(hosts_nuevos),
+            'hosts_desaparecidos': int(hosts_desaparecidos),
+        }
+
+    def _conjunto(self, categoria):
+        """Subconsulta con las claves de la categoría"""
+        a = self.primero
+        b = self.segundo
+        if categoria == 'nuevas':
+            return _claves(b).except_(_claves(a)).subquery()
+        if categoria == 'resueltas':
+            return _claves(a).except_(_claves(b)).subquery()
+        if categoria == 'persistentes':
+            return _claves(a).intersect(_claves(b)).subquery()
+        if categoria == 'hosts_nuevos':
+            return _ips(b).except_(_ips(a)).subquery()
+        if categoria == 'hosts_desaparecidos':
+            return _ips(a).except_(_ips(b)).subquery()
+        raise ValueError(f'Categoría desconocida: {categoria}')
+
+    def _escaneos_detalle(self, categoria):
+        return self.segundo if CATEGORIAS[categoria][1] == 'segundo' else self.primero
+
+    def es_de_hosts(self, categoria):
+        return categoria.startswith('hosts_')
+
+    def columnas(self, categoria):
+        return COLUMNAS_HOSTS if self.es_de_hosts(categoria) else COLUMNAS_HALLAZGOS
+
+    def consulta(self, categoria):
+        """Filas de detalle de la categoría, ordenadas por sus claves"""
+        conjunto = self._conjunto(categoria)
+        escaneos = self._escaneos_detalle(categoria)
+
+        if self.es_de_hosts(categoria):
+            return select(Host.ip, func.max(Host.nombre_host), func.count(Vulnerabilidad.id))\
+                .outerjoin(Vulnerabilidad, Vulnerabilidad.host_id == Host.id)\
+                .join(conjunto, conjunto.c.ip == Host.ip)\
+                .where(Host.escaneo_id.in_(escaneos))\
+                .group_by(Host.ip)\
+                .order_by(Host.ip)
+
+        return select(Host.ip, Host.nombre_host, Vulnerabilidad.oid, Vulnerabilidad.puerto,
+                      Vulnerabilidad.nvt, Vulnerabilidad.nivel_amenaza, Vulnerabilidad.cvss,
+                      Vulnerabilidad.estado)\
+            .join(Vulnerabilidad, Vulnerabilidad.host_id == Host.id)\
+            .join(conjunto, and_(conjunto.c.ip == Host.ip,
+                                 conjunto.c.oid == Vulnerabilidad.oid,
+                                 conjunto.c.puerto == _puerto()))\
+            .where(Host.escaneo_id.in_(escaneos))\
+            .order_by(Host.ip, Vulnerabilidad.oid, _puerto(), Vulnerabilidad.id)
+
+    def pagina(self, categoria, pagina, por_pagina):
+        """Devuelve las filas de una página de la categoría y si hay más páginas"""
+        filas = db.session.execute(
+            self.consulta(categoria).limit(por_pagina + 1).offset((pagina - 1) * por_pagina)
+        ).all()
+        return filas[:por_pagina], len(filas) > por_pagina
+
+    def filas(self, categoria, tamano_lote=1000):
+        """Itera todas las filas de la categoría sin cargarlas en memoria"""
+        resultado = db.session.execute(
+            self.consulta(categoria).execution_options(yield_per=tamano_lote)
+        )
+        for fila in resultado:
+            yield fila
@@ -1,146 +1,276 @@
-import pandas as pd
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
-from reportlab.lib.styles import getSampleStyleSheet
-from io import BytesIO
+import os
+import csv
 import logging
+import importlib.util
+from io import BytesIO, StringIO
 from datetime import datetime
+from itertools import islice
 
 logger = logging.getLogger(__name__)
 
-def exportar_a_csv(resultados, tipo_reporte):
+# Columnas de cada exportación, en el orden del archivo
+COLUMNAS_HOSTS = ['Sede', 'Fecha', 'IP', 'Hostname', 'Críticas', 'Altas', 'Medias', 'Bajas', 'Total']
+COLUMNAS_VULNERABILIDADES = ['IP', 'Hostname', 'Nivel', 'CVSS', 'Puerto', 'Estado', 'NVT', 'Resumen']
+
+# Tamaño aproximado de cada fragmento enviado al cliente
+TAMANO_FRAGMENTO = 64 * 1024
+
+# Columnas tipadas de la exportación en Parquet: (nombre, tipo)
+COLUMNAS_PARQUET_VULNERABILIDADES = [
+    ('sede', 'categoria'), ('fecha_escaneo', 'fecha'), ('ip', 'texto'), ('nombre_host', 'texto'),
+    ('nivel_amenaza', 'categoria'), ('cvss', 'decimal'), ('puerto', 'texto'), ('estado', 'categoria'),
+    ('nvt', 'texto'), ('resumen', 'texto'),
+]
+
+# Filas de cada grupo (row group) de un Parquet: cada grupo se envía en cuanto se completa
+FILAS_POR_GRUPO = 10000
+
+# Exportaciones en PDF: por encima de este número de filas hay que usar CSV o Parquet
+MAXIMO_FILAS_PDF = int(os.environ.get('PDF_EXPORT_MAX_ROWS', 20000))
+TAMANO_FUENTE_PDF = 8
+ALTO_FILA_PDF = 12
+ALTO_CABECERA_PDF = 18
+# (título, ancho en puntos) de cada columna; suman el ancho útil de una página carta
+COLUMNAS_PDF = {
+    'hosts': [('Sede', 90), ('IP', 70), ('Hostname', 100), ('Críticas', 42), ('Altas', 42),
+              ('Medias', 42), ('Bajas', 42), ('Total', 40)],
+    'vulnerabilidades': [('IP', 70), ('Hostname', 85), ('Nivel', 45), ('CVSS', 30), ('Puerto', 55),
+                         ('Estado', 50), ('NVT', 133)],
+}
+
+def escribir_csv(columnas, filas):
     """
-    Exporta los resultados a un archivo CSV.
+    Genera un CSV por fragmentos de texto a partir de un iterable de filas,
+    sin tener todo el archivo en memoria. Sirve como cuerpo de una respuesta
+    en streaming: la cabecera sale antes de leer la primera fila.
     """
+    salida = StringIO()
+    escritor = csv.writer(salida, lineterminator='\n')
+    escritor.writerow(columnas)
     try:
-        if tipo_reporte == 'hosts':
-            # Preparar datos para el formato de hosts
-            datos = []
-            for resultado in resultados:
-                for ip, host in resultado['hosts_detalle'].items():
-                    vulnerabilidades = {
-                        'Critical': 0, 'High': 0, 
-                        'Medium': 0, 'Low': 0
-                    }
-                    
-                    for vuln in host['vulnerabilidades']:
-                        vulnerabilidades[vuln['nivel_amenaza']] += 1
-                    
-                    datos.append({
-                        'Sede': resultado['sede'],
-                        'Fecha': resultado['fecha_escaneo'],
-                        'IP': ip,
-                        'Hostname': host['nombre_host'],
-                        'Críticas': vulnerabilidades['Critical'],
-                        'Altas': vulnerabilidades['High'],
-                        'Medias': vulnerabilidades['Medium'],
-                        'Bajas': vulnerabilidades['Low'],
-                        'Total': sum(vulnerabilidades.values())
-                    })
-            
-            df = pd.DataFrame(datos)
-            
-        elif tipo_reporte == 'vulnerabilidades':
-            # Preparar datos para el formato de vulnerabilidades
-            datos = []
-            for vuln in resultados:
-                datos.append({
-                    'IP': vuln.host.ip,
-                    'Hostname': vuln.host.nombre_host,
-                    'Nivel': vuln.nivel_amenaza,
-                    'CVSS': vuln.cvss,
-                    'Puerto': vuln.puerto,
-                    'Estado': vuln.estado,
-                    'NVT': vuln.nvt,
-                    'Resumen': vuln.resumen
-                })
-            
-            df = pd.DataFrame(datos)
-        
-        output = BytesIO()
-        df.to_csv(output, index=False, encoding='utf-8')
-        output.seek(0)
-        return output
-
+        for fila in filas:
+            escritor.writerow(fila)
+            if salida.tell() >= TAMANO_FRAGMENTO:
+                yield salida.getvalue()
+                salida.seek(0)
+                salida.truncate()
+        yield salida.getvalue()
     except Exception as e:
+        # Las cabeceras ya se enviaron: cortar la conexión para que la descarga quede incompleta
         logger.error(f"Error al exportar a CSV: {str(e)}", exc_info=True)
         raise
 
-def exportar_a_pdf(resultados, tipo_reporte):
+def parquet_disponible():
+    """pyarrow es opcional (pip install pyarrow); se comprueba sin importarlo"""
+    return importlib.util.find_spec('pyarrow') is not None
+
+def a_decimal(valor):
+    """CVSS guardado como texto a número; vacío o no numérico queda nulo"""
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return None
+
+class _Fragmentos:
+    """Archivo de solo escritura que acumula los bytes hasta que se recogen"""
+
+    closed = False
+
+    def __init__(self):
+        self._partes = []
+        self._posicion = 0
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self._posicion
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def recoger(self):
+        datos = b''.join(self._partes)
+        self._partes = []
+        return datos
+
+def _tipo_arrow(pa, tipo):
+    return {
+        'texto': pa.string(),
+        # Se lee como categoría en pandas y con diccionario en el archivo
+        'categoria': pa.dictionary(pa.int32(), pa.string()),
+        'fecha': pa.date32(),
+        'decimal': pa.float64(),
+        'lista': pa.list_(pa.string()),
+    }[tipo]
+
+def escribir_parquet(columnas, filas, filas_por_grupo=FILAS_POR_GRUPO):
+    """
+    Genera un Parquet (comprimido con zstd) por fragmentos de bytes a partir
+    de un iterable de filas. ``columnas`` es una lista de (nombre, tipo),
+    con tipo 'texto', 'categoria', 'fecha', 'decimal' o 'lista'. Cada
+    ``filas_por_grupo`` filas se escribe un grupo y se envía, así que en
+    memoria solo hay un grupo a la vez. pyarrow se importa aquí: ocupa unos
+    50 MB y solo lo usan estas exportaciones.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    esquema = pa.schema([(nombre, _tipo_arrow(pa, tipo)) for nombre, tipo in columnas])
+    salida = _Fragmentos()
+    filas = iter(filas)
+    try:
+        with pq.ParquetWriter(salida, esquema, compression='zstd') as escritor:
+            while lote := list(islice(filas, filas_por_grupo)):
+                valores = zip(*lote)
+                escritor.write_table(pa.Table.from_arrays(
+                    [pa.array(columna, type=tipo) for columna, tipo in zip(valores, esquema.types)],
+                    schema=esquema
+                ), row_group_size=filas_por_grupo)
+                yield salida.recoger()
+        yield salida.recoger()
+    except Exception as e:
+        # Las cabeceras ya se enviaron: cortar la conexión para que la descarga quede incompleta
+        logger.error(f"Error al exportar a Parquet: {str(e)}", exc_info=True)
+        raise
+
+def exportar_a_parquet(filas):
+    """
+    Exporta los hallazgos a Parquet como un generador de fragmentos de bytes.
+    Recibe las filas de filas_exportar_vulnerabilidades (app.py), con las
+    columnas de COLUMNAS_PARQUET_VULNERABILIDADES y el CVSS aún como texto.
+    """
+    filas = ((f.sede, f.fecha_escaneo, f.ip, f.nombre_host, f.nivel_amenaza, a_decimal(f.cvss),
+              f.puerto, f.estado, f.nvt, f.resumen) for f in filas)
+    return escribir_parquet(COLUMNAS_PARQUET_VULNERABILIDADES, filas)
+
+def _filas_hosts(escaneos):
+    for escaneo in escaneos:
+        for host in escaneo['hosts']:
+            conteos = [host['Critical'], host['High'], host['Medium'], host['Low']]
+            yield [escaneo['sede'], escaneo['fecha_escaneo'], host['ip'], host['nombre_host'],
+                   *conteos, sum(conteos)]
+
+def _filas_vulnerabilidades(filas):
+    for fila in filas:
+        yield [fila.ip, fila.nombre_host, fila.nivel_amenaza, fila.cvss,
+               fila.puerto, fila.estado, fila.nvt, fila.resumen]
+
+def exportar_a_csv(resultados, tipo_reporte):
+    """
+    Exporta los resultados a CSV como un generador de fragmentos de texto.
+    Para 'hosts' recibe los escaneos de iterar_hosts_por_escaneo; para
+    'vulnerabilidades', las filas de filas_exportar_vulnerabilidades.
+    """
+    if tipo_reporte == 'hosts':
+        return escribir_csv(COLUMNAS_HOSTS, _filas_hosts(resultados))
+    elif tipo_reporte == 'vulnerabilidades':
+        return escribir_csv(COLUMNAS_VULNERABILIDADES, _filas_vulnerabilidades(resultados))
+    raise ValueError(f"Tipo de reporte no válido: {tipo_reporte}")
+
+class DemasiadasFilas(Exception):
+    """La exportación en PDF supera el máximo de filas"""
+
+    def __init__(self, maximo):
+        super().__init__(f"La exportación supera las {maximo} filas admitidas en PDF")
+        self.maximo = maximo
+
+def _recortar(valor, maximo):
+    """Texto de la celda en una sola línea, recortado con '…' si no cabe en la columna"""
+    texto = '' if valor is None else str(valor)
+    return texto if len(texto) <= maximo else texto[:maximo - 1] + '…'
+
+def _filas_pdf_hosts(escaneos):
+    # Escaneos de iterar_hosts_por_escaneo: conteos por nivel ya agregados en la base
+    for escaneo in escaneos:
+        for host in escaneo['hosts']:
+            conteos = [host.get(nivel, 0) for nivel in ('Critical', 'High', 'Medium', 'Low')]
+            yield [escaneo['sede'], host['ip'], host['nombre_host'], *conteos, sum(conteos)]
+
+def _filas_pdf_vulnerabilidades(filas):
+    # Filas de filas_exportar_vulnerabilidades: columnas sueltas, sin objetos ORM
+    for fila in filas:
+        yield [fila.ip, fila.nombre_host, fila.nivel_amenaza, fila.cvss, fila.puerto, fila.estado, fila.nvt]
+
+def exportar_a_pdf(resultados, tipo_reporte, maximo_filas=MAXIMO_FILAS_PDF):
     """
     Exporta los resultados a un archivo PDF.
+
+    Las filas se reparten en tablas de una página, cada una con su cabecera,
+    con anchos de columna y altos de fila fijos y las celdas recortadas a una
+    línea: así reportlab no mide cada celda ni parte una tabla enorme página
+    a página, y el tiempo crece de forma lineal con las filas. Si hay más de
+    ``maximo_filas`` (None = sin límite) lanza DemasiadasFilas antes de
+    maquetar nada.
     """
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib.styles import getSampleStyleSheet
+
+    if tipo_reporte == 'hosts':
+        filas = _filas_pdf_hosts(resultados)
+    elif tipo_reporte == 'vulnerabilidades':
+        filas = _filas_pdf_vulnerabilidades(resultados)
+    else:
+        raise ValueError(f"Tipo de reporte no válido: {tipo_reporte}")
+
+    cabecera = [titulo for titulo, _ in COLUMNAS_PDF[tipo_reporte]]
+    anchos = [ancho for _, ancho in COLUMNAS_PDF[tipo_reporte]]
+    # Caracteres que caben en cada columna (Helvetica mide de media algo más de media fuente)
+    limites = [int((ancho - 6) / (TAMANO_FUENTE_PDF * 0.55)) for ancho in anchos]
+    data = []
+    for fila in filas:
+        if maximo_filas is not None and len(data) >= maximo_filas:
+            raise DemasiadasFilas(maximo_filas)
+        data.append([_recortar(valor, limite) for valor, limite in zip(fila, limites)])
+
     try:
         buffer = BytesIO()
         doc = SimpleDocTemplate(buffer, pagesize=letter)
-        elements = []
         styles = getSampleStyleSheet()
 
         # Título
         title = f"Reporte de {tipo_reporte.title()} - {datetime.now().strftime('%Y-%m-%d')}"
-        elements.append(Paragraph(title, styles['Title']))
-        elements.append(Paragraph("<br/><br/>", styles['Normal']))
-
-        if tipo_reporte == 'hosts':
-            # Preparar datos para la tabla de hosts
-            data = [['Sede', 'IP', 'Hostname', 'Críticas', 'Altas', 'Medias', 'Bajas', 'Total']]
-            
-            for resultado in resultados:
-                for ip, host in resultado['hosts_detalle'].items():
-                    vulnerabilidades = {
-                        'Critical': 0, 'High': 0, 
-                        'Medium': 0, 'Low': 0
-                    }
-                    
-                    for vuln in host['vulnerabilidades']:
-                        vulnerabilidades[vuln['nivel_amenaza']] += 1
-                    
-                    data.append([
-                        resultado['sede'],
-                        ip,
-                        host['nombre_host'],
-                        vulnerabilidades['Critical'],
-                        vulnerabilidades['High'],
-                        vulnerabilidades['Medium'],
-                        vulnerabilidades['Low'],
-                        sum(vulnerabilidades.values())
-                    ])
-
-        elif tipo_reporte == 'vulnerabilidades':
-            # Preparar datos para la tabla de vulnerabilidades
-            data = [['IP', 'Hostname', 'Nivel', 'CVSS', 'Puerto', 'Estado', 'NVT']]
-            
-            for vuln in resultados:
-                data.append([
-                    vuln.host.ip,
-                    vuln.host.nombre_host,
-                    vuln.nivel_amenaza,
-                    vuln.cvss,
-                    vuln.puerto,
-                    vuln.estado,
-                    vuln.nvt
-                ])
-
-        # Crear tabla
-        table = Table(data)
-        table.setStyle(TableStyle([
+        elements = [Paragraph(title, styles['Title']), Spacer(1, 12)]
+
+        # Filas por página: el marco tiene 6 puntos de margen arriba y abajo,
+        # y en la primera página el título ocupa parte del alto
+        alto_marco = doc.height - 12
+        alto_titulo = sum(e.wrap(doc.width, doc.height)[1] for e in elements) + styles['Title'].spaceAfter
+        filas_por_pagina = int((alto_marco - ALTO_CABECERA_PDF) // ALTO_FILA_PDF)
+        filas_primera_pagina = int((alto_marco - alto_titulo - ALTO_CABECERA_PDF) // ALTO_FILA_PDF)
+
+        estilo = TableStyle([
             ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
             ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
             ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
             ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
             ('BACKGROUND', (0, 1), (-1, -1), colors.white),
             ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
             ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 8),
+            ('FONTSIZE', (0, 1), (-1, -1), TAMANO_FUENTE_PDF),
             ('GRID', (0, 0), (-1, -1), 1, colors.black),
             ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
             ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ]))
+        ])
+
+        inicio, tamano = 0, filas_primera_pagina
+        while True:
+            trozo = data[inicio:inicio + tamano]
+            elements.append(Table([cabecera] + trozo, colWidths=anchos,
+                                  rowHeights=[ALTO_CABECERA_PDF] + [ALTO_FILA_PDF] * len(trozo),
+                                  repeatRows=1, style=estilo))
+            inicio += tamano
+            tamano = filas_por_pagina
+            if inicio >= len(data):
+                break
 
-        elements.append(table)
         doc.build(elements)
         buffer.seek(0)
         return buffer
@@ -0,0 +1,32 @@
+"""
+Filtros comunes de sede, fechas, nivel de riesgo y estado, compartidos por
+las vistas HTML, las exportaciones, los informes y la API REST.
+"""
+from datetime import datetime
+
+from models import Sede, Escaneo, Vulnerabilidad
+
+
+def _fecha(valor, nombre):
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f"Parámetro '{nombre}' inválido, se espera YYYY-MM-DD")
+
+
+def aplicar_filtros(query, sede=None, fecha_inicio=None, fecha_fin=None, riesgo=None, estado=None):
+    """
+    Aplica los filtros de filtrar_resultados a una consulta que ya une Escaneo
+    y Sede. Lanza ValueError si una fecha no tiene el formato YYYY-MM-DD.
+    """
+    if sede and sede != 'Todas las sedes':
+        query = query.filter(Sede.nombre == sede)
+    if fecha_inicio:
+        query = query.filter(Escaneo.fecha_escaneo >= _fecha(fecha_inicio, 'fecha_inicio'))
+    if fecha_fin:
+        query = query.filter(Escaneo.fecha_escaneo <= _fecha(fecha_fin, 'fecha_fin'))
+    if riesgo and riesgo != 'all':
+        query = query.filter(Vulnerabilidad.nivel_amenaza == riesgo)
+    if estado and estado != 'all':
+        query = query.filter(Vulnerabilidad.estado == estado)
+    return query
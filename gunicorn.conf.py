@@ -0,0 +1,51 @@
+"""
+Configuración de gunicorn (gunicorn --config gunicorn.conf.py app:app).
+
+La aplicación se importa una sola vez en el proceso maestro (preload_app) y
+los workers se crean con fork, así que arrancan sin volver a importar Flask
+ni SQLAlchemy y comparten esas páginas de memoria. Tras el fork cada worker
+descarta el pool de conexiones heredado para no compartir sockets de
+PostgreSQL con el maestro ni con sus hermanos.
+
+Las métricas de /metrics se agregan entre workers a través de los archivos
+de PROMETHEUS_MULTIPROC_DIR, que se vacía al arrancar.
+"""
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# Los informes técnicos de sedes grandes pueden tardar
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+# Se define aquí para que ya exista al importar prometheus_client (preload)
+directorio_metricas = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/sectracker-metricas')
+os.makedirs(directorio_metricas, exist_ok=True)
+
+
+def on_starting(server):
+    # Los valores de una ejecución anterior no deben sumarse a los nuevos
+    for nombre in os.listdir(directorio_metricas):
+        os.remove(os.path.join(directorio_metricas, nombre))
+
+
+def post_fork(server, worker):
+    from app import app
+    from database import db
+
+    with app.app_context():
+        # close=False: no cerrar las conexiones del maestro, solo olvidarlas
+        db.engine.dispose(close=False)
+
+
+def child_exit(server, worker):
+    from metricas import marcar_worker_terminado
+
+    marcar_worker_terminado(worker.pid)
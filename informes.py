@@ -1,12 +1,18 @@
-import pandas as pd
+import os
 from io import BytesIO
 from datetime import datetime
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.pagesizes import letter, landscape
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.graphics.shapes import Drawing, String
+from reportlab.graphics.charts.piecharts import Pie
 from reportlab.lib.units import inch
-import matplotlib.pyplot as plt
+
+from exportar import escribir_csv, escribir_parquet, a_decimal
+
+# Hosts por PDF parcial en escribir_pdf_tecnico: acota la memoria de la historia de reportlab
+HOSTS_POR_PARTE = 200
 
 def generar_informe_ejecutivo(datos, tipo='pdf'):
     """
@@ -14,30 +20,42 @@ def generar_informe_ejecutivo(datos, tipo='pdf'):
     """
     return generar_pdf_ejecutivo(datos)
 
-def generar_grafico_distribucion(niveles):
-    """Genera un gráfico de torta con la distribución de vulnerabilidades"""
-    plt.figure(figsize=(6, 4))
+def generar_grafico_distribucion(niveles, ancho=400, alto=300):
+    """
+    Gráfico de torta con la distribución de vulnerabilidades, como dibujo
+    vectorial de reportlab: se inserta en la historia del PDF como un
+    flowable más, sin rasterizar ni cargar matplotlib.
+    """
     colores = {'Critical': '#dc3545', 'High': '#fd7e14', 'Medium': '#ffc107', 'Low': '#0dcaf0'}
 
+    dibujo = Drawing(ancho, alto)
+    dibujo.add(String(ancho / 2, alto - 14, 'Distribución de Vulnerabilidades por Nivel',
+                      fontName='Helvetica-Bold', fontSize=12, textAnchor='middle'))
+
     # Filtrar niveles con valores > 0
     niveles_filtrados = {k: v for k, v in niveles.items() if v > 0}
-    valores = list(niveles_filtrados.values())
-    etiquetas = [f"{k} ({v})" for k, v in niveles_filtrados.items()]
-    colores_filtrados = [colores[k] for k in niveles_filtrados.keys()]
-
-    if valores:
-        plt.pie(valores, labels=etiquetas, colors=colores_filtrados, autopct='%1.1f%%')
-        plt.title('Distribución de Vulnerabilidades por Nivel')
-    else:
-        plt.text(0.5, 0.5, 'No hay vulnerabilidades para mostrar', 
-                horizontalalignment='center', verticalalignment='center')
-
-    # Guardar el gráfico en un buffer
-    img_buffer = BytesIO()
-    plt.savefig(img_buffer, format='png', bbox_inches='tight', dpi=300)
-    plt.close()
-    img_buffer.seek(0)
-    return img_buffer
+    total = sum(niveles_filtrados.values())
+    if not total:
+        dibujo.add(String(ancho / 2, alto / 2, 'No hay vulnerabilidades para mostrar',
+                          fontName='Helvetica', fontSize=10, textAnchor='middle'))
+        return dibujo
+
+    torta = Pie()
+    diametro = min(ancho, alto) - 110
+    torta.x = (ancho - diametro) / 2
+    torta.y = (alto - 30 - diametro) / 2
+    torta.width = torta.height = diametro
+    torta.data = list(niveles_filtrados.values())
+    torta.labels = [f"{k} ({v}, {v / total * 100:.1f}%)" for k, v in niveles_filtrados.items()]
+    torta.sideLabels = True
+    torta.slices.strokeColor = colors.white
+    torta.slices.strokeWidth = 1
+    torta.slices.fontName = 'Helvetica'
+    torta.slices.fontSize = 9
+    for indice, nivel in enumerate(niveles_filtrados):
+        torta.slices[indice].fillColor = colors.HexColor(colores[nivel])
+    dibujo.add(torta)
+    return dibujo
 
 def generar_pdf_ejecutivo(datos):
     """
@@ -126,9 +144,7 @@ def generar_pdf_ejecutivo(datos):
 
     # Añadir gráfico de distribución
     if total_vulnerabilidades > 0:
-        img_buffer = generar_grafico_distribucion(niveles)
-        img = Image(img_buffer, width=400, height=300)
-        story.append(img)
+        story.append(generar_grafico_distribucion(niveles))
         story.append(Spacer(1, 20))
 
     # Análisis de riesgo
@@ -162,45 +178,45 @@ def generar_pdf_ejecutivo(datos):
 
 def generar_informe_tecnico(datos, tipo='pdf'):
     """
-    Genera un informe técnico detallado
+    Genera un informe técnico detallado.
+    PDF: ``datos`` es el diccionario con hosts_detalle.
+    CSV: ``datos`` es un iterable de Vulnerabilidad y el resultado, un generador de texto.
+    Parquet: igual que CSV, y el resultado es un generador de bytes.
     """
     if tipo == 'pdf':
         return generar_pdf_tecnico(datos)
+    elif tipo == 'parquet':
+        return generar_parquet_tecnico(datos)
     else:  # csv
         return generar_csv_tecnico(datos)
 
-def generar_pdf_tecnico(datos):
-    """
-    Genera un PDF con información técnica detallada
-    """
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=landscape(letter),
-                          rightMargin=36, leftMargin=36,
-                          topMargin=36, bottomMargin=36)
-
-    story = []
+def _estilos_tecnicos():
     styles = getSampleStyleSheet()
-
-    # Título
-    title_style = ParagraphStyle(
+    styles.add(ParagraphStyle(
         'CustomTitle',
         parent=styles['Heading1'],
         fontSize=24,
         spaceAfter=30
-    )
-    story.append(Paragraph("Informe Técnico Detallado", title_style))
-    story.append(Spacer(1, 12))
-
-    # Información del contexto
-    context_style = ParagraphStyle(
+    ))
+    styles.add(ParagraphStyle(
         'Context',
         parent=styles['Normal'],
         fontSize=12,
         spaceAfter=20
-    )
+    ))
+    return styles
+
+def _documento_tecnico(destino):
+    return SimpleDocTemplate(destino, pagesize=landscape(letter),
+                             rightMargin=36, leftMargin=36,
+                             topMargin=36, bottomMargin=36)
+
+def _portada_tecnica(datos, styles):
+    """Título, sede y período del informe técnico"""
+    story = [Paragraph("Informe Técnico Detallado", styles['CustomTitle']), Spacer(1, 12)]
 
     # Sede y fecha
-    sede_info = f"Sede: {datos.get('sede', 'Todas las sedes')}"
+    sede_info = f"Sede: {datos.get('sede') or 'Todas las sedes'}"
     fecha_info = "Período: "
     if datos.get('fecha_inicio') and datos.get('fecha_fin'):
         fecha_info += f"Del {datos['fecha_inicio']} al {datos['fecha_fin']}"
@@ -211,92 +227,187 @@ def generar_pdf_tecnico(datos):
     else:
         fecha_info += "Todo el período"
 
-    story.append(Paragraph(sede_info, context_style))
-    story.append(Paragraph(fecha_info, context_style))
-    story.append(Paragraph(f"Fecha del informe: {datetime.now().strftime('%Y-%m-%d')}", context_style))
+    story.append(Paragraph(sede_info, styles['Context']))
+    story.append(Paragraph(fecha_info, styles['Context']))
+    story.append(Paragraph(f"Fecha del informe: {datetime.now().strftime('%Y-%m-%d')}", styles['Context']))
+    story.append(Spacer(1, 12))
+    return story
+
+def _detalle_host(ip, host_data, styles):
+    """Tabla y detalle de las vulnerabilidades de un host"""
+    # Información del host
+    story = [Paragraph(f"Host: {ip}", styles["Heading2"])]
+    if host_data.get('nombre_host'):
+        story.append(Paragraph(f"Nombre: {host_data['nombre_host']}", styles["Normal"]))
     story.append(Spacer(1, 12))
 
-    # Contenido detallado por host
-    for ip, host_data in datos['hosts_detalle'].items():
-        # Información del host
-        story.append(Paragraph(f"Host: {ip}", styles["Heading2"]))
-        if host_data.get('nombre_host'):
-            story.append(Paragraph(f"Nombre: {host_data['nombre_host']}", styles["Normal"]))
-        story.append(Spacer(1, 12))
-
-        # Tabla de vulnerabilidades
-        vuln_data = [['Vulnerabilidad', 'Nivel', 'CVSS', 'Puerto', 'Estado']]
-        for vuln in host_data['vulnerabilidades']:
-            vuln_data.append([
-                vuln['nvt'],
-                vuln['nivel_amenaza'],
-                vuln['cvss'],
-                vuln['puerto'],
-                vuln.get('estado', 'No especificado')
-            ])
-
-        table = Table(vuln_data, repeatRows=1)
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 8),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('WORDWRAP', (0, 0), (-1, -1), True)
-        ]))
-
-        story.append(table)
-        story.append(Spacer(1, 20))
+    # Tabla de vulnerabilidades
+    vuln_data = [['Vulnerabilidad', 'Nivel', 'CVSS', 'Puerto', 'Estado']]
+    for vuln in host_data['vulnerabilidades']:
+        vuln_data.append([
+            vuln['nvt'],
+            vuln['nivel_amenaza'],
+            vuln['cvss'],
+            vuln['puerto'],
+            vuln.get('estado', 'No especificado')
+        ])
+
+    table = Table(vuln_data, repeatRows=1)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -1), 8),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('WORDWRAP', (0, 0), (-1, -1), True)
+    ]))
 
-        # Detalles de cada vulnerabilidad
-        for vuln in host_data['vulnerabilidades']:
-            story.append(Paragraph(f"Detalle de Vulnerabilidad: {vuln['nvt']}", styles["Heading3"]))
-            story.append(Paragraph(f"Resumen: {vuln.get('resumen', 'No disponible')}", styles["Normal"]))
-            story.append(Paragraph(f"Impacto: {vuln.get('impacto', 'No disponible')}", styles["Normal"]))
-            story.append(Paragraph(f"Solución: {vuln.get('solucion', 'No disponible')}", styles["Normal"]))
-            if vuln.get('referencias'):
-                story.append(Paragraph("Referencias:", styles["Normal"]))
-                for ref in vuln['referencias']:
-                    story.append(Paragraph(f"• {ref}", styles["Normal"]))
-            story.append(Spacer(1, 12))
+    story.append(table)
+    story.append(Spacer(1, 20))
 
-    doc.build(story)
-    buffer.seek(0)
-    return buffer
+    # Detalles de cada vulnerabilidad
+    for vuln in host_data['vulnerabilidades']:
+        story.append(Paragraph(f"Detalle de Vulnerabilidad: {vuln['nvt']}", styles["Heading3"]))
+        story.append(Paragraph(f"Resumen: {vuln.get('resumen', 'No disponible')}", styles["Normal"]))
+        story.append(Paragraph(f"Impacto: {vuln.get('impacto', 'No disponible')}", styles["Normal"]))
+        story.append(Paragraph(f"Solución: {vuln.get('solucion', 'No disponible')}", styles["Normal"]))
+        if vuln.get('referencias'):
+            story.append(Paragraph("Referencias:", styles["Normal"]))
+            for ref in vuln['referencias']:
+                story.append(Paragraph(f"• {ref}", styles["Normal"]))
+        story.append(Spacer(1, 12))
+    return story
 
-def generar_csv_tecnico(datos):
+def generar_pdf_tecnico(datos):
     """
-    Genera un CSV con información técnica detallada
+    Genera un PDF con información técnica detallada
     """
     buffer = BytesIO()
+    styles = _estilos_tecnicos()
+    story = _portada_tecnica(datos, styles)
 
-    # Preparar datos para el DataFrame
-    rows = []
+    # Contenido detallado por host
     for ip, host_data in datos['hosts_detalle'].items():
-        for vuln in host_data['vulnerabilidades']:
-            rows.append({
-                'IP': ip,
-                'Nombre Host': host_data.get('nombre_host', ''),
-                'Vulnerabilidad': vuln['nvt'],
-                'OID': vuln.get('oid', ''),
-                'Nivel': vuln['nivel_amenaza'],
-                'CVSS': vuln['cvss'],
-                'Puerto': vuln['puerto'],
-                'Resumen': vuln.get('resumen', ''),
-                'Impacto': vuln.get('impacto', ''),
-                'Solución': vuln.get('solucion', ''),
-                'Método Detección': vuln.get('metodo_deteccion', ''),
-                'Referencias': '; '.join(vuln.get('referencias', [])),
-                'Estado': vuln.get('estado', 'No especificado')
-            })
-
-    df = pd.DataFrame(rows)
-    df.to_csv(buffer, index=False, encoding='utf-8')
+        story.extend(_detalle_host(ip, host_data, styles))
+
+    _documento_tecnico(buffer).build(story)
     buffer.seek(0)
-    return buffer
\ No newline at end of file
+    return buffer
+
+def escribir_pdf_tecnico(destino, datos, hosts, hosts_por_parte=HOSTS_POR_PARTE, al_avanzar=None):
+    """
+    Escribe el informe técnico en el archivo ``destino`` sin tener todo el
+    documento en memoria. ``hosts`` es un iterable de (ip, host_data) que se
+    consume a medida que avanza; cada ``hosts_por_parte`` hosts se genera un
+    PDF parcial (solo esa parte de la historia vive en memoria) y al final
+    las partes se unen en ``destino``. Cada parte empieza en una página nueva.
+    ``al_avanzar(hosts_escritos)`` se llama tras cada parte.
+    Devuelve el número de hosts escritos.
+    """
+    styles = _estilos_tecnicos()
+    partes = []
+    story = _portada_tecnica(datos, styles)
+    hosts_en_parte = total = 0
+
+    def cerrar_parte():
+        ruta = f"{destino}.parte{len(partes):04d}"
+        _documento_tecnico(ruta).build(story)
+        partes.append(ruta)
+
+    try:
+        for ip, host_data in hosts:
+            story.extend(_detalle_host(ip, host_data, styles))
+            hosts_en_parte += 1
+            total += 1
+            if hosts_en_parte >= hosts_por_parte:
+                cerrar_parte()
+                story = []
+                hosts_en_parte = 0
+                if al_avanzar:
+                    al_avanzar(total)
+        if story or not partes:
+            cerrar_parte()
+            if al_avanzar:
+                al_avanzar(total)
+        unir_pdfs(partes, destino)
+    finally:
+        for ruta in partes:
+            if os.path.exists(ruta):
+                os.remove(ruta)
+    return total
+
+def unir_pdfs(rutas, destino):
+    """Concatena los PDF de ``rutas`` en ``destino``"""
+    from pypdf import PdfWriter
+
+    escritor = PdfWriter()
+    for ruta in rutas:
+        escritor.append(ruta)
+    temporal = f"{destino}.tmp"
+    with open(temporal, 'wb') as f:
+        escritor.write(f)
+    escritor.close()
+    os.replace(temporal, destino)
+
+def generar_csv_tecnico(vulnerabilidades):
+    """
+    Genera un CSV con información técnica detallada, por fragmentos de texto.
+    Recibe un iterable de Vulnerabilidad con su host cargado (leído por lotes);
+    los valores nulos quedan como celdas vacías.
+    """
+    columnas = ['IP', 'Nombre Host', 'Vulnerabilidad', 'OID', 'Nivel', 'CVSS', 'Puerto', 'Resumen',
+                'Impacto', 'Solución', 'Método Detección', 'Referencias', 'Estado']
+    filas = ([
+        vuln.host.ip,
+        vuln.host.nombre_host,
+        vuln.nvt,
+        vuln.oid,
+        vuln.nivel_amenaza,
+        vuln.cvss,
+        vuln.puerto,
+        vuln.resumen,
+        vuln.impacto,
+        vuln.solucion,
+        vuln.metodo_deteccion,
+        '; '.join(vuln.referencias or []),
+        vuln.estado
+    ] for vuln in vulnerabilidades)
+    return escribir_csv(columnas, filas)
+
+def generar_parquet_tecnico(vulnerabilidades):
+    """
+    Genera el informe técnico en Parquet, por fragmentos de bytes, con las
+    columnas del CSV tipadas: CVSS numérico, nivel, estado y sede como
+    categorías, fecha del escaneo y referencias como lista. Recibe un
+    iterable de Vulnerabilidad con host, escaneo y sede cargados.
+    """
+    columnas = [
+        ('sede', 'categoria'), ('fecha_escaneo', 'fecha'), ('ip', 'texto'), ('nombre_host', 'texto'),
+        ('nvt', 'texto'), ('oid', 'texto'), ('nivel_amenaza', 'categoria'), ('cvss', 'decimal'),
+        ('puerto', 'texto'), ('resumen', 'texto'), ('impacto', 'texto'), ('solucion', 'texto'),
+        ('metodo_deteccion', 'texto'), ('referencias', 'lista'), ('estado', 'categoria'),
+    ]
+    filas = ((
+        vuln.host.escaneo.sede.nombre,
+        vuln.host.escaneo.fecha_escaneo,
+        vuln.host.ip,
+        vuln.host.nombre_host,
+        vuln.nvt,
+        vuln.oid,
+        vuln.nivel_amenaza,
+        a_decimal(vuln.cvss),
+        vuln.puerto,
+        vuln.resumen,
+        vuln.impacto,
+        vuln.solucion,
+        vuln.metodo_deteccion,
+        vuln.referencias or [],
+        vuln.estado
+    ) for vuln in vulnerabilidades)
+    return escribir_parquet(columnas, filas)
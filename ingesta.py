@@ -0,0 +1,73 @@
+"""
+Guardado de los resultados de un reporte analizado.
+
+Los hosts y hallazgos se insertan por lotes con INSERT de varias filas en
+lugar de un objeto del ORM y un flush por host. Lo usan la subida de
+reportes (/subir_reporte) y la carga de datos de prueba (flask sembrar-datos).
+"""
+import logging
+
+from sqlalchemy import insert
+
+from database import db
+from models import Escaneo, Host, Vulnerabilidad
+
+logger = logging.getLogger(__name__)
+
+TAMANO_LOTE = 5000
+
+
+def guardar_escaneo(sede_id, fecha_escaneo, resultados, tamano_lote=TAMANO_LOTE):
+    """
+    Crea el escaneo con los hosts y hallazgos de ``resultados`` (el formato
+    de analizar_vulnerabilidades). No hace commit: lo decide quien llama.
+    Devuelve (escaneo, total_hosts, total_vulnerabilidades).
+    """
+    escaneo = Escaneo(sede_id=sede_id, fecha_escaneo=fecha_escaneo)
+    db.session.add(escaneo)
+    db.session.flush()
+
+    hosts_detalle = resultados['hosts_detalle']
+    filas_hosts = [{
+        'ip': ip,
+        'nombre_host': host_data.get('nombre_host', ''),
+        'escaneo_id': escaneo.id,
+    } for ip, host_data in hosts_detalle.items()]
+
+    # Las IP son únicas dentro de un escaneo: sirven para recuperar cada id
+    ids_hosts = {}
+    for inicio in range(0, len(filas_hosts), tamano_lote):
+        insertados = db.session.execute(
+            insert(Host).returning(Host.id, Host.ip),
+            filas_hosts[inicio:inicio + tamano_lote]
+        )
+        ids_hosts.update((ip, host_id) for host_id, ip in insertados)
+
+    total_vulns = 0
+    lote = []
+    for ip, host_data in hosts_detalle.items():
+        for vuln_data in host_data.get('vulnerabilidades', []):
+            lote.append({
+                'host_id': ids_hosts[ip],
+                'nvt': vuln_data.get('nvt', ''),
+                'oid': vuln_data.get('oid', ''),
+                'nivel_amenaza': vuln_data.get('nivel_amenaza', ''),
+                'cvss': vuln_data.get('cvss', ''),
+                'puerto': vuln_data.get('puerto', ''),
+                'resumen': vuln_data.get('resumen', ''),
+                'impacto': vuln_data.get('impacto', ''),
+                'solucion': vuln_data.get('solucion', ''),
+                'metodo_deteccion': vuln_data.get('metodo_deteccion', ''),
+                'referencias': vuln_data.get('referencias', []),
+                'estado': 'ACTIVA',
+            })
+            if len(lote) >= tamano_lote:
+                db.session.execute(insert(Vulnerabilidad), lote)
+                total_vulns += len(lote)
+                lote = []
+    if lote:
+        db.session.execute(insert(Vulnerabilidad), lote)
+        total_vulns += len(lote)
+
+    logger.debug(f"Escaneo {escaneo.id} guardado: {len(filas_hosts)} hosts, {total_vulns} vulnerabilidades")
+    return escaneo, len(filas_hosts), total_vulns
@@ -3,6 +3,12 @@
 echo "========================================"
 echo "    SECTRACKER-PRO - Inicialización"
 echo "========================================"
+echo
+echo "Creando o actualizando el esquema de la base de datos..."
+echo
+
+flask --app app init-db || exit 1
+
 echo
 echo "Creando usuario administrador inicial..."
 echo
@@ -0,0 +1,178 @@
+"""
+Métricas en formato Prometheus, expuestas en GET /metrics.
+
+Requiere el paquete opcional prometheus-client; sin él las métricas no se
+registran y /metrics responde 503. Con gunicorn, gunicorn.conf.py define
+PROMETHEUS_MULTIPROC_DIR: cada worker escribe sus valores en archivos de
+ese directorio y /metrics devuelve la suma de todos los workers, sea cual
+sea el que atienda la petición. Si se define METRICS_TOKEN, /metrics exige
+la cabecera ``Authorization: Bearer <token>``.
+"""
+import os
+import hmac
+import time
+import logging
+
+from flask import Blueprint, Response, g, request, has_request_context
+from sqlalchemy import event
+
+from database import db
+from streaming import al_terminar_respuesta
+
+logger = logging.getLogger(__name__)
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, CONTENT_TYPE_LATEST
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+metricas_bp = Blueprint('metricas', __name__)
+
+# Segundos: desde respuestas cacheadas hasta informes técnicos de sedes grandes
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BUCKETS_CONSULTAS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+BUCKETS_TRABAJOS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# Etiqueta de las peticiones que no corresponden a ninguna ruta (404), para
+# que las URL inventadas no creen series nuevas
+ENDPOINT_DESCONOCIDO = 'desconocido'
+
+if prometheus_client is not None:
+    DURACION_PETICIONES = Histogram(
+        'sectracker_http_request_duration_seconds',
+        'Duración de las peticiones HTTP, hasta enviar el último byte',
+        ['endpoint', 'method'], buckets=BUCKETS_LATENCIA)
+    PETICIONES = Counter(
+        'sectracker_http_requests_total',
+        'Peticiones HTTP atendidas',
+        ['endpoint', 'method', 'status'])
+    PETICIONES_EN_CURSO = Gauge(
+        'sectracker_http_requests_in_progress',
+        'Peticiones HTTP en curso',
+        multiprocess_mode='livesum')
+    CONSULTAS_POR_PETICION = Histogram(
+        'sectracker_db_queries_per_request',
+        'Consultas SQL ejecutadas por petición',
+        ['endpoint'], buckets=BUCKETS_CONSULTAS)
+    TIEMPO_DB_POR_PETICION = Histogram(
+        'sectracker_db_time_per_request_seconds',
+        'Tiempo total en consultas SQL por petición',
+        ['endpoint'], buckets=BUCKETS_LATENCIA)
+    CONEXIONES_ABIERTAS = Gauge(
+        'sectracker_db_pool_connections_open',
+        'Conexiones a la base de datos abiertas por los pools',
+        multiprocess_mode='livesum')
+    CONEXIONES_EN_USO = Gauge(
+        'sectracker_db_pool_connections_in_use',
+        'Conexiones del pool prestadas en este momento',
+        multiprocess_mode='livesum')
+    DURACION_TRABAJOS = Histogram(
+        'sectracker_job_duration_seconds',
+        'Duración de las ingestas de reportes y la generación de informes',
+        ['tipo'], buckets=BUCKETS_TRABAJOS)
+
+
+def init_metricas(app):
+    """Registra /metrics, los hooks de cada petición y los eventos del motor SQL"""
+    app.register_blueprint(metricas_bp)
+    if prometheus_client is None:
+        logger.warning("prometheus-client no está instalado: /metrics desactivado (pip install prometheus-client)")
+        return
+
+    app.before_request(_iniciar_peticion)
+    app.after_request(_programar_registro)
+
+    with app.app_context():
+        motor = db.engine
+    event.listen(motor, 'before_cursor_execute', _antes_de_consulta)
+    event.listen(motor, 'after_cursor_execute', _despues_de_consulta)
+    # Eventos del pool: se conservan cuando engine.dispose() lo recrea tras el fork
+    event.listen(motor, 'connect', lambda *args: CONEXIONES_ABIERTAS.inc())
+    event.listen(motor, 'close', lambda *args: CONEXIONES_ABIERTAS.dec())
+    event.listen(motor, 'checkout', lambda *args: CONEXIONES_EN_USO.inc())
+    event.listen(motor, 'checkin', lambda *args: CONEXIONES_EN_USO.dec())
+
+
+def registrar_trabajo(tipo, segundos):
+    """Anota la duración de una ingesta o de un informe ('ingesta', 'informe_tecnico_pdf'...)"""
+    if prometheus_client is not None:
+        DURACION_TRABAJOS.labels(tipo=tipo).observe(segundos)
+
+
+def medir_generador(tipo, generador):
+    """Envuelve el generador de una respuesta en streaming y anota lo que tarda en consumirse"""
+    inicio = time.perf_counter()
+    try:
+        yield from generador
+    finally:
+        registrar_trabajo(tipo, time.perf_counter() - inicio)
+
+
+def marcar_worker_terminado(pid):
+    """Descarta los indicadores de un worker que ya no existe (hook child_exit de gunicorn)"""
+    if prometheus_client is not None and os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
+
+
+def _iniciar_peticion():
+    g.metricas = {'inicio': time.perf_counter(), 'consultas': 0, 'tiempo_db': 0.0}
+    PETICIONES_EN_CURSO.inc()
+
+
+def _programar_registro(respuesta):
+    datos = g.get('metricas')
+    if datos is not None:
+        endpoint = request.endpoint or ENDPOINT_DESCONOCIDO
+        metodo = request.method
+        estado = respuesta.status_code
+        # El servidor cierra la respuesta tras enviar el último byte: en las
+        # páginas en streaming eso incluye las consultas hechas al generarlas
+        al_terminar_respuesta(respuesta, lambda: _registrar_peticion(datos, endpoint, metodo, estado))
+    return respuesta
+
+
+def _registrar_peticion(datos, endpoint, metodo, estado):
+    PETICIONES_EN_CURSO.dec()
+    DURACION_PETICIONES.labels(endpoint=endpoint, method=metodo).observe(time.perf_counter() - datos['inicio'])
+    PETICIONES.labels(endpoint=endpoint, method=metodo, status=str(estado)).inc()
+    CONSULTAS_POR_PETICION.labels(endpoint=endpoint).observe(datos['consultas'])
+    TIEMPO_DB_POR_PETICION.labels(endpoint=endpoint).observe(datos['tiempo_db'])
+
+
+def _antes_de_consulta(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metricas_inicio_consulta', []).append(time.perf_counter())
+
+
+def _despues_de_consulta(conn, cursor, statement, parameters, context, executemany):
+    inicio = conn.info['metricas_inicio_consulta'].pop()
+    # Las consultas fuera de una petición (hilo del registro de actividad, CLI) no se atribuyen
+    if has_request_context() and 'metricas' in g:
+        g.metricas['consultas'] += 1
+        g.metricas['tiempo_db'] += time.perf_counter() - inicio
+
+
+def _token_valido():
+    token = os.environ.get('METRICS_TOKEN')
+    if not token:
+        return True
+    cabecera = request.headers.get('Authorization', '')
+    return cabecera.startswith('Bearer ') and hmac.compare_digest(cabecera[7:].encode(), token.encode())
+
+
+@metricas_bp.route('/metrics')
+def exponer_metricas():
+    """Métricas de todos los workers en el formato de texto de Prometheus"""
+    if prometheus_client is None:
+        return Response('prometheus-client no está instalado\n', status=503, mimetype='text/plain')
+    if not _token_valido():
+        return Response('Token no válido\n', status=401, mimetype='text/plain',
+                        headers={'WWW-Authenticate': 'Bearer'})
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registro = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registro)
+    else:
+        registro = prometheus_client.REGISTRY
+    return Response(prometheus_client.generate_latest(registro), content_type=CONTENT_TYPE_LATEST)
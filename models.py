@@ -1,3 +1,5 @@
+import hashlib
+import secrets
 from datetime import datetime
 from database import db
 from flask_login import UserMixin
@@ -24,6 +26,29 @@ class User(UserMixin, db.Model):
     def __repr__(self):
         return f'<User {self.username}>'
 
+class UsuarioSesion(UserMixin):
+    """Copia de solo lectura de los datos de un User para current_user.
+
+    Se guarda en la caché de respuestas, así que solo contiene valores
+    serializables a JSON. No es una instancia de la sesión de SQLAlchemy:
+    para modificar el usuario hay que cargar el User correspondiente.
+    """
+
+    CAMPOS = ('id', 'username', 'email', 'role', 'is_active')
+    # Atributo normal en lugar de la propiedad de UserMixin para poder asignarlo
+    is_active = True
+
+    def __init__(self, datos):
+        for campo in self.CAMPOS:
+            setattr(self, campo, datos.get(campo))
+
+    @classmethod
+    def datos_de(cls, user):
+        return {campo: getattr(user, campo) for campo in cls.CAMPOS}
+
+    def __repr__(self):
+        return f'<UsuarioSesion {self.username}>'
+
 class ActivityLog(db.Model):
     __tablename__ = 'activity_logs'
 
@@ -35,6 +60,31 @@ class ActivityLog(db.Model):
 
     user = db.relationship('User', backref='activities')
 
+class ApiToken(db.Model):
+    __tablename__ = 'api_tokens'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    nombre = db.Column(db.String(100), nullable=False)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    activo = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    user = db.relationship('User', backref=db.backref('api_tokens', cascade='all, delete-orphan'))
+
+    @staticmethod
+    def hash_token(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def generar(cls, user, nombre):
+        """Crea un token para el usuario; el valor en claro solo se devuelve aquí"""
+        token = secrets.token_urlsafe(32)
+        return cls(user=user, nombre=nombre, token_hash=cls.hash_token(token)), token
+
+    def __repr__(self):
+        return f'<ApiToken {self.nombre}>'
+
 class Sede(db.Model):
     __tablename__ = 'sedes'
 
@@ -51,7 +101,7 @@ class Escaneo(db.Model):
     __tablename__ = 'escaneos'
 
     id = db.Column(db.Integer, primary_key=True)
-    sede_id = db.Column(db.Integer, db.ForeignKey('sedes.id'), nullable=False)
+    sede_id = db.Column(db.Integer, db.ForeignKey('sedes.id'), nullable=False, index=True)
     fecha_escaneo = db.Column(db.Date, nullable=False)
     fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
     hosts = db.relationship('Host', backref='escaneo', lazy=True, cascade='all, delete-orphan')
@@ -66,7 +116,7 @@ class Host(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     ip = db.Column(db.String(50), nullable=False)
     nombre_host = db.Column(db.String(200))
-    escaneo_id = db.Column(db.Integer, db.ForeignKey('escaneos.id'), nullable=False)
+    escaneo_id = db.Column(db.Integer, db.ForeignKey('escaneos.id'), nullable=False, index=True)
     vulnerabilidades = db.relationship('Vulnerabilidad', backref='host', lazy=True, cascade='all, delete-orphan')
 
     def __repr__(self):
@@ -87,7 +137,7 @@ class Vulnerabilidad(db.Model):
     metodo_deteccion = db.Column(db.Text)
     referencias = db.Column(db.JSON)
     estado = db.Column(db.String(20), default='ACTIVA')
-    host_id = db.Column(db.Integer, db.ForeignKey('hosts.id'), nullable=False)
+    host_id = db.Column(db.Integer, db.ForeignKey('hosts.id'), nullable=False, index=True)
 
     def __repr__(self):
         return f'<Vulnerabilidad {self.nvt}>'
\ No newline at end of file
@@ -0,0 +1,161 @@
+"""
+Paquetes de informes por sede: el informe ejecutivo y el técnico en PDF de
+cada sede con datos en el rango, en un único ZIP.
+
+Cada informe es una tarea independiente que se reparte en un pool de
+procesos (uno por núcleo, o REPORT_BUNDLE_WORKERS), así que una revisión de
+decenas de sedes usa todos los núcleos en lugar de generar un informe tras
+otro. Los procesos del pool se crean con spawn e importan la aplicación
+una vez: no heredan las conexiones ni los hilos del proceso que los lanza.
+Cada proceso escribe su PDF en disco y solo devuelve la ruta; el proceso
+principal lo añade al ZIP en cuanto termina y lo borra, de modo que en
+disco solo conviven el ZIP y los informes en curso.
+
+Los informes que ya están en la caché de informes (artefactos) se copian
+sin generarlos y los nuevos se guardan en ella. El paquete se genera como
+trabajo en segundo plano desde /generar_paquete (ver trabajos.py) o con
+``flask generar-paquete``.
+"""
+import os
+import time
+import shutil
+import logging
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import click
+from flask.cli import with_appcontext
+from werkzeug.utils import secure_filename
+
+from database import db
+from models import Sede, Escaneo, Host, Vulnerabilidad
+from filtros import aplicar_filtros
+from artefactos import artefactos
+
+logger = logging.getLogger(__name__)
+
+PROCESOS = int(os.environ.get('REPORT_BUNDLE_WORKERS', 0)) or os.cpu_count() or 1
+TIPOS = ('ejecutivo', 'tecnico')
+
+
+def sedes_con_datos(filtros):
+    """Nombres de las sedes con hallazgos que cumplen los filtros, por orden alfabético"""
+    query = db.session.query(Sede.nombre).select_from(Vulnerabilidad).join(Host).join(Escaneo).join(Sede)
+    query = aplicar_filtros(query, **filtros)
+    return [nombre for nombre, in query.distinct().order_by(Sede.nombre)]
+
+
+def _iniciar_proceso():
+    """Inicializador del pool: cada proceso trabaja dentro de un contexto de la aplicación"""
+    from app import app
+
+    app.app_context().push()
+
+
+def _generar_informe(tipo, sede, filtros, ruta):
+    """
+    Escribe en ``ruta`` el informe ``tipo`` de una sede (en un proceso del
+    pool). Devuelve la ruta, o None si la sede no tiene datos para ese informe.
+    """
+    from app import vulnerabilidades_informe_tecnico, datos_informe_ejecutivo
+    from informes import generar_informe_ejecutivo, escribir_pdf_tecnico
+    from trabajos import hosts_de_informe
+
+    filtros_sede = dict(filtros, sede=sede)
+    clave = artefactos.clave(tipo, 'pdf', filtros_sede, sede=sede)
+    archivo = artefactos.abrir(clave)
+    if archivo is not None:
+        with archivo, open(ruta, 'wb') as salida:
+            shutil.copyfileobj(archivo, salida)
+        return ruta
+
+    try:
+        if tipo == 'ejecutivo':
+            datos = datos_informe_ejecutivo(**filtros_sede)
+            if datos is None:
+                return None
+            contenido = generar_informe_ejecutivo(datos).getvalue()
+            with open(ruta, 'wb') as salida:
+                salida.write(contenido)
+            artefactos.guardar(clave, contenido)
+        else:
+            vulnerabilidades = vulnerabilidades_informe_tecnico(**filtros_sede)
+            hosts = ((ip, host_data) for _, ip, host_data in hosts_de_informe(vulnerabilidades))
+            if escribir_pdf_tecnico(ruta, filtros_sede, hosts) == 0:
+                os.remove(ruta)
+                return None
+            artefactos.guardar_archivo(clave, ruta)
+        return ruta
+    finally:
+        # Sin transacción abierta entre una tarea y la siguiente
+        db.session.remove()
+
+
+def generar_paquete(destino, filtros, procesos=PROCESOS, al_avanzar=None):
+    """
+    Escribe en ``destino`` el ZIP con los informes de cada sede, con una
+    carpeta por sede. ``al_avanzar(hechos, total)`` se llama cada vez que
+    termina un informe. Devuelve el número de sedes y de informes.
+    """
+    sedes = sedes_con_datos(filtros)
+    tareas = [(f"{numero:03d}_{secure_filename(sede) or 'sede'}", sede, tipo)
+              for numero, sede in enumerate(sedes, start=1) for tipo in TIPOS]
+    temporal = f"{destino}.tmp"
+    directorio_partes = f"{destino}.partes"
+    os.makedirs(directorio_partes, exist_ok=True)
+    informes = 0
+    if al_avanzar:
+        al_avanzar(0, len(tareas))
+
+    try:
+        # Los PDF ya van comprimidos: deflate apenas reduce el ZIP y ocuparía
+        # al proceso principal mientras los del pool esperan
+        with zipfile.ZipFile(temporal, 'w', compression=zipfile.ZIP_STORED) as paquete, \
+                ProcessPoolExecutor(max_workers=max(1, min(procesos, len(tareas))),
+                                    mp_context=multiprocessing.get_context('spawn'),
+                                    initializer=_iniciar_proceso) as pool:
+            futuros = {
+                pool.submit(_generar_informe, tipo, sede, filtros,
+                            os.path.join(directorio_partes, f"{carpeta}_{tipo}.pdf")): (carpeta, sede, tipo)
+                for carpeta, sede, tipo in tareas
+            }
+            try:
+                for hechos, futuro in enumerate(as_completed(futuros), start=1):
+                    ruta = futuro.result()
+                    if ruta is not None:
+                        carpeta, sede, tipo = futuros[futuro]
+                        paquete.write(ruta, f"{carpeta}/informe_{tipo}.pdf")
+                        os.remove(ruta)
+                        informes += 1
+                        logger.debug(f"Informe {tipo} de {sede} añadido al paquete")
+                    if al_avanzar:
+                        al_avanzar(hechos, len(tareas))
+            except BaseException:
+                for futuro in futuros:
+                    futuro.cancel()
+                raise
+        os.replace(temporal, destino)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        shutil.rmtree(directorio_partes, ignore_errors=True)
+    return {'sedes': len(sedes), 'informes': informes}
+
+
+@click.command('generar-paquete')
+@click.option('--sede', default=None, help='Solo esta sede')
+@click.option('--fecha-inicio', default=None, help='Escaneos desde esta fecha (AAAA-MM-DD)')
+@click.option('--fecha-fin', default=None, help='Escaneos hasta esta fecha (AAAA-MM-DD)')
+@click.option('--riesgo', default=None, help='Solo hallazgos de este nivel de amenaza')
+@click.option('--salida', default='informes_por_sede.zip', show_default=True, help='Ruta del ZIP')
+@click.option('--procesos', default=PROCESOS, show_default=True, help='Informes generados a la vez')
+@with_appcontext
+def comando_generar_paquete(sede, fecha_inicio, fecha_fin, riesgo, salida, procesos):
+    """Genera un ZIP con los informes ejecutivo y técnico en PDF de cada sede"""
+    filtros = {'sede': sede, 'fecha_inicio': fecha_inicio, 'fecha_fin': fecha_fin, 'riesgo': riesgo}
+    inicio = time.perf_counter()
+    resumen = generar_paquete(salida, filtros, procesos=procesos,
+                              al_avanzar=lambda hechos, total: click.echo(f"{hechos}/{total} informes"))
+    click.echo(f"{salida}: {resumen['informes']} informes de {resumen['sedes']} sedes "
+               f"en {time.perf_counter() - inicio:.1f} s con {procesos} procesos")
@@ -0,0 +1,164 @@
+"""
+Perfilador de consultas SQL por petición, con detección de N+1.
+
+Se activa con PROFILER_SAMPLE_RATE (fracción de peticiones perfiladas, de 0
+a 1; 0 lo desactiva y no registra ningún hook). En cada petición muestreada
+se anotan las consultas, su duración y la línea del código de la aplicación
+que las lanzó, y:
+
+- se añade la cabecera Server-Timing (visible en las herramientas de
+  desarrollo del navegador) con el tiempo en base de datos y el total;
+- se registra un aviso cuando una misma forma de sentencia se repite
+  PROFILER_N1_THRESHOLD veces o más, con los puntos de llamada;
+- si la petición supera PROFILER_SLOW_REQUEST_MS se registran sus
+  consultas más lentas.
+
+Con un muestreo bajo (p. ej. 0.01) puede quedar activo en producción: las
+peticiones no muestreadas solo pagan una comprobación por consulta.
+"""
+import os
+import re
+import sys
+import time
+import random
+import logging
+from collections import defaultdict
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+from database import db
+from streaming import al_terminar_respuesta
+
+logger = logging.getLogger(__name__)
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+CONSULTAS_MAXIMAS = 10000      # por petición, para acotar la memoria
+CONSULTAS_EN_LOG = 5
+LARGO_SENTENCIA_LOG = 300
+
+# Listas de parámetros (IN (?, ?, ?) o IN (%(p_1)s, %(p_2)s)) que cambian de largo entre llamadas
+_LISTA_PARAMETROS = re.compile(r'\((?:\s*(?:\?|%\(\w+\)s|%s|\$\d+)\s*,?)+\)')
+_ESPACIOS = re.compile(r'\s+')
+
+
+def forma_sentencia(sentencia):
+    """Normaliza una sentencia para agrupar las que solo difieren en parámetros"""
+    return _LISTA_PARAMETROS.sub('(?)', _ESPACIOS.sub(' ', sentencia)).strip()
+
+
+def _punto_de_llamada():
+    """Primera línea del código de la aplicación (o de una plantilla) en la pila"""
+    marco = sys._getframe(2)
+    while marco is not None:
+        ruta = marco.f_code.co_filename
+        if ruta.startswith(RAIZ) and 'site-packages' not in ruta and ruta != __file__:
+            return f"{os.path.relpath(ruta, RAIZ)}:{marco.f_lineno} ({marco.f_code.co_name})"
+        marco = marco.f_back
+    return 'desconocido'
+
+
+class PerfilPeticion:
+    """Consultas de una petición muestreada"""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.consultas = []
+        self.descartadas = 0
+
+    def anotar(self, sentencia, duracion, sitio):
+        if len(self.consultas) >= CONSULTAS_MAXIMAS:
+            self.descartadas += 1
+            return
+        self.consultas.append((sentencia, duracion, sitio))
+
+    @property
+    def tiempo_db(self):
+        return sum(duracion for _, duracion, _ in self.consultas)
+
+    def repetidas(self, umbral):
+        """[(forma, veces, segundos, puntos de llamada)] de las formas con al menos ``umbral`` ejecuciones"""
+        grupos = defaultdict(list)
+        for sentencia, duracion, sitio in self.consultas:
+            grupos[forma_sentencia(sentencia)].append((duracion, sitio))
+        resultado = []
+        for forma, ejecuciones in grupos.items():
+            if len(ejecuciones) >= umbral:
+                sitios = sorted({sitio for _, sitio in ejecuciones})
+                resultado.append((forma, len(ejecuciones), sum(d for d, _ in ejecuciones), sitios))
+        return sorted(resultado, key=lambda r: r[1], reverse=True)
+
+    def mas_lentas(self, cantidad=CONSULTAS_EN_LOG):
+        return sorted(self.consultas, key=lambda c: c[1], reverse=True)[:cantidad]
+
+
+class Perfilador:
+    def __init__(self, app, muestreo, umbral_n1=5, lenta_ms=500):
+        self.muestreo = muestreo
+        self.umbral_n1 = umbral_n1
+        self.lenta = lenta_ms / 1000
+
+        app.before_request(self._iniciar)
+        app.after_request(self._terminar)
+        with app.app_context():
+            motor = db.engine
+        event.listen(motor, 'before_cursor_execute', self._antes_de_consulta)
+        event.listen(motor, 'after_cursor_execute', self._despues_de_consulta)
+
+    def _iniciar(self):
+        if random.random() < self.muestreo:
+            g.perfil_sql = PerfilPeticion()
+
+    def _antes_de_consulta(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and 'perfil_sql' in g:
+            conn.info.setdefault('perfil_inicio_consulta', []).append(time.perf_counter())
+
+    def _despues_de_consulta(self, conn, cursor, statement, parameters, context, executemany):
+        pendientes = conn.info.get('perfil_inicio_consulta')
+        if not pendientes or not has_request_context() or 'perfil_sql' not in g:
+            return
+        g.perfil_sql.anotar(statement, time.perf_counter() - pendientes.pop(), _punto_de_llamada())
+
+    def _terminar(self, respuesta):
+        perfil = g.get('perfil_sql')
+        if perfil is None:
+            return respuesta
+        # En las respuestas en streaming solo cubre lo hecho antes del primer byte
+        total = time.perf_counter() - perfil.inicio
+        respuesta.headers.add('Server-Timing',
+                              f'db;dur={perfil.tiempo_db * 1000:.1f};desc="{len(perfil.consultas)} consultas", '
+                              f'total;dur={total * 1000:.1f}')
+        descripcion = f"{request.method} {request.full_path.rstrip('?')}"
+        al_terminar_respuesta(respuesta, lambda: self._informar(perfil, descripcion))
+        return respuesta
+
+    def _informar(self, perfil, descripcion):
+        """Se ejecuta al cerrar la respuesta, con todas las consultas (también las del streaming)"""
+        try:
+            total = time.perf_counter() - perfil.inicio
+            for forma, veces, segundos, sitios in perfil.repetidas(self.umbral_n1):
+                logger.warning(f"Posible N+1 en {descripcion}: {veces} consultas iguales ({segundos * 1000:.1f} ms) "
+                               f"desde {', '.join(sitios[:3])}: {forma[:LARGO_SENTENCIA_LOG]}")
+            if total >= self.lenta:
+                lineas = [f"    {duracion * 1000:8.1f} ms  {sitio}  {' '.join(sentencia.split())[:LARGO_SENTENCIA_LOG]}"
+                          for sentencia, duracion, sitio in perfil.mas_lentas()]
+                omitidas = f", {perfil.descartadas} sin registrar" if perfil.descartadas else ""
+                logger.warning(f"Petición lenta {descripcion}: {total * 1000:.0f} ms, "
+                               f"{len(perfil.consultas)} consultas{omitidas} ({perfil.tiempo_db * 1000:.0f} ms en base de datos). "
+                               f"Consultas más lentas:\n" + '\n'.join(lineas))
+        except Exception as e:
+            logger.error(f"Error al informar el perfil de {descripcion}: {str(e)}", exc_info=True)
+
+
+def init_perfilador(app):
+    """Activa el perfilador si PROFILER_SAMPLE_RATE es mayor que 0"""
+    muestreo = float(os.environ.get('PROFILER_SAMPLE_RATE', 0))
+    if muestreo <= 0:
+        return None
+    logger.info(f"Perfilador SQL activo para el {muestreo:.1%} de las peticiones")
+    return Perfilador(
+        app,
+        muestreo=min(muestreo, 1.0),
+        umbral_n1=int(os.environ.get('PROFILER_N1_THRESHOLD', 5)),
+        lenta_ms=float(os.environ.get('PROFILER_SLOW_REQUEST_MS', 500)),
+    )
@@ -0,0 +1,221 @@
+"""
+Informes estándar generados de antemano, fuera de hora.
+
+El informe ejecutivo del último escaneo de cada sede y el de todas las sedes
+de los últimos DIAS_RECIENTES días se piden todos a la vez los lunes por la
+mañana y su generación se acumulaba en los workers. ``flask
+pregenerar-informes`` (para cron) o el programador interno
+(REPORT_SCHEDULE_TIME=HH:MM) los generan antes y los guardan en la caché de
+informes (artefactos). Un manifiesto JSON junto a esa caché anota de cada
+uno los filtros, la clave y la hora de generación: /informes los lista con
+esa hora y /informes/programados/<id> los descarga al instante. La clave
+incluye la versión de datos de la sede, como la de cualquier informe de la
+caché: si desde la generación hubo subidas, cambios de estado o borrados
+(la clave actual ya no coincide) o el archivo ya no está en la caché
+(expulsado por tamaño), se redirige a /generar_informe con los mismos
+filtros y se genera como cualquier otro.
+
+El programador interno es un hilo por proceso, creado con la primera
+petición (como el del registro de actividad), que a la hora indicada lanza
+``flask pregenerar-informes`` en un proceso aparte. Un cerrojo de archivo
+hace que de todos los workers solo lo lance uno.
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import logging
+import threading
+import subprocess
+from datetime import date, datetime, timedelta
+
+import click
+from flask import Blueprint, send_file, redirect, url_for, abort
+from flask.cli import with_appcontext
+from flask_login import login_required
+from sqlalchemy import func
+
+from database import db
+from models import Sede, Escaneo
+from artefactos import artefactos
+
+logger = logging.getLogger(__name__)
+
+programados_bp = Blueprint('programados', __name__)
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+DIAS_RECIENTES = 30
+HORA_PROGRAMADA = os.environ.get('REPORT_SCHEDULE_TIME', '')
+ARCHIVO_MANIFIESTO = os.path.join(os.path.dirname(artefactos.directorio), 'informes_programados.json')
+ARCHIVO_CERROJO = f"{ARCHIVO_MANIFIESTO}.lock"
+
+
+def definiciones():
+    """Informes estándar a generar, con los filtros resueltos a fechas concretas"""
+    informes = [{
+        'id': 'todas_las_sedes',
+        'titulo': f'Todas las sedes, últimos {DIAS_RECIENTES} días',
+        'filtros': {'sede': None, 'fecha_inicio': (date.today() - timedelta(days=DIAS_RECIENTES)).isoformat(),
+                    'fecha_fin': None, 'riesgo': None},
+    }]
+    ultimos = db.session.query(Sede.id, Sede.nombre, func.max(Escaneo.fecha_escaneo))\
+        .join(Escaneo).group_by(Sede.id, Sede.nombre).order_by(Sede.nombre)
+    for sede_id, nombre, fecha in ultimos:
+        fecha = fecha.isoformat() if hasattr(fecha, 'isoformat') else fecha
+        informes.append({
+            'id': f'sede_{sede_id}',
+            'titulo': f'{nombre}, último escaneo ({fecha})',
+            'filtros': {'sede': nombre, 'fecha_inicio': fecha, 'fecha_fin': fecha, 'riesgo': None},
+        })
+    return informes
+
+
+def leer_manifiesto():
+    """Informes generados en la última ejecución, o un manifiesto vacío"""
+    try:
+        with open(ARCHIVO_MANIFIESTO) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {'actualizado': None, 'informes': []}
+
+
+def _guardar_manifiesto(manifiesto):
+    temporal = f"{ARCHIVO_MANIFIESTO}.{os.getpid()}.tmp"
+    with open(temporal, 'w') as f:
+        json.dump(manifiesto, f)
+    os.replace(temporal, ARCHIVO_MANIFIESTO)
+
+
+def pregenerar():
+    """Genera los informes estándar en la caché de informes y actualiza el manifiesto"""
+    from app import datos_informe_ejecutivo
+    from informes import generar_informe_ejecutivo
+    from metricas import registrar_trabajo
+
+    if not artefactos.activa:
+        raise click.ClickException("La caché de informes está desactivada (REPORT_CACHE_MAX_MB=0)")
+    os.makedirs(os.path.dirname(ARCHIVO_MANIFIESTO), exist_ok=True)
+    inicio_total = time.perf_counter()
+    generados = []
+    for definicion in definiciones():
+        inicio = time.perf_counter()
+        filtros = definicion['filtros']
+        try:
+            datos = datos_informe_ejecutivo(**filtros)
+            if datos is None:
+                continue
+            contenido = generar_informe_ejecutivo(datos).getvalue()
+        except Exception as e:
+            logger.error(f"Error al pregenerar el informe {definicion['id']}: {str(e)}", exc_info=True)
+            continue
+        clave = artefactos.clave('ejecutivo', 'pdf', filtros, sede=filtros['sede'])
+        artefactos.guardar(clave, contenido)
+        generados.append(dict(definicion, clave=clave, tamano=len(contenido),
+                              generado=datetime.now().isoformat(timespec='seconds'),
+                              segundos=round(time.perf_counter() - inicio, 2)))
+
+    segundos = time.perf_counter() - inicio_total
+    _guardar_manifiesto({'actualizado': datetime.now().isoformat(timespec='seconds'), 'informes': generados})
+    registrar_trabajo('pregeneracion_informes', segundos)
+    logger.info(f"Informes programados: {len(generados)} generados en {segundos:.1f} s")
+    return generados
+
+
+@click.command('pregenerar-informes')
+@with_appcontext
+def comando_pregenerar_informes():
+    """Genera los informes ejecutivos estándar en la caché de informes (para cron)"""
+    for informe in pregenerar():
+        click.echo(f"{informe['titulo']}: {informe['tamano'] / 1024:.0f} KB en {informe['segundos']:.2f} s")
+
+
+def resumen_programados():
+    """Informes programados para la vista de informes, con la URL de descarga"""
+    manifiesto = leer_manifiesto()
+    return {
+        'actualizado': manifiesto['actualizado'],
+        'informes': [dict(informe, url=url_for('programados.descargar_programado', informe_id=informe['id']))
+                     for informe in manifiesto['informes']],
+    }
+
+
+@programados_bp.route('/informes/programados/<informe_id>')
+@login_required
+def descargar_programado(informe_id):
+    informe = next((i for i in leer_manifiesto()['informes'] if i['id'] == informe_id), None)
+    if informe is None:
+        abort(404)
+    filtros = informe['filtros']
+    vigente = informe['clave'] == artefactos.clave('ejecutivo', 'pdf', filtros, sede=filtros['sede'])
+    archivo = artefactos.abrir(informe['clave']) if vigente else None
+    if archivo is None:
+        # Datos modificados desde la generación o archivo expulsado de la
+        # caché: se genera en el momento con los mismos filtros
+        filtros = {k: v for k, v in informe['filtros'].items() if v}
+        return redirect(url_for('generar_informe', tipo='ejecutivo', formato='pdf', **filtros))
+    marca = informe['generado'].replace('-', '').replace(':', '').replace('T', '_')
+    return send_file(archivo, mimetype='application/pdf', as_attachment=True,
+                     download_name=f"informe_ejecutivo_{informe['id']}_{marca}.pdf")
+
+
+class Programador:
+    """Lanza la pregeneración cada día a la hora indicada desde un hilo de cada proceso"""
+
+    def __init__(self, hora, minuto):
+        self.hora = hora
+        self.minuto = minuto
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def asegurar_hilo(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Proceso nuevo (o worker recién creado con fork)
+                self._pid = os.getpid()
+                threading.Thread(target=self._esperar, name='informes-programados', daemon=True).start()
+
+    def _siguiente(self, ahora):
+        siguiente = ahora.replace(hour=self.hora, minute=self.minuto, second=0, microsecond=0)
+        return siguiente if siguiente > ahora else siguiente + timedelta(days=1)
+
+    def _esperar(self):
+        while True:
+            turno = self._siguiente(datetime.now())
+            time.sleep(max((turno - datetime.now()).total_seconds(), 0))
+            try:
+                self._lanzar(turno)
+            except Exception as e:
+                logger.error(f"Error al lanzar los informes programados: {str(e)}", exc_info=True)
+
+    def _lanzar(self, turno):
+        os.makedirs(os.path.dirname(ARCHIVO_CERROJO), exist_ok=True)
+        with open(ARCHIVO_CERROJO, 'w') as cerrojo:
+            try:
+                fcntl.flock(cerrojo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # otro worker ya los está generando
+            actualizado = leer_manifiesto()['actualizado']
+            if actualizado and actualizado >= turno.isoformat(timespec='seconds'):
+                return  # otro worker ya los generó en este turno
+            logger.info("Lanzando la generación de los informes programados")
+            subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'pregenerar-informes'],
+                           cwd=RAIZ, stdin=subprocess.DEVNULL)
+
+
+def init_programados(app):
+    """Registra la descarga y, con REPORT_SCHEDULE_TIME, el programador interno"""
+    app.register_blueprint(programados_bp)
+    app.cli.add_command(comando_pregenerar_informes)
+    if not HORA_PROGRAMADA:
+        return
+    try:
+        hora, minuto = (int(parte) for parte in HORA_PROGRAMADA.split(':'))
+        datetime.now().replace(hour=hora, minute=minuto)
+    except ValueError:
+        logger.warning(f"REPORT_SCHEDULE_TIME no válido ({HORA_PROGRAMADA}), se esperaba HH:MM: programador desactivado")
+        return
+    programador = Programador(hora, minuto)
+    app.before_request(programador.asegurar_hilo)
@@ -0,0 +1,103 @@
+import logging
+from flask import current_app, stream_with_context, get_flashed_messages
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Número de fragmentos de Jinja que se agrupan en cada escritura al socket
+FRAGMENTOS_POR_ENVIO = 64
+
+
+class ResultadosEnStreaming:
+    """Iterable de un solo uso sobre un cursor del servidor.
+
+    Se evalúa como verdadero si tiene al menos un elemento leyendo solo ese
+    primero, así las plantillas pueden seguir usando ``{% if resultados %}``
+    sin cargar todos los resultados en memoria. No admite ``|length``.
+    """
+
+    def __init__(self, iterable):
+        self._iterador = iter(iterable)
+        self._pendientes = []
+        self._agotado = False
+
+    def __bool__(self):
+        if not self._pendientes and not self._agotado:
+            for elemento in self._iterador:
+                self._pendientes.append(elemento)
+                break
+            else:
+                self._agotado = True
+        return bool(self._pendientes)
+
+    def __iter__(self):
+        while self._pendientes:
+            yield self._pendientes.pop(0)
+        yield from self._iterador
+
+
+def al_terminar_respuesta(respuesta, funcion):
+    """Ejecuta ``funcion`` cuando el servidor termina de enviar la respuesta.
+
+    Las respuestas de send_file (direct_passthrough) llegan al servidor sin
+    el close() de Werkzeug que dispara call_on_close; en ellas se ejecuta ya,
+    porque el cuerpo está generado y solo queda copiarlo al socket.
+    """
+    if respuesta.direct_passthrough:
+        funcion()
+    else:
+        respuesta.call_on_close(funcion)
+
+
+def respuesta_en_streaming(generador, **kwargs):
+    """Response con stream_with_context que conserva la sesión de la vista.
+
+    Desde Flask 3.1 el contexto de la petición se cierra al volver la vista
+    y se vuelve a abrir al leer el primer fragmento. Flask-SQLAlchemy cierra
+    la sesión en ese primer cierre, y las consultas creadas en la vista
+    seguirían en una sesión retirada del registro: su conexión no vuelve al
+    pool y, con un cursor del servidor de PostgreSQL, la transacción se
+    cerraría a mitad de lectura. Por eso la sesión se aparta del registro
+    mientras termina la vista, se restaura al empezar el streaming y se
+    cierra cuando el servidor termina de enviar la respuesta.
+    """
+    sesion = db.session()
+    db.session.registry.clear()
+
+    def generar():
+        db.session.registry.set(sesion)
+        yield from generador
+
+    respuesta = current_app.response_class(stream_with_context(generar()), **kwargs)
+    # También si el cliente se desconecta antes de recibir el primer fragmento
+    respuesta.call_on_close(sesion.close)
+    return respuesta
+
+
+def renderizar_en_streaming(plantilla, **contexto):
+    """Equivalente a render_template que envía el HTML a medida que se genera.
+
+    La cabecera de la página sale antes de ejecutar las consultas que
+    alimentan la plantilla, y la memoria del worker queda acotada al lote
+    del cursor en lugar de al tamaño de la página completa.
+    """
+    app = current_app._get_current_object()
+    # Los mensajes flash se sacan de la sesión ahora: la cookie de sesión se
+    # escribe antes del primer fragmento y, si la plantilla los leyera durante
+    # el streaming, se mostrarían pero seguirían en la sesión para la
+    # siguiente página. Flask los guarda en la petición y la plantilla
+    # recibe los mismos al llamar a get_flashed_messages().
+    get_flashed_messages(with_categories=True)
+    app.update_template_context(contexto)
+    flujo = app.jinja_env.get_template(plantilla).stream(contexto)
+    flujo.enable_buffering(FRAGMENTOS_POR_ENVIO)
+
+    def generar():
+        try:
+            yield from flujo
+        except Exception as e:
+            # Las cabeceras ya se enviaron: solo queda registrar y cortar la página
+            logger.error(f"Error al generar {plantilla} en streaming: {str(e)}", exc_info=True)
+
+    return respuesta_en_streaming(generar(), mimetype='text/html')
@@ -0,0 +1,48 @@
+"""
+Páginas enviadas en streaming (streaming.py).
+
+Se ejecutan contra una base SQLite temporal:
+    python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, RAIZ)
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{tempfile.mkdtemp()}/pruebas.db")
+os.environ.setdefault('CACHE_BACKEND', 'none')
+
+from app import app  # noqa: E402
+from database import db, crear_esquema  # noqa: E402
+from models import User  # noqa: E402
+
+
+@pytest.fixture
+def cliente():
+    app.config['TESTING'] = True
+    with app.app_context():
+        crear_esquema()
+        if User.query.filter_by(username='prueba').first() is None:
+            usuario = User(username='prueba', email='prueba@example.com', role='admin')
+            usuario.set_password('clave')
+            db.session.add(usuario)
+            db.session.commit()
+    cliente = app.test_client()
+    cliente.post('/login', data={'username': 'prueba', 'password': 'clave'})
+    return cliente
+
+
+@pytest.mark.parametrize('pagina', ['/hosts', '/vulnerabilidades'])
+def test_flash_se_consume_en_pagina_en_streaming(cliente, pagina):
+    with cliente.session_transaction() as sesion:
+        sesion['_flashes'] = [('warning', 'Aviso de prueba')]
+
+    respuesta = cliente.get(pagina)
+    assert 'Aviso de prueba' in respuesta.get_data(as_text=True)
+
+    with cliente.session_transaction() as sesion:
+        assert '_flashes' not in sesion
+    assert 'Aviso de prueba' not in cliente.get('/dashboard').get_data(as_text=True)
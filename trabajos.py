@@ -0,0 +1,349 @@
+"""
+Informes técnicos en PDF y paquetes de informes por sede generados en
+segundo plano.
+
+Un informe técnico de miles de hosts tarda minutos, así que no se genera en
+la petición: /generar_informe/tecnico/pdf crea un trabajo y lanza
+``flask ejecutar-trabajo <id>`` en un proceso aparte, que no ocupa el worker
+de gunicorn ni hereda su memoria, y sigue aunque el worker se recicle. Ese
+proceso lee los hallazgos por lotes, escribe el PDF por partes (ver
+informes.escribir_pdf_tecnico) en REPORT_JOBS_DIR, dentro del volumen
+./data, y guarda el estado del trabajo en un JSON junto al PDF, que
+cualquier worker puede leer. Al terminar anota la duración y el pico de
+memoria (RSS) del proceso.
+
+Con ``por_sede`` se genera un PDF por sede y al final se unen en uno; los
+PDF de cada sede también se pueden descargar. Los trabajos de tipo
+``paquete`` generan en cambio el ZIP con los informes ejecutivo y técnico
+de cada sede (ver paquetes.py); su progreso se cuenta en informes, no en
+hosts.
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import shutil
+import logging
+import resource
+import threading
+import subprocess
+from itertools import groupby
+from datetime import datetime, timedelta
+
+import click
+from flask import Blueprint, jsonify, send_file, url_for, abort
+from flask.cli import with_appcontext
+from flask_login import login_required, current_user
+from sqlalchemy import func
+
+from models import Host
+from artefactos import artefactos
+
+logger = logging.getLogger(__name__)
+
+trabajos_bp = Blueprint('trabajos', __name__)
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+DIRECTORIO_TRABAJOS = os.environ.get('REPORT_JOBS_DIR', os.path.join(RAIZ, 'data', 'informes'))
+MAXIMO_EN_CURSO = int(os.environ.get('REPORT_JOBS_MAX_RUNNING', 2))
+DIAS_RETENCION = int(os.environ.get('REPORT_JOBS_RETENTION_DAYS', 7))
+TRABAJOS_LISTADOS = 10
+
+PENDIENTE, EN_CURSO, TERMINADO, ERROR = 'pendiente', 'en_curso', 'terminado', 'error'
+TECNICO, PAQUETE = 'tecnico', 'paquete'
+ARCHIVO_INFORME = 'informe_tecnico.pdf'
+ARCHIVO_PAQUETE = 'informes_por_sede.zip'
+ETIQUETAS = {TECNICO: 'Informe técnico', PAQUETE: 'Paquete de informes'}
+_ID_VALIDO = re.compile(r'^[0-9a-f]{32}$')
+
+
+class DemasiadosTrabajos(Exception):
+    """Ya hay MAXIMO_EN_CURSO informes generándose"""
+
+
+def _directorio(trabajo_id):
+    return os.path.join(DIRECTORIO_TRABAJOS, trabajo_id)
+
+
+def _guardar(trabajo):
+    """Escribe el estado de forma atómica: quien lo lea nunca ve un JSON a medias"""
+    ruta = os.path.join(_directorio(trabajo['id']), 'estado.json')
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, 'w') as f:
+        json.dump(trabajo, f)
+    os.replace(temporal, ruta)
+
+
+def _proceso_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def leer_trabajo(trabajo_id):
+    """Estado del trabajo, o None si no existe"""
+    if not _ID_VALIDO.match(trabajo_id or ''):
+        return None
+    try:
+        with open(os.path.join(_directorio(trabajo_id), 'estado.json')) as f:
+            trabajo = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    # El proceso murió sin anotar el final (p. ej. reinicio del contenedor)
+    if trabajo['estado'] == EN_CURSO and not _proceso_vivo(trabajo['pid']):
+        trabajo.update(estado=ERROR, error='El proceso de generación se interrumpió')
+    return trabajo
+
+
+def listar_trabajos(usuario_id=None, limite=TRABAJOS_LISTADOS):
+    """Trabajos más recientes primero, opcionalmente solo los de un usuario"""
+    if not os.path.isdir(DIRECTORIO_TRABAJOS):
+        return []
+    trabajos = []
+    for trabajo_id in os.listdir(DIRECTORIO_TRABAJOS):
+        trabajo = leer_trabajo(trabajo_id)
+        if trabajo and (usuario_id is None or trabajo['usuario_id'] == usuario_id):
+            trabajos.append(trabajo)
+    trabajos.sort(key=lambda t: t['creado'], reverse=True)
+    return trabajos[:limite] if limite else trabajos
+
+
+def _limpiar_antiguos():
+    limite = (datetime.now() - timedelta(days=DIAS_RETENCION)).isoformat(timespec='seconds')
+    for trabajo in listar_trabajos(limite=None):
+        if trabajo['estado'] in (TERMINADO, ERROR) and trabajo['creado'] < limite:
+            shutil.rmtree(_directorio(trabajo['id']), ignore_errors=True)
+            logger.info(f"Informe {trabajo['id']} eliminado por antigüedad")
+
+
+def crear_trabajo(usuario_id, filtros, por_sede=False, clave_cache=None, tipo=TECNICO):
+    """
+    Registra un informe técnico en PDF (o un paquete, con ``tipo=PAQUETE``)
+    y lanza el proceso que lo genera.
+    Si el usuario ya tiene uno igual sin terminar, devuelve ese. Con
+    ``clave_cache`` el PDF terminado se guarda también en la caché de
+    informes (artefactos), calculada antes de leer los datos.
+    """
+    _limpiar_antiguos()
+    activos = [t for t in listar_trabajos(limite=None) if t['estado'] in (PENDIENTE, EN_CURSO)]
+    for trabajo in activos:
+        if (trabajo['usuario_id'] == usuario_id and trabajo['filtros'] == filtros
+                and trabajo['por_sede'] == por_sede and trabajo.get('tipo', TECNICO) == tipo):
+            return trabajo
+    if len(activos) >= MAXIMO_EN_CURSO:
+        raise DemasiadosTrabajos()
+
+    trabajo = {
+        'id': uuid.uuid4().hex,
+        'tipo': tipo,
+        'usuario_id': usuario_id,
+        'filtros': filtros,
+        'por_sede': por_sede,
+        'clave_cache': clave_cache,
+        'estado': PENDIENTE,
+        'creado': datetime.now().isoformat(timespec='seconds'),
+        'pid': None,
+        'hosts_total': None,
+        'hosts_hechos': 0,
+        'archivos': [],
+        'segundos': None,
+        'rss_maximo_mb': None,
+        'error': None,
+    }
+    os.makedirs(_directorio(trabajo['id']))
+    _guardar(trabajo)
+
+    proceso = subprocess.Popen(
+        [sys.executable, '-m', 'flask', '--app', 'app', 'ejecutar-trabajo', trabajo['id']],
+        cwd=RAIZ, stdin=subprocess.DEVNULL, start_new_session=True
+    )
+    trabajo['pid'] = proceso.pid
+    _guardar(trabajo)
+    threading.Thread(target=_esperar, args=(proceso, trabajo['id']), name=f'informe-{tipo}', daemon=True).start()
+    logger.info(f"{ETIQUETAS[tipo]} {trabajo['id']} lanzado (pid {proceso.pid}) con filtros {filtros}")
+    return trabajo
+
+
+def _esperar(proceso, trabajo_id):
+    """Recoge el proceso al terminar y anota el error si murió sin hacerlo él"""
+    codigo = proceso.wait()
+    if codigo == 0:
+        return
+    trabajo = leer_trabajo(trabajo_id)
+    if trabajo and trabajo['estado'] in (PENDIENTE, EN_CURSO):
+        trabajo.update(estado=ERROR, error=f'El proceso de generación terminó con código {codigo}')
+        _guardar(trabajo)
+
+
+def hosts_de_informe(vulnerabilidades):
+    """(sede, ip, host_data) a partir de las filas ordenadas por host"""
+    for (sede, ip), filas in groupby(vulnerabilidades, key=lambda v: (v.host.escaneo.sede.nombre, v.host.ip)):
+        filas = list(filas)
+        yield sede, ip, {
+            'nombre_host': filas[0].host.nombre_host,
+            'vulnerabilidades': [{
+                'nvt': v.nvt,
+                'nivel_amenaza': v.nivel_amenaza,
+                'cvss': v.cvss,
+                'puerto': v.puerto,
+                'estado': v.estado,
+                'resumen': v.resumen,
+                'impacto': v.impacto,
+                'solucion': v.solucion,
+                'referencias': v.referencias,
+            } for v in filas]
+        }
+
+
+def _generar_tecnico(trabajo, directorio, avanzar):
+    """Escribe el informe técnico del trabajo (y los de cada sede) y devuelve la ruta del PDF completo"""
+    from app import vulnerabilidades_informe_tecnico
+    from informes import escribir_pdf_tecnico, unir_pdfs
+
+    filtros = trabajo['filtros']
+    vulnerabilidades = vulnerabilidades_informe_tecnico(por_sede=trabajo['por_sede'], **filtros)
+    trabajo['hosts_total'] = vulnerabilidades.order_by(None)\
+        .with_entities(func.count(func.distinct(Host.id))).scalar()
+    _guardar(trabajo)
+
+    destino = os.path.join(directorio, ARCHIVO_INFORME)
+    hosts = hosts_de_informe(vulnerabilidades)
+    if trabajo['por_sede']:
+        hechos = 0
+        for numero, (sede, hosts_sede) in enumerate(groupby(hosts, key=lambda h: h[0]), start=1):
+            nombre = f"sede_{numero:03d}.pdf"
+            hechos += escribir_pdf_tecnico(
+                os.path.join(directorio, nombre), dict(filtros, sede=sede),
+                ((ip, host_data) for _, ip, host_data in hosts_sede),
+                al_avanzar=lambda n, base=hechos: avanzar(base + n)
+            )
+            trabajo['archivos'].append({'nombre': nombre, 'etiqueta': sede})
+        unir_pdfs([os.path.join(directorio, a['nombre']) for a in trabajo['archivos']], destino)
+    else:
+        escribir_pdf_tecnico(destino, filtros, ((ip, host_data) for _, ip, host_data in hosts),
+                             al_avanzar=avanzar)
+    trabajo['archivos'].insert(0, {'nombre': ARCHIVO_INFORME, 'etiqueta': 'Informe completo'})
+    return destino
+
+
+def _generar_paquete(trabajo, directorio, avanzar):
+    """Escribe el ZIP con los informes de cada sede y devuelve su ruta"""
+    from paquetes import generar_paquete
+
+    def avanzar_paquete(hechos, total):
+        trabajo['hosts_total'] = total
+        avanzar(hechos)
+
+    destino = os.path.join(directorio, ARCHIVO_PAQUETE)
+    resumen = generar_paquete(destino, trabajo['filtros'], al_avanzar=avanzar_paquete)
+    trabajo['archivos'].append({'nombre': ARCHIVO_PAQUETE,
+                                'etiqueta': f"ZIP ({resumen['informes']} informes de {resumen['sedes']} sedes)"})
+    return destino
+
+
+def ejecutar_trabajo(trabajo_id):
+    """Genera el PDF o el paquete del trabajo; se ejecuta en el proceso lanzado por crear_trabajo"""
+    from metricas import registrar_trabajo
+
+    trabajo = leer_trabajo(trabajo_id)
+    if trabajo is None:
+        raise click.ClickException(f"No existe el trabajo {trabajo_id}")
+    tipo = trabajo.get('tipo', TECNICO)
+    trabajo.update(estado=EN_CURSO, pid=os.getpid())
+    _guardar(trabajo)
+    inicio = time.perf_counter()
+    directorio = _directorio(trabajo_id)
+
+    def avanzar(hechos):
+        trabajo['hosts_hechos'] = hechos
+        _guardar(trabajo)
+
+    try:
+        if tipo == PAQUETE:
+            destino = _generar_paquete(trabajo, directorio, avanzar)
+        else:
+            destino = _generar_tecnico(trabajo, directorio, avanzar)
+        for archivo in trabajo['archivos']:
+            archivo['tamano'] = os.path.getsize(os.path.join(directorio, archivo['nombre']))
+
+        segundos = time.perf_counter() - inicio
+        # ru_maxrss está en KB en Linux; en los paquetes cuenta el mayor de los procesos del pool
+        rss_maximo_mb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+        trabajo.update(estado=TERMINADO, terminado=datetime.now().isoformat(timespec='seconds'),
+                       segundos=round(segundos, 1), rss_maximo_mb=round(rss_maximo_mb, 1))
+        _guardar(trabajo)
+        artefactos.guardar_archivo(trabajo['clave_cache'], destino)
+        registrar_trabajo('paquete_informes' if tipo == PAQUETE else 'informe_tecnico_pdf', segundos)
+        logger.info(f"{ETIQUETAS[tipo]} {trabajo_id} terminado: {trabajo['hosts_hechos']} "
+                    f"{'informes' if tipo == PAQUETE else 'hosts'} en {segundos:.1f} s, "
+                    f"pico de memoria {rss_maximo_mb:.0f} MB")
+    except Exception as e:
+        logger.error(f"Error al generar el trabajo {trabajo_id} ({tipo}): {str(e)}", exc_info=True)
+        trabajo.update(estado=ERROR, error='Error al generar el informe')
+        _guardar(trabajo)
+        raise
+
+
+@click.command('ejecutar-trabajo')
+@click.argument('trabajo_id')
+@with_appcontext
+def comando_ejecutar_trabajo(trabajo_id):
+    """Genera un informe técnico en PDF o un paquete registrado con crear_trabajo"""
+    ejecutar_trabajo(trabajo_id)
+
+
+def _trabajo_visible(trabajo_id):
+    trabajo = leer_trabajo(trabajo_id)
+    if trabajo is None or (trabajo['usuario_id'] != current_user.id and current_user.role != 'admin'):
+        abort(404)
+    return trabajo
+
+
+def resumen_trabajo(trabajo):
+    """Estado del trabajo para la vista de informes, con las URL de descarga"""
+    return {
+        'id': trabajo['id'],
+        'tipo': trabajo.get('tipo', TECNICO),
+        'unidad': 'informes' if trabajo.get('tipo') == PAQUETE else 'hosts',
+        'estado': trabajo['estado'],
+        'creado': trabajo['creado'],
+        'filtros': trabajo['filtros'],
+        'por_sede': trabajo['por_sede'],
+        'hosts_total': trabajo['hosts_total'],
+        'hosts_hechos': trabajo['hosts_hechos'],
+        'segundos': trabajo['segundos'],
+        'rss_maximo_mb': trabajo['rss_maximo_mb'],
+        'error': trabajo['error'],
+        'archivos': [dict(archivo, url=url_for('trabajos.descargar_trabajo', trabajo_id=trabajo['id'],
+                                               archivo=archivo['nombre']))
+                     for archivo in trabajo['archivos']] if trabajo['estado'] == TERMINADO else [],
+    }
+
+
+@trabajos_bp.route('/informes/trabajos/<trabajo_id>')
+@login_required
+def estado_trabajo(trabajo_id):
+    """Estado de un informe en segundo plano (lo consulta la vista de informes)"""
+    return jsonify(resumen_trabajo(_trabajo_visible(trabajo_id)))
+
+
+@trabajos_bp.route('/informes/trabajos/<trabajo_id>/<archivo>')
+@login_required
+def descargar_trabajo(trabajo_id, archivo):
+    trabajo = _trabajo_visible(trabajo_id)
+    if trabajo['estado'] != TERMINADO or archivo not in {a['nombre'] for a in trabajo['archivos']}:
+        abort(404)
+    marca = trabajo['creado'].replace('-', '').replace(':', '').replace('T', '_')
+    if archivo == ARCHIVO_PAQUETE:
+        return send_file(os.path.join(_directorio(trabajo_id), archivo), mimetype='application/zip',
+                         as_attachment=True, download_name=f"informes_por_sede_{marca}.zip")
+    nombre = f"informe_tecnico_{marca}.pdf" if archivo == ARCHIVO_INFORME else f"informe_tecnico_{marca}_{archivo}"
+    return send_file(os.path.join(_directorio(trabajo_id), archivo), mimetype='application/pdf',
+                     as_attachment=True, download_name=nombre)